@@ -11,16 +11,13 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QTabWidget, QLabel, QLineEdit, QPushButton, QTextEdit, 
                              QFileDialog, QCheckBox, QListWidget, QListWidgetItem, 
-                             QSplitter, QProgressBar, QMessageBox, QScrollArea, QFrame)
+                             QSplitter, QProgressBar, QMessageBox, QScrollArea, QFrame, QComboBox)
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSize
 from PyQt6.QtGui import QPixmap, QIcon, QAction
 
-# Import backend services
-# 导入后端服务
+# Import backend config; services are imported on first use to keep startup fast
+# 导入后端配置；服务在首次使用时才导入，以加快启动
 try:
-    from agent.services.paper_manager import PaperManager
-    from agent.services.search_service import SearchService
-    from agent.services.image_search import ImageSearchService
     from agent.config import Config
 except ImportError as e:
     print(f"Error importing backend modules: {e}")
@@ -64,16 +61,19 @@ class MainWindow(QMainWindow):
 
     def get_paper_manager(self):
         if not self.paper_manager:
+            from agent.services.paper_manager import PaperManager
             self.paper_manager = PaperManager()
         return self.paper_manager
 
     def get_search_service(self):
         if not self.search_service:
+            from agent.services.search_service import SearchService
             self.search_service = SearchService()
         return self.search_service
 
     def get_image_service(self):
         if not self.image_service:
+            from agent.services.image_search import ImageSearchService
             self.image_service = ImageSearchService()
         return self.image_service
 
@@ -210,12 +210,41 @@ class MainWindow(QMainWindow):
         self.top_k_spin = QLineEdit("5") # Simple implementation # 简单实现
         self.top_k_spin.setFixedWidth(50)
         self.top_k_spin.setPlaceholderText("Top K")
+        # Snippet retrieval mode
+        # 片段检索模式
+        self.search_mode_combo = QComboBox()
+        self.search_mode_combo.addItem("语义", "dense")
+        self.search_mode_combo.addItem("混合 (BM25 + 语义)", "hybrid")
+        self.search_mode_combo.addItem("关键词预筛选", "prefilter")
+        self.file_by_chunks_cb = QCheckBox("按片段命中排序文件")
+        self.file_by_chunks_cb.setChecked(False)
         
         opts_layout.addWidget(self.return_snippets_cb)
         opts_layout.addWidget(QLabel("返回数量:"))
         opts_layout.addWidget(self.top_k_spin)
+        opts_layout.addWidget(QLabel("检索模式:"))
+        opts_layout.addWidget(self.search_mode_combo)
+        opts_layout.addWidget(self.file_by_chunks_cb)
         opts_layout.addStretch()
 
+        # Filters (evaluated inside the index)
+        # 过滤条件（在索引内部执行）
+        filter_layout = QHBoxLayout()
+        self.paper_topic_filter = QLineEdit()
+        self.paper_topic_filter.setPlaceholderText("主题 (逗号分隔)")
+        self.paper_filename_filter = QLineEdit()
+        self.paper_filename_filter.setPlaceholderText("文件名通配 (例如: *survey*)")
+        self.paper_pages_filter = QLineEdit()
+        self.paper_pages_filter.setPlaceholderText("页码 (例如: 3-7)")
+        self.paper_pages_filter.setFixedWidth(110)
+        self.paper_dir_filter = QLineEdit()
+        self.paper_dir_filter.setPlaceholderText("目录前缀")
+        filter_layout.addWidget(QLabel("过滤:"))
+        filter_layout.addWidget(self.paper_topic_filter)
+        filter_layout.addWidget(self.paper_filename_filter)
+        filter_layout.addWidget(self.paper_pages_filter)
+        filter_layout.addWidget(self.paper_dir_filter)
+
         # Results Area
         # 结果区域
         self.paper_results_list = QListWidget()
@@ -231,6 +260,7 @@ class MainWindow(QMainWindow):
 
         layout.addLayout(search_layout)
         layout.addLayout(opts_layout)
+        layout.addLayout(filter_layout)
         layout.addWidget(splitter)
 
         widget.setLayout(layout)
@@ -247,14 +277,25 @@ class MainWindow(QMainWindow):
             top_k = 5
         
         return_snippets = self.return_snippets_cb.isChecked()
+        mode = self.search_mode_combo.currentData()
+        file_ranking = "chunks" if self.file_by_chunks_cb.isChecked() else None
+        topic_text = self.paper_topic_filter.text().strip()
+        filter_params = {
+            "topic": [t.strip() for t in topic_text.split(",") if t.strip()] if topic_text else None,
+            "filename": self.paper_filename_filter.text().strip() or None,
+            "pages": self.paper_pages_filter.text().strip() or None,
+            "path_prefix": self.paper_dir_filter.text().strip() or None,
+        }
         
         self.status_bar.showMessage("正在搜索...")
         self.paper_results_list.clear()
         self.paper_details_text.clear()
 
         def task():
+            from agent.index.filters import SearchFilter
             ss = self.get_search_service()
-            return ss.search_paper(query, top_k=top_k, return_snippets=return_snippets, return_files=True)
+            return ss.search_paper(query, top_k=top_k, return_snippets=return_snippets, return_files=True, mode=mode,
+                                  file_ranking=file_ranking, search_filter=SearchFilter.from_params(**filter_params))
 
         self.worker_search = WorkerThread(task)
         self.worker_search.finished.connect(self.on_search_paper_finished)
@@ -286,7 +327,8 @@ class MainWindow(QMainWindow):
                 for i, doc_id in enumerate(snippets["ids"][0]):
                     text = snippets["documents"][0][i]
                     meta = snippets["metadatas"][0][i]
-                    self.paper_details_text.append(f"[片段] {meta.get('filename')} (第 {meta.get('page_id')} 页):\n{text[:200]}...\n")
+                    pages = meta.get('page_id') if meta.get('page_end', meta.get('page_id')) == meta.get('page_id') else f"{meta.get('page_id')}-{meta.get('page_end')}"
+                    self.paper_details_text.append(f"[片段] {meta.get('filename')} (第 {pages} 页):\n{text[:200]}...\n")
 
     def show_paper_details(self, item):
         meta = item.data(Qt.ItemDataRole.UserRole)
@@ -372,10 +414,9 @@ class MainWindow(QMainWindow):
 
                 iss = self.get_image_service()
                 
-                # Index the directory containing the image
-                # 索引包含图片的目录
-                parent_dir = str(Path(final_path).parent)
-                iss.index_images(parent_dir) 
+                # Index only this image; unchanged files in its directory are not re-embedded
+                # 仅索引该图片；同目录下未变化的文件不会被重新嵌入
+                iss.index_image_files([final_path])
                 
                 return "Success"
             except Exception as e:
@@ -407,6 +448,17 @@ class MainWindow(QMainWindow):
         search_layout.addWidget(self.img_query_input)
         search_layout.addWidget(search_btn)
 
+        # Filters
+        # 过滤条件
+        filter_layout = QHBoxLayout()
+        self.img_filename_filter = QLineEdit()
+        self.img_filename_filter.setPlaceholderText("文件名通配 (例如: *.png)")
+        self.img_dir_filter = QLineEdit()
+        self.img_dir_filter.setPlaceholderText("目录前缀")
+        filter_layout.addWidget(QLabel("过滤:"))
+        filter_layout.addWidget(self.img_filename_filter)
+        filter_layout.addWidget(self.img_dir_filter)
+
         # Results Area
         # 结果区域
         self.img_scroll_area = QScrollArea()
@@ -416,6 +468,7 @@ class MainWindow(QMainWindow):
         self.img_scroll_area.setWidget(self.img_results_container)
 
         layout.addLayout(search_layout)
+        layout.addLayout(filter_layout)
         layout.addWidget(self.img_scroll_area)
 
         widget.setLayout(layout)
@@ -427,6 +480,8 @@ class MainWindow(QMainWindow):
             return
 
         self.status_bar.showMessage("正在搜索图片...")
+        filename = self.img_filename_filter.text().strip() or None
+        path_prefix = self.img_dir_filter.text().strip() or None
         
         # Clear previous results
         # 清除以前的结果
@@ -434,8 +489,9 @@ class MainWindow(QMainWindow):
             self.img_results_layout.itemAt(i).widget().setParent(None)
 
         def task():
+            from agent.index.filters import SearchFilter
             iss = self.get_image_service()
-            return iss.search_image(query, top_k=5)
+            return iss.search_image(query, top_k=5, search_filter=SearchFilter.from_params(filename=filename, path_prefix=path_prefix))
 
         self.worker_img = WorkerThread(task)
         self.worker_img.finished.connect(self.on_search_image_finished)
@@ -1,10 +1,23 @@
-import torch
 from pathlib import Path
 import os
 
 # Set Hugging Face mirror for China access
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
 
+class _LazyDevice:
+    """
+    Resolves the compute device on first access, so importing the config does not import torch.
+    首次访问时才确定计算设备，使导入配置时不必导入 torch。
+    """
+    def __init__(self):
+        self._device = None
+
+    def __get__(self, obj, owner):
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+
 class Config:
     # Paths
     # 项目根目录
@@ -19,11 +32,19 @@ class Config:
     INDEX_DIR = DATA_DIR / "index"
     # 缓存目录
     CACHE_DIR = DATA_DIR / "cache"
+    # 嵌入缓存目录
+    EMBEDDING_CACHE_DIR = CACHE_DIR / "embeddings"
+    # 批量整理溢出文件目录
+    SPILL_DIR = CACHE_DIR / "spill"
 
     # Models
     # 文本嵌入模型名称
     # 升级为支持多语言且性能更强的模型 (768维)
     TEXT_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+    # 文本嵌入的批大小 (文本按 token 长度排序后按此大小分批，减少填充)
+    TEXT_EMBED_BATCH_SIZE = 64
+    # 批量整理时跨文档累积的片段数，达到后统一嵌入
+    TEXT_EMBED_ACCUMULATE = 1024
     # OpenCLIP model config
     # 图像嵌入模型配置 (CLIP)
     # 升级为 Huge 多语言模型 (XLM-Roberta) 以支持中文并提供更高精度 (1024维)
@@ -32,8 +53,20 @@ class Config:
     IMAGE_MODEL_PRETRAINED = "frozen_laion5b_s13b_b90k"
 
     # Device
-    # 设备选择: 如果有 CUDA 则使用 CUDA，否则使用 CPU
-    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    # 设备选择: 如果有 CUDA 则使用 CUDA，否则使用 CPU (首次访问时检测)
+    DEVICE = _LazyDevice()
+
+    # CPU inference
+    # 嵌入模型的 CPU 推理后端: "torch" (float32) 或 "int8" (线性层动态 int8 量化，仅在 CPU 上生效)
+    EMBEDDER_BACKEND = "torch"
+    # PyTorch CPU 推理线程数 (None 表示使用 PyTorch 默认值)
+    EMBEDDER_THREADS = None
+    # 转换后模型的缓存目录 (首次加载时转换并检查精度)
+    ACCELERATED_MODELS_DIR = CACHE_DIR / "accelerated"
+    # 转换后模型与 float 模型嵌入的最小余弦相似度，未达到时回退到 float 模型
+    EMBEDDER_MIN_COSINE = 0.98
+    # 共享的嵌入模型/向量数据库在引用计数归零后保留的秒数 (None 表示保持加载直至进程退出)
+    REGISTRY_IDLE_UNLOAD = None
 
     # Indexing
     # 文本分块大小
@@ -41,7 +74,87 @@ class Config:
     CHUNK_SIZE = 800
     # 文本分块重叠大小
     CHUNK_OVERLAP = 150
+    # 分块方式: "sentence" (按句子/段落边界并按 token 预算打包，可跨页) 或 "window" (旧的逐页字符滑窗，使用上面两项)
+    CHUNKER = "sentence"
+    # 每个分块的 token 预算 (文本模型最大长度 128 减去首尾两个特殊标记)
+    CHUNK_MAX_TOKENS = 126
+    # 相邻分块之间以完整句子延续的上下文 token 数
+    CHUNK_OVERLAP_TOKENS = 16
     
+    # 并行解析 PDF 的进程数 (0 表示在主进程中串行解析)
+    PDF_PARSE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+    # 批量整理时是否将文档记录溢出到磁盘 (两遍模式，内存峰值不随论文数量增长)
+    BATCH_SPILL = False
+
+    # Image ingestion pipeline
+    # 每批编码的图片数
+    IMAGE_BATCH_SIZE = 32
+    # 解码/预处理图片的进程数 (0 表示在主进程中串行处理)
+    IMAGE_DECODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+    # 预取的批次数上限 (限制排队中的已解码图片占用的内存)
+    IMAGE_PREFETCH_BATCHES = 2
+
+    # Embedding cache
+    # 是否启用持久化嵌入缓存 (按模型名与内容 sha256 寻址)
+    USE_EMBEDDING_CACHE = True
+    # 每个模型最多缓存的向量数 (超出后按 LRU 淘汰)
+    EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+    # 进程内查询嵌入 LRU 缓存的容量 (每个嵌入模型一份)
+    QUERY_CACHE_SIZE = 1024
+    # 论文检索结果缓存的容量 (索引写入后自动失效)
+    SEARCH_RESULT_CACHE_SIZE = 256
+
+    # Concurrent queries
+    # 是否将并发线程的查询嵌入合并为批量前向计算 (每个嵌入模型一个调度线程)
+    QUERY_BATCHING = True
+    # 收到第一个查询后等待更多并发查询的时间窗口 (毫秒)
+    QUERY_BATCH_WINDOW_MS = 5
+    # 每次合批前向计算的最大查询数
+    QUERY_BATCH_MAX = 64
+    # 等待嵌入的查询请求数上限 (队列满时提交方阻塞)
+    QUERY_QUEUE_SIZE = 1024
+    # 队列满时提交方最长等待秒数，超时抛出 TimeoutError
+    QUERY_SUBMIT_TIMEOUT = 30
+
+    # Vector backend
+    # 向量检索后端: "chroma" (HNSW + SQLite) 或 "memory" (内存映射矩阵上的精确暴力检索，适合数十万片段以内的库)
+    VECTOR_BACKEND = "chroma"
+    # memory 后端的向量存储类型: "float32" 或 "float16" (减半内存占用)
+    MATRIX_DTYPE = "float32"
+    # memory 后端每次矩阵乘法处理的行数 (限制临时内存)
+    MATRIX_SCAN_BLOCK = 65536
+    # memory 后端的量化方式: None (精确浮点扫描) 或 "int8" (扫描 int8 编码，内存约为 float32 的 1/4)
+    MATRIX_QUANTIZATION = None
+    # int8 量化时每个结果用浮点向量精确重排的候选倍数
+    MATRIX_RERANK_FACTOR = 4
+
+    # Lexical / hybrid retrieval
+    # 是否维护论文片段的 BM25 倒排索引 (SQLite FTS5)
+    USE_LEXICAL_INDEX = True
+    # BM25 索引文件名 (与所用后端的索引存放在同一目录)
+    LEXICAL_INDEX_NAME = "lexical.sqlite3"
+    # 默认片段检索模式: "dense" (语义)、"hybrid" (BM25 与语义 RRF 融合)、"prefilter" (BM25 预筛选后语义打分)
+    SEARCH_MODE = "dense"
+    # 混合检索时每路召回的候选数 = top_k * 该倍数
+    HYBRID_CANDIDATES_FACTOR = 4
+    # 倒数排名融合 (RRF) 的平滑常数
+    RRF_K = 60
+    # 预筛选模式下由 BM25 召回、再进行语义打分的候选数
+    LEXICAL_PREFILTER_CANDIDATES = 200
+    # 文件名/目录过滤器匹配到的 ID 集合的缓存容量 (索引写入后失效)
+    FILTER_ID_CACHE_SIZE = 64
+
+    # File ranking
+    # 文件级排序方式: "collection" (查询均值池化的 papers_files 集合)、"chunks" (由片段命中按文件聚合)
+    FILE_RANKING = "collection"
+    # 片段聚合方式: "max" (最佳片段)、"topm" (前 m 个片段相似度之和)
+    FILE_AGGREGATION = "max"
+    # "topm" 聚合时每个文件累加的片段数
+    FILE_AGGREGATION_TOP_M = 3
+    # 由片段聚合文件时的过采样倍数 (查询 top_k * 该倍数个片段，不足 top_k 个文件时加倍)
+    FILE_CHUNK_OVERSAMPLE = 10
+
     # Chroma
     # 向量数据库集合名称
     # 论文文件集合
@@ -51,6 +164,24 @@ class Config:
     # 图片集合
     # 更新集合名称以避免与旧维度(768)冲突
     COLLECTION_IMAGES = "images_xlm_h14"
+    # 单次写入向量数据库的最大行数 (同时受 Chroma 的最大批大小限制)
+    VECTOR_WRITE_BATCH_SIZE = 4096
+    # 图片增量索引清单文件名 (与所用后端的索引存放在同一目录)
+    IMAGE_MANIFEST_NAME = "images_manifest.json"
+    # 论文增量摄入清单文件名 (与所用后端的索引存放在同一目录)
+    PAPER_MANIFEST_NAME = "papers_manifest.json"
+    # 索引代数令牌文件名 (每次写入索引时更新，用于使检索结果缓存失效)
+    INDEX_GENERATION_NAME = "index_generation"
+
+    # Daemon
+    # 常驻进程监听地址 (仅本机)
+    DAEMON_HOST = "127.0.0.1"
+    # 常驻进程端口 (0 表示由系统分配空闲端口)
+    DAEMON_PORT = 0
+    # 常驻进程状态文件 (记录端口、PID 与访问令牌，客户端据此发现常驻进程)
+    DAEMON_STATE_FILE = CACHE_DIR / "daemon.json"
+    # 客户端探测常驻进程是否存活的超时 (秒)
+    DAEMON_CONNECT_TIMEOUT = 0.5
 
     @classmethod
     def setup(cls):
@@ -0,0 +1,84 @@
+import json
+import urllib.error
+import urllib.request
+from agent.config import Config
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class DaemonError(RuntimeError):
+    """
+    A command failed inside the daemon.
+    命令在常驻进程中执行失败。
+    """
+
+class DaemonClient:
+    """
+    Client of a running agent daemon, found through the daemon state file.
+    通过状态文件发现并连接正在运行的常驻进程的客户端。
+    """
+    def __init__(self, host: str, port: int, token: str):
+        self.base_url = f"http://{host}:{port}"
+        self.token = token
+
+    @classmethod
+    def discover(cls, state_file: str = str(Config.DAEMON_STATE_FILE), timeout: float = Config.DAEMON_CONNECT_TIMEOUT):
+        """
+        Connect to the daemon if one is running.
+        如果常驻进程正在运行则连接它。
+
+        Returns:
+            DaemonClient | None: A client for a live daemon, or None. 存活常驻进程的客户端，否则为 None。
+        """
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            client = cls(state["host"], state["port"], state["token"])
+        except (OSError, ValueError, KeyError):
+            return None
+        return client if client.ping(timeout) else None
+
+    def _request(self, path: str, payload: dict = None, timeout: float = None) -> dict:
+        data = None if payload is None else json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            headers={"Content-Type": "application/json", "X-Agent-Token": self.token},
+            method="GET" if data is None else "POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            # Error replies still carry a JSON body
+            # 错误响应同样包含 JSON 正文
+            try:
+                return json.loads(e.read().decode("utf-8"))
+            except ValueError:
+                return {"ok": False, "error": f"HTTP {e.code}"}
+
+    def ping(self, timeout: float = Config.DAEMON_CONNECT_TIMEOUT) -> bool:
+        try:
+            return bool(self._request("/health", timeout=timeout).get("ok"))
+        except (OSError, ValueError):
+            return False
+
+    def call(self, command: str, params: dict = None):
+        """
+        Run a command in the daemon and return its JSON result.
+        在常驻进程中执行命令并返回其 JSON 结果。
+
+        Raises:
+            DaemonError: If the command failed in the daemon. 命令在常驻进程中失败时抛出。
+        """
+        reply = self._request("/call", {"command": command, "params": params or {}})
+        if not reply.get("ok"):
+            raise DaemonError(reply.get("error", "Unknown daemon error"))
+        return reply.get("result")
+
+    def shutdown(self):
+        """
+        Ask the daemon to stop.
+        请求常驻进程停止。
+        """
+        self._request("/shutdown", {}, timeout=Config.DAEMON_CONNECT_TIMEOUT * 4)
@@ -0,0 +1,267 @@
+import json
+import os
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+from agent.config import Config
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+def to_jsonable(value):
+    """
+    Convert a service result (Chroma result dicts, numpy arrays, paths) into JSON-safe values.
+    将服务结果（Chroma 结果字典、numpy 数组、路径）转换为可 JSON 序列化的值。
+    """
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Path):
+        return str(value)
+    return value
+
+class ServiceHub:
+    """
+    Holds one shared vector store and embedders, and builds the services on first use.
+    持有共享的向量数据库与嵌入模型，并在首次使用时构建各服务。
+
+    Used by the daemon to keep models warm between requests, and by the CLI for in-process execution.
+    Service modules are imported on first use, so a paper search never imports the image model stack.
+    常驻进程用它在请求之间保持模型常驻；命令行在进程内执行时也使用它。
+    服务模块在首次使用时才导入，因此论文检索不会加载图像模型相关依赖。
+    """
+    # Commands that write the index or move files run one at a time
+    # 写入索引或移动文件的命令逐个执行
+    WRITE_COMMANDS = {"add_paper", "batch_organize", "index_images"}
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._instances = {}
+
+    def _get(self, name: str, factory):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = factory()
+                    self._instances[name] = instance
+        return instance
+
+    # Embedders and stores come from the process-wide registry, so services built outside the hub share them too
+    # 嵌入模型与向量数据库来自进程级注册表，因此在 hub 之外构建的服务也共享它们
+    def vector_store(self):
+        from agent.services import registry
+        return self._get("vector_store", registry.vector_store)
+
+    def text_embedder(self):
+        from agent.services import registry
+        return self._get("text_embedder", registry.text_embedder)
+
+    def image_embedder(self):
+        from agent.services import registry
+        # Text tower only until images are indexed 在索引图片之前只加载文本编码器
+        return self._get("image_embedder", lambda: registry.image_embedder(load_vision=False))
+
+    def paper_manager(self):
+        from agent.services.paper_manager import PaperManager
+        return self._get("paper_manager", lambda: PaperManager(self.text_embedder(), self.vector_store()))
+
+    def search_service(self):
+        from agent.services.search_service import SearchService
+        return self._get("search_service", lambda: SearchService(self.text_embedder(), self.vector_store()))
+
+    def image_search(self):
+        from agent.services.image_search import ImageSearchService
+        return self._get("image_search", lambda: ImageSearchService(self.image_embedder(), self.vector_store()))
+
+    def preload(self, images: bool = False):
+        """
+        Load the models ahead of the first request.
+        在首个请求之前加载模型。
+
+        Args:
+            images (bool): Also load the image model (large). 同时加载图像模型（体积较大）。
+        """
+        self.paper_manager()
+        self.search_service()
+        if images:
+            self.image_search()
+
+    def execute(self, command: str, params: dict = None):
+        """
+        Run one CLI command.
+        执行一个命令行命令。
+
+        Args:
+            command (str): Command name, as in main.py. 命令名称，与 main.py 一致。
+            params (dict, optional): Keyword arguments of the command. 命令的关键字参数。
+
+        Returns:
+            JSON-safe command result (None for commands without a result). 可 JSON 序列化的命令结果。
+        """
+        params = dict(params or {})
+        handler = getattr(self, f"_cmd_{command}", None)
+        if handler is None:
+            raise ValueError(f"Unknown command: {command}")
+        if command in self.WRITE_COMMANDS:
+            with self._write_lock:
+                return to_jsonable(handler(**params))
+        return to_jsonable(handler(**params))
+
+    def _cmd_add_paper(self, path: str, topics: list[str] = None, move: bool = False, index: bool = True):
+        return self.paper_manager().add_paper(path, topics=topics, move=move, index=index)
+
+    @staticmethod
+    def _search_filter(topic=None, filename: str = None, pages=None, path_prefix: str = None):
+        from agent.index.filters import SearchFilter
+        return SearchFilter.from_params(topic=topic, filename=filename, pages=pages, path_prefix=path_prefix)
+
+    def _cmd_search_paper(self, query: str, top_k: int = 5, return_snippets: bool = False, return_files: bool = True,
+                          mode: str = None, file_ranking: str = None, **filters):
+        return self.search_service().search_paper(query, top_k=top_k, return_snippets=return_snippets,
+                                                  return_files=return_files, mode=mode, file_ranking=file_ranking,
+                                                  search_filter=self._search_filter(**filters))
+
+    def _cmd_search_cache_stats(self):
+        return self.search_service().cache_stats()
+
+    def _cmd_search_image(self, query: str, top_k: int = 5, **filters):
+        return self.image_search().search_image(query, top_k=top_k, search_filter=self._search_filter(**filters))
+
+    def _cmd_search_papers_batch(self, queries: list[str], top_k: int = 5, return_snippets: bool = False, return_files: bool = True,
+                                 file_ranking: str = None, **filters):
+        return self.search_service().search_papers_batch(queries, top_k=top_k, return_snippets=return_snippets,
+                                                         return_files=return_files, file_ranking=file_ranking,
+                                                         search_filter=self._search_filter(**filters))
+
+    def _cmd_search_images_batch(self, queries: list[str], top_k: int = 5, **filters):
+        return self.image_search().search_images_batch(queries, top_k=top_k, search_filter=self._search_filter(**filters))
+
+    def _cmd_batch_organize(self, root: str, topics: list[str] = None, **kwargs):
+        return self.paper_manager().batch_organize(root, topics, **kwargs)
+
+    def _cmd_index_images(self, dir: str = None, workers: int = None):
+        if dir:
+            return self.image_search().index_images(dir, workers=workers)
+        return self.image_search().index_images(workers=workers)
+
+class AgentDaemon:
+    """
+    Long-lived local HTTP server that keeps the embedders and vector store loaded across CLI invocations.
+    常驻本地 HTTP 服务，使嵌入模型与向量数据库在多次命令行调用之间保持加载状态。
+
+    It only listens on localhost and requires the random token stored in the daemon state file,
+    which is readable by the current user only.
+    仅监听本机地址，并要求携带状态文件中的随机令牌（该文件仅当前用户可读）。
+    """
+    def __init__(self, host: str = Config.DAEMON_HOST, port: int = Config.DAEMON_PORT,
+                 state_file: str = str(Config.DAEMON_STATE_FILE), hub: ServiceHub = None):
+        """
+        Args:
+            host (str): Listen address. 监听地址。
+            port (int): Listen port, 0 for any free port. 监听端口，0 表示任意空闲端口。
+            state_file (str): Where to publish the port and token for clients. 向客户端发布端口与令牌的文件。
+            hub (ServiceHub, optional): Services to serve. 提供服务的 ServiceHub。
+        """
+        self.hub = hub or ServiceHub()
+        self.state_file = Path(state_file)
+        self.token = secrets.token_hex(16)
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                if secrets.compare_digest(self.headers.get("X-Agent-Token", ""), daemon.token):
+                    return True
+                self._reply(403, {"ok": False, "error": "Invalid daemon token"})
+                return False
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path == "/health":
+                    self._reply(200, {"ok": True, "pid": os.getpid()})
+                else:
+                    self._reply(404, {"ok": False, "error": f"Unknown path: {self.path}"})
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                if self.path == "/shutdown":
+                    self._reply(200, {"ok": True})
+                    threading.Thread(target=daemon.server.shutdown, daemon=True).start()
+                    return
+                if self.path != "/call":
+                    self._reply(404, {"ok": False, "error": f"Unknown path: {self.path}"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    request = json.loads(self.rfile.read(length).decode("utf-8"))
+                    logger.info(f"Daemon running '{request['command']}'")
+                    result = daemon.hub.execute(request["command"], request.get("params"))
+                    self._reply(200, {"ok": True, "result": result})
+                except Exception as e:
+                    logger.error(f"Daemon command failed: {e}", exc_info=True)
+                    self._reply(500, {"ok": False, "error": f"{type(e).__name__}: {e}"})
+
+        return Handler
+
+    def _write_state(self):
+        host, port = self.server.server_address[:2]
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_file.with_suffix(".tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"host": host, "port": port, "pid": os.getpid(), "token": self.token}, f)
+        os.replace(tmp_path, self.state_file)
+
+    def _remove_state(self):
+        # Only remove the state file if another daemon has not replaced it
+        # 仅当状态文件未被其他常驻进程替换时才删除
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                if json.load(f).get("token") != self.token:
+                    return
+            self.state_file.unlink()
+        except (OSError, ValueError):
+            pass
+
+    def serve_forever(self):
+        """
+        Publish the state file and serve until shutdown.
+        发布状态文件并持续服务直至关闭。
+        """
+        self._write_state()
+        host, port = self.server.server_address[:2]
+        logger.info(f"Agent daemon listening on http://{host}:{port} (pid {os.getpid()})")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            self._remove_state()
+            logger.info("Agent daemon stopped.")
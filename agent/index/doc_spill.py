@@ -0,0 +1,138 @@
+import json
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+from agent.config import Config
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class DocumentSpillStore:
+    """
+    On-disk store for batch document records, keeping peak memory flat during batch organization.
+    批处理文档记录的磁盘存储，使批量整理时的内存峰值保持平稳。
+
+    Pass one appends each document: its file and chunk embeddings go to raw float32 files and its chunks
+    (text plus metadata) to a JSON-lines spill file. After `finish()` the embeddings are exposed as
+    memory-mapped matrices and chunks are streamed back one document at a time with `load_chunks()`.
+    第一遍追加每个文档：文件与片段嵌入写入 float32 原始文件，片段（文本及元数据）写入 JSON 行溢出文件。
+    调用 `finish()` 后，嵌入以内存映射矩阵形式提供，片段可通过 `load_chunks()` 逐文档读回。
+    """
+    def __init__(self, spill_dir: str = str(Config.SPILL_DIR)):
+        """
+        Create a fresh spill directory for one batch run.
+        为一次批处理创建新的溢出目录。
+
+        Args:
+            spill_dir (str): Parent directory of spill runs. 溢出文件的父目录。
+        """
+        Path(spill_dir).mkdir(parents=True, exist_ok=True)
+        self.dir = Path(tempfile.mkdtemp(prefix="batch_", dir=spill_dir))
+        self._files_path = self.dir / "files.f32"
+        self._chunk_vectors_path = self.dir / "chunks.f32"
+        self._chunks_path = self.dir / "chunks.jsonl"
+        self._files_out = open(self._files_path, "wb")
+        self._chunk_vectors_out = open(self._chunk_vectors_path, "wb")
+        self._chunks_out = open(self._chunks_path, "wb")
+        self._chunks_in = None
+
+        self.dim = None
+        self.n_docs = 0
+        self._n_chunk_rows = 0
+        self._chunks_offset = 0
+
+        # Available after finish()
+        # 调用 finish() 后可用
+        self.file_embeddings = None
+        self.chunk_embeddings = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def append(self, record: dict, doc_embedding, chunks: list[dict] = None) -> dict:
+        """
+        Spill one document and return the compact record that stays in memory.
+        溢出一个文档，并返回保留在内存中的精简记录。
+
+        Args:
+            record (dict): Document record (path, hashes, flags). 文档记录（路径、哈希、标志）。
+            doc_embedding (DocumentEmbedding): File and chunk embeddings. 文件与片段嵌入。
+            chunks (list[dict], optional): Chunks with their text. 包含文本的片段。
+
+        Returns:
+            dict: `record` plus spill offsets, without chunks or embeddings. 附带溢出偏移、不含片段与嵌入的记录。
+        """
+        file_embedding = np.asarray(doc_embedding.file_embedding, dtype=np.float32)
+        if self.dim is None:
+            self.dim = file_embedding.shape[-1]
+        self._files_out.write(file_embedding.tobytes())
+
+        spilled = {k: v for k, v in record.items() if k not in ("chunks", "embedding")}
+        spilled["spill_store"] = self
+        spilled["spill_row"] = self.n_docs
+        spilled["chunk_rows"] = None
+        spilled["chunks_span"] = None
+        if chunks:
+            chunk_embeddings = np.asarray(doc_embedding.chunk_embeddings, dtype=np.float32)
+            self._chunk_vectors_out.write(chunk_embeddings.tobytes())
+            spilled["chunk_rows"] = (self._n_chunk_rows, len(chunks))
+            self._n_chunk_rows += len(chunks)
+
+            line = json.dumps(chunks, ensure_ascii=False).encode("utf-8") + b"\n"
+            self._chunks_out.write(line)
+            spilled["chunks_span"] = (self._chunks_offset, len(line))
+            self._chunks_offset += len(line)
+
+        self.n_docs += 1
+        return spilled
+
+    def finish(self):
+        """
+        End pass one: close the writers and memory-map the embedding matrices.
+        结束第一遍：关闭写入器并内存映射嵌入矩阵。
+        """
+        for f in (self._files_out, self._chunk_vectors_out, self._chunks_out):
+            f.close()
+        if self.n_docs:
+            self.file_embeddings = np.memmap(self._files_path, dtype=np.float32, mode="r", shape=(self.n_docs, self.dim))
+        if self._n_chunk_rows:
+            self.chunk_embeddings = np.memmap(self._chunk_vectors_path, dtype=np.float32, mode="r", shape=(self._n_chunk_rows, self.dim))
+        self._chunks_in = open(self._chunks_path, "rb")
+        logger.info(f"Spilled {self.n_docs} documents ({self._n_chunk_rows} chunks) to {self.dir}")
+
+    def load_chunks(self, record: dict):
+        """
+        Stream one document's chunks back from the spill file.
+        从溢出文件中读回一个文档的片段。
+        """
+        if record["chunks_span"] is None:
+            return []
+        offset, length = record["chunks_span"]
+        self._chunks_in.seek(offset)
+        return json.loads(self._chunks_in.read(length).decode("utf-8"))
+
+    def load_chunk_embeddings(self, record: dict):
+        """
+        Chunk embeddings of one document as a view into the memory-mapped matrix.
+        一个文档的片段嵌入（内存映射矩阵的视图）。
+        """
+        if record["chunk_rows"] is None:
+            return None
+        start, n = record["chunk_rows"]
+        return self.chunk_embeddings[start:start + n]
+
+    def close(self):
+        """
+        Release file handles and delete the spill directory.
+        释放文件句柄并删除溢出目录。
+        """
+        for f in (self._files_out, self._chunk_vectors_out, self._chunks_out, self._chunks_in):
+            if f is not None and not f.closed:
+                f.close()
+        self.file_embeddings = None
+        self.chunk_embeddings = None
+        shutil.rmtree(self.dir, ignore_errors=True)
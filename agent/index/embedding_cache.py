@@ -0,0 +1,353 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from agent.config import Config
+from agent.utils.file_lock import FileLock
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding cache backed by a memory-mapped float32 matrix.
+    基于内存映射 float32 矩阵的持久化内容寻址嵌入缓存。
+
+    Entries are keyed by the sha256 digest of the embedded content inside a per-model namespace.
+    The key index keeps LRU order and is evicted once `max_entries` is reached.
+    条目以内容的 sha256 摘要为键，并按模型划分命名空间。键索引维护 LRU 顺序，达到 `max_entries` 后淘汰。
+
+    Several instances may share a namespace, in one process or in several (daemon, UI, CLI). The key of every row
+    is stored next to it in `keys.bin` and checked on each read, so a row rewritten by another instance is a miss,
+    never a wrong vector. Rows are allocated under a file lock after re-reading `keys.bin` whenever another
+    instance has written; LRU order is kept per instance.
+    多个实例可共享同一命名空间，无论在同一进程还是多个进程中（常驻进程、UI、命令行）。每行的键与其一同存放在
+    `keys.bin` 中并在每次读取时检查，因此被其他实例改写的行只会是未命中，而不会返回错误的向量。分配行时持有文件锁，
+    并在其他实例写入后重新读取 `keys.bin`；LRU 顺序由各实例各自维护。
+    """
+    INITIAL_CAPACITY = 1024
+    FLUSH_EVERY = 256
+    KEY_BYTES = 32
+
+    def __init__(self, namespace: str, cache_dir: str = str(Config.EMBEDDING_CACHE_DIR), max_entries: int = Config.EMBEDDING_CACHE_MAX_ENTRIES):
+        """
+        Initialize the cache, loading any previously persisted entries.
+        初始化缓存，并加载之前持久化的条目。
+
+        Args:
+            namespace (str): Cache namespace, usually the model name. 缓存命名空间，通常为模型名称。
+            cache_dir (str): Root directory of all embedding caches. 嵌入缓存根目录。
+            max_entries (int): Maximum number of cached vectors. 最大缓存向量数。
+        """
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.dir = Path(cache_dir) / re.sub(r"[^A-Za-z0-9._-]+", "_", namespace)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.dir / "vectors.f32"
+        # Owner key of each row; an all-zero row is free 每行所属的键；全零行为空闲
+        self.keys_path = self.dir / "keys.bin"
+        self.meta_path = self.dir / "meta.json"
+        # LRU order hint, rewritten on flush 按 LRU 顺序排列的键，刷新时重写
+        self.index_path = self.dir / "index.npz"
+        # Token rewritten by every write, so other instances know to re-read keys.bin
+        # 每次写入都会重写的令牌，使其他实例知道需要重新读取 keys.bin
+        self.generation_path = self.dir / "generation"
+        self._file_lock = FileLock(self.dir / "lock")
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.RLock()
+        self._slots = OrderedDict()  # digest -> row, least recently used first
+        self._free = []
+        self._dim = None
+        self._capacity = 0
+        self._vectors = None
+        self._keys = None
+        self._generation = None
+        self._dirty = 0
+
+        with self._lock, self._file_lock:
+            self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key_for_text(text: str) -> bytes:
+        """
+        Cache key of a text string.
+        文本字符串的缓存键。
+        """
+        return hashlib.sha256(b"text:" + text.encode("utf-8")).digest()
+
+    @staticmethod
+    def key_for_bytes(data: bytes) -> bytes:
+        """
+        Cache key of raw content bytes (e.g. an image file).
+        原始内容字节（例如图片文件）的缓存键。
+        """
+        return hashlib.sha256(b"bytes:" + data).digest()
+
+    @staticmethod
+    def key_for_digest(hex_digest: str) -> bytes:
+        """
+        Cache key of content identified by its sha256 hex digest (e.g. a hashed file).
+        由 sha256 十六进制摘要标识的内容（例如已哈希的文件）的缓存键。
+        """
+        return hashlib.sha256(b"digest:" + bytes.fromhex(hex_digest)).digest()
+
+    def _read_generation(self) -> str:
+        try:
+            return self.generation_path.read_text(encoding="utf-8")
+        except OSError:
+            return ""
+
+    def _bump_generation(self):
+        self._generation = uuid.uuid4().hex
+        self.generation_path.write_text(self._generation, encoding="utf-8")
+
+    def _reset(self):
+        self._slots.clear()
+        self._free = []
+        self._dim = None
+        self._capacity = 0
+        self._vectors = None
+        self._keys = None
+
+    def _load(self):
+        """
+        (Re)build the row map from `keys.bin`; called with the file lock held.
+        根据 `keys.bin` (重新) 构建行映射；调用时须持有文件锁。
+        """
+        self._generation = self._read_generation()
+        if not self.keys_path.exists():
+            if self.vectors_path.exists():
+                # Caches written before rows carried their keys cannot be verified
+                # 行不带键之前写入的缓存无法校验
+                logger.warning(f"Discarding embedding cache at {self.dir} written by an older version")
+                for path in (self.vectors_path, self.index_path, self.meta_path):
+                    path.unlink(missing_ok=True)
+            self._reset()
+            return
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                dim = json.load(f)["dim"]
+            capacity = self.keys_path.stat().st_size // self.KEY_BYTES
+            if self.vectors_path.stat().st_size < capacity * dim * 4:
+                with open(self.vectors_path, "ab") as f:
+                    f.truncate(capacity * dim * 4)
+            keys = np.memmap(self.keys_path, dtype=np.uint8, mode="r+", shape=(capacity, self.KEY_BYTES)) if capacity else None
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dim)) if capacity else None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable embedding cache at {self.dir}: {e}")
+            for path in (self.vectors_path, self.keys_path, self.index_path, self.meta_path):
+                path.unlink(missing_ok=True)
+            self._reset()
+            return
+
+        occupied = np.flatnonzero(keys.any(axis=1)) if capacity else np.empty(0, dtype=np.int64)
+        rows = {keys[r].tobytes(): int(r) for r in occupied}
+        # Keep this instance's LRU order; on first load use the persisted hint. Unknown keys count as oldest.
+        # 保留本实例的 LRU 顺序；首次加载时使用持久化的顺序。未知的键视为最久未使用。
+        if self._slots:
+            order = list(self._slots)
+        else:
+            try:
+                order = [k.tobytes() for k in np.load(self.index_path)["keys"]]
+            except Exception:
+                order = []
+        known = set(order)
+        slots = OrderedDict((k, r) for k, r in rows.items() if k not in known)
+        slots.update((k, rows[k]) for k in order if k in rows)
+        used = set(rows.values())
+
+        self._slots = slots
+        self._free = [r for r in range(capacity - 1, -1, -1) if r not in used]
+        self._dim, self._capacity = dim, capacity
+        self._vectors, self._keys = vectors, keys
+        if rows:
+            logger.info(f"Loaded embedding cache '{self.namespace}' with {len(rows)} entries")
+
+    def _sync(self):
+        # Called with the file lock held: pick up rows written by other instances
+        # 调用时须持有文件锁：获取其他实例写入的行
+        if self._read_generation() != self._generation:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._keys.flush()
+            self._load()
+
+    def _grow(self, dim: int):
+        if self._dim is None:
+            self._dim = dim
+            tmp_path = self.dir / "meta.tmp.json"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": dim}, f)
+            os.replace(tmp_path, self.meta_path)
+        elif dim != self._dim:
+            raise ValueError(f"Embedding dimension {dim} does not match cache dimension {self._dim}")
+
+        new_capacity = min(max(self.INITIAL_CAPACITY, self._capacity * 2), self.max_entries)
+        if new_capacity <= self._capacity:
+            return
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._keys.flush()
+            self._vectors = self._keys = None
+        # Vectors first: capacity is read from the size of keys.bin 先扩展向量文件：容量由 keys.bin 的大小得出
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self._dim * 4)
+        with open(self.keys_path, "ab") as f:
+            f.truncate(new_capacity * self.KEY_BYTES)
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self._dim))
+        self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode="r+", shape=(new_capacity, self.KEY_BYTES))
+        self._free.extend(range(new_capacity - 1, self._capacity - 1, -1))
+        self._capacity = new_capacity
+
+    def _allocate_row(self, dim: int) -> int:
+        if not self._free:
+            self._grow(dim)
+        if self._free:
+            return self._free.pop()
+        # Full: evict the least recently used entry and reuse its row
+        # 已满：淘汰最久未使用的条目并复用其行
+        _, row = self._slots.popitem(last=False)
+        self.evictions += 1
+        return row
+
+    def _read_row(self, key: bytes, row: int):
+        # The key is checked before and after copying, so a row being rewritten is never returned
+        # 复制前后都检查键，因此不会返回正在被改写的行
+        expected = np.frombuffer(key, dtype=np.uint8)
+        if row >= self._capacity or not np.array_equal(self._keys[row], expected):
+            return None
+        vec = np.array(self._vectors[row])
+        if not np.array_equal(self._keys[row], expected):
+            return None
+        return vec
+
+    def _lookup(self, keys: list[bytes], results: list):
+        for i, key in enumerate(keys):
+            if results[i] is not None:
+                continue
+            row = self._slots.get(key)
+            if row is None:
+                continue
+            vec = self._read_row(key, row)
+            if vec is None:
+                # Rewritten by another instance 已被其他实例改写
+                del self._slots[key]
+            else:
+                self._slots.move_to_end(key)
+                results[i] = vec
+
+    def get_many(self, keys: list[bytes]) -> list:
+        """
+        Look up cached vectors.
+        查找缓存向量。
+
+        Returns:
+            list: One float32 vector per key, or None where the key is not cached. 每个键对应的向量，未命中为 None。
+        """
+        results = [None] * len(keys)
+        with self._lock:
+            self._lookup(keys, results)
+            if any(v is None for v in results) and self._read_generation() != self._generation:
+                # Other instances have written since: look for the misses in their rows
+                # 其他实例在此期间有写入：在其写入的行中查找未命中的键
+                with self._file_lock:
+                    self._sync()
+                self._lookup(keys, results)
+            found = sum(v is not None for v in results)
+            self.hits += found
+            self.misses += len(keys) - found
+        return results
+
+    def put_many(self, keys: list[bytes], vectors):
+        """
+        Store vectors under their content keys.
+        按内容键存储向量。
+        """
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock:
+            self._sync()
+            for key, vec in zip(keys, vectors):
+                row = self._slots.get(key)
+                if row is None:
+                    row = self._allocate_row(vec.shape[-1])
+                # Clear the key while the row is rewritten, so concurrent readers miss instead of reading a torn vector
+                # 改写期间清除键，使并发读取方未命中而不是读到不完整的向量
+                self._keys[row] = 0
+                self._vectors[row] = vec
+                self._keys[row] = np.frombuffer(key, dtype=np.uint8)
+                self._slots[key] = row
+                self._slots.move_to_end(key)
+            self._bump_generation()
+            self._dirty += len(keys)
+            if self._dirty >= self.FLUSH_EVERY:
+                self.flush()
+
+    def get_or_compute(self, keys: list[bytes], items: list, encode):
+        """
+        Return vectors for `items`, running `encode` only on the items whose keys are not cached.
+        返回 `items` 的向量，仅对未命中缓存的条目调用 `encode`。
+
+        Args:
+            keys (list[bytes]): Cache key of each item. 每个条目的缓存键。
+            items (list): Items to embed (texts or images). 待嵌入条目（文本或图像）。
+            encode (callable): Model function mapping a list of items to an embedding array. 将条目列表映射为嵌入数组的模型函数。
+
+        Returns:
+            np.ndarray: float32 array of shape (len(items), dim). 形状为 (len(items), dim) 的 float32 数组。
+        """
+        vectors = self.get_many(keys)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            new_vectors = encode([items[i] for i in missing])
+            self.put_many([keys[i] for i in missing], new_vectors)
+            for i, v in zip(missing, new_vectors):
+                vectors[i] = v
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+    def flush(self):
+        """
+        Persist vectors, row keys and the LRU order to disk.
+        将向量、行键与 LRU 顺序持久化到磁盘。
+        """
+        with self._lock:
+            if self._vectors is None or not self._dirty:
+                return
+            with self._file_lock:
+                self._vectors.flush()
+                self._keys.flush()
+                keys = np.frombuffer(b"".join(self._slots.keys()), dtype=np.uint8).reshape(-1, self.KEY_BYTES)
+                tmp_path = self.dir / "index.tmp.npz"
+                np.savez(tmp_path, keys=keys)
+                os.replace(tmp_path, self.index_path)
+            self._dirty = 0
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters and occupancy.
+        命中/未命中计数及占用情况。
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "namespace": self.namespace,
+                "entries": len(self._slots),
+                "capacity": self._capacity,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,127 @@
+import fnmatch
+import os
+from pathlib import Path
+
+class SearchFilter:
+    """
+    Metadata predicates restricting a search: topic, filename glob, page range and directory prefix.
+    限定检索范围的元数据谓词：主题、文件名通配、页码范围与目录前缀。
+
+    Topic and page range map to a Chroma-style `where` clause evaluated by the index. Filename globs and
+    directory prefixes have no `where` operator, so `VectorStore` resolves them to the set of matching ids
+    first and restricts the nearest-neighbour query to those ids; either way top-k stays exact.
+    主题与页码范围转换为由索引执行的 Chroma 风格 `where` 子句。文件名通配与目录前缀没有对应的 `where` 运算符，
+    因此 `VectorStore` 先求出匹配的 ID 集合，再将近邻查询限定在这些 ID 上；两种方式下 top-k 均保持精确。
+    """
+    def __init__(self, topic=None, filename: str = None, pages: tuple = None, path_prefix: str = None):
+        """
+        Args:
+            topic (str | list[str], optional): Topic, or any of several topics. 主题，或多个主题中的任一个。
+            filename (str, optional): Case-insensitive glob on the file name, e.g. "*survey*.pdf". 文件名通配（不区分大小写）。
+            pages (tuple, optional): Inclusive (first, last) page range; chunks overlapping it match. Either end may be None.
+                页码范围 (首页, 末页)（闭区间），与之有交集的片段即匹配；任一端可为 None。
+            path_prefix (str, optional): Only files under this directory; relative paths are resolved against the
+                working directory, as indexed paths are absolute. 仅限该目录下的文件；相对路径相对于当前工作目录解析，因为索引中的路径为绝对路径。
+        """
+        if isinstance(topic, str):
+            topic = [topic]
+        self.topics = list(topic) if topic else None
+        self.filename = filename or None
+        if pages is not None and all(p is None for p in pages):
+            pages = None
+        self.pages = tuple(pages) if pages is not None else None
+        self.path_prefix = str(Path(path_prefix).expanduser().resolve()) if path_prefix else None
+
+    @classmethod
+    def from_params(cls, topic=None, filename: str = None, pages=None, path_prefix: str = None):
+        """
+        Build a filter from plain (e.g. CLI or JSON) parameters; returns None when nothing is set.
+        从普通参数（如命令行或 JSON）构建过滤器；未设置任何条件时返回 None。
+
+        Args:
+            pages (str | list, optional): "3-7", "5-", "-2", "4" or a [first, last] pair. 页码范围字符串或 [首页, 末页]。
+        """
+        if isinstance(pages, str):
+            pages = cls.parse_pages(pages)
+        search_filter = cls(topic=topic, filename=filename, pages=pages, path_prefix=path_prefix)
+        return None if search_filter.is_empty() else search_filter
+
+    @staticmethod
+    def parse_pages(text: str) -> tuple:
+        """
+        Parse "3-7", "5-", "-2" or "4" into an inclusive (first, last) pair.
+        将 "3-7"、"5-"、"-2" 或 "4" 解析为闭区间 (首页, 末页)。
+        """
+        text = text.strip()
+        if not text:
+            return None
+        if "-" not in text:
+            return (int(text), int(text))
+        first, last = text.split("-", 1)
+        return (int(first) if first.strip() else None, int(last) if last.strip() else None)
+
+    def is_empty(self) -> bool:
+        return not (self.topics or self.filename or self.pages or self.path_prefix)
+
+    def without_pages(self) -> "SearchFilter":
+        """
+        The same filter minus the page range, for collections whose entries are whole files.
+        去掉页码范围的同一过滤器，用于以整个文件为条目的集合。
+        """
+        return SearchFilter(topic=self.topics, filename=self.filename, path_prefix=self.path_prefix)
+
+    def key(self) -> tuple:
+        """
+        Hashable form, for result cache keys.
+        可哈希形式，用作结果缓存键。
+        """
+        return (tuple(self.topics) if self.topics else None, self.filename, self.pages, self.path_prefix)
+
+    def where(self):
+        """
+        Chroma `where` clause for the predicates the index evaluates directly, or None.
+        索引可直接执行的谓词所对应的 Chroma `where` 子句，无则返回 None。
+        """
+        clauses = []
+        if self.topics:
+            clauses.append({"topic": self.topics[0]} if len(self.topics) == 1 else {"topic": {"$in": self.topics}})
+        if self.pages:
+            first, last = self.pages
+            if first is not None:
+                # Chunks spanning pages end on "page_end"; character-window chunks only have "page_id"
+                # 跨页分块以 "page_end" 结束；字符滑窗分块只有 "page_id"
+                clauses.append({"$or": [{"page_id": {"$gte": first}}, {"page_end": {"$gte": first}}]})
+            if last is not None:
+                clauses.append({"page_id": {"$lte": last}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def needs_id_scan(self) -> bool:
+        """
+        Whether some predicate has no `where` form and must be resolved to ids.
+        是否存在无法表示为 `where` 的谓词，需要解析为 ID 集合。
+        """
+        return bool(self.filename or self.path_prefix)
+
+    def matches(self, metadata: dict) -> bool:
+        """
+        Evaluate every predicate against one entry's metadata.
+        对单个条目的元数据执行全部谓词。
+        """
+        metadata = metadata or {}
+        if self.topics and metadata.get("topic") not in self.topics:
+            return False
+        if self.pages:
+            page = metadata.get("page_id")
+            page_end = metadata.get("page_end", page)
+            first, last = self.pages
+            if page is None or (first is not None and page_end < first) or (last is not None and page > last):
+                return False
+        if self.filename and not fnmatch.fnmatchcase(str(metadata.get("filename", "")).lower(), self.filename.lower()):
+            return False
+        if self.path_prefix:
+            path = os.path.normpath(str(metadata.get("path", "")))
+            if path != self.path_prefix and not path.startswith(self.path_prefix.rstrip(os.sep) + os.sep):
+                return False
+        return True
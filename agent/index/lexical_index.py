@@ -0,0 +1,132 @@
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+# Latin/number words, keeping compounds such as "gpt-4", "vit-h-14" or "resnet50.v2" together
+# 拉丁字母/数字词，保留 "gpt-4"、"vit-h-14"、"resnet50.v2" 等复合词
+_WORD_RE = re.compile(r"[0-9a-z]+(?:[-_.][0-9a-z]+)*")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text into BM25 terms.
+    将文本切分为 BM25 词项。
+
+    Latin words are lowercased; compounds are indexed both whole (joined by "_") and by their parts,
+    so "ViT-H-14" matches "vit_h_14" as well as "vit". Chinese runs are split into character bigrams.
+    拉丁词转为小写；复合词既整体索引（以 "_" 连接）也按部分索引，因此 "ViT-H-14" 既匹配 "vit_h_14" 也匹配 "vit"。
+    中文连续字符切分为字二元组。
+    """
+    lowered = text.lower()
+    terms = []
+    for match in _WORD_RE.finditer(lowered):
+        word = match.group()
+        parts = re.split(r"[-_.]", word)
+        if len(parts) > 1:
+            terms.append("_".join(parts))
+        terms.extend(parts)
+    for match in _CJK_RE.finditer(text):
+        run = match.group()
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+class LexicalIndex:
+    """
+    Persistent BM25 inverted index over paper chunk texts, backed by SQLite FTS5.
+    基于 SQLite FTS5 的论文片段文本持久化 BM25 倒排索引。
+
+    Texts are pre-tokenized with `tokenize` and stored as space-separated terms, so FTS5 only has to
+    split on spaces and the same rules apply to documents and queries.
+    文本先用 `tokenize` 预分词并以空格分隔存储，FTS5 只需按空格切分，文档与查询使用同一规则。
+    """
+    def __init__(self, db_path: str):
+        """
+        Open (or create) the index.
+        打开（或创建）索引。
+
+        Args:
+            db_path (str): SQLite database file. SQLite 数据库文件。
+        """
+        self.path = Path(db_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(terms, tokenize = \"unicode61 tokenchars '_'\")"
+            )
+        except sqlite3.OperationalError as e:
+            raise RuntimeError(f"SQLite FTS5 is required for the lexical index: {e}") from e
+        # Chunk id <-> FTS rowid, so replacing or deleting a chunk is an indexed lookup
+        # 片段 ID 与 FTS 行号的映射，使替换或删除片段可通过索引查找完成
+        self._db.execute("CREATE TABLE IF NOT EXISTS chunk_ids (id INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL)")
+        self._db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM chunk_ids").fetchone()[0]
+
+    def add(self, chunk_ids: list[str], texts: list[str]):
+        """
+        Index chunk texts, replacing any previous text under the same ids.
+        索引片段文本，替换相同 ID 下已有的文本。
+        """
+        if not chunk_ids:
+            return
+        terms = [" ".join(tokenize(text or "")) for text in texts]
+        with self._lock:
+            self._delete(chunk_ids)
+            for chunk_id, chunk_terms in zip(chunk_ids, terms):
+                rowid = self._db.execute("INSERT INTO chunk_ids (chunk_id) VALUES (?)", (chunk_id,)).lastrowid
+                self._db.execute("INSERT INTO chunks (rowid, terms) VALUES (?, ?)", (rowid, chunk_terms))
+            self._db.commit()
+
+    def _delete(self, chunk_ids: list[str]):
+        for start in range(0, len(chunk_ids), 900):
+            part = chunk_ids[start:start + 900]
+            placeholders = ",".join("?" * len(part))
+            rowids = [r for (r,) in self._db.execute(f"SELECT id FROM chunk_ids WHERE chunk_id IN ({placeholders})", part)]
+            if rowids:
+                self._db.execute(f"DELETE FROM chunks WHERE rowid IN ({','.join('?' * len(rowids))})", rowids)
+                self._db.execute(f"DELETE FROM chunk_ids WHERE chunk_id IN ({placeholders})", part)
+
+    def delete(self, chunk_ids: list[str]):
+        """
+        Remove chunks from the index.
+        从索引中移除片段。
+        """
+        if not chunk_ids:
+            return
+        with self._lock:
+            self._delete(chunk_ids)
+            self._db.commit()
+
+    def search(self, query: str, n_results: int = 10) -> list[tuple[str, float]]:
+        """
+        BM25 search; any query term may match.
+        BM25 检索；任一查询词命中即可。
+
+        Returns:
+            list[tuple[str, float]]: (chunk id, BM25 score), best first; higher is better. (片段 ID, BM25 分数)，按分数降序。
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        match = " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        with self._lock:
+            # FTS5's bm25() is negative, more negative meaning more relevant
+            # FTS5 的 bm25() 为负值，越小越相关
+            rows = self._db.execute(
+                "SELECT c.chunk_id, m.score FROM "
+                "(SELECT rowid, bm25(chunks) AS score FROM chunks WHERE chunks MATCH ? ORDER BY score LIMIT ?) AS m "
+                "JOIN chunk_ids AS c ON c.id = m.rowid ORDER BY m.score",
+                (match, n_results)
+            ).fetchall()
+        return [(chunk_id, -score) for chunk_id, score in rows]
@@ -0,0 +1,95 @@
+import json
+import os
+from pathlib import Path
+from agent.utils.file_lock import FileLock
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+# Marks a key removed by this instance, pending `save` 标记本实例删除、尚未 `save` 的键
+_REMOVED = object()
+
+class Manifest:
+    """
+    JSON-backed mapping of file path to ingest record, used for incremental indexing.
+    基于 JSON 的文件路径到摄入记录的映射，用于增量索引。
+
+    Several processes may index into the same store (daemon, UI, CLI). `save` therefore writes only the keys this
+    instance set or popped, merged into the current file under a lock file, and `refresh` picks up the others' records.
+    多个进程可能写入同一索引（常驻进程、UI、命令行）。因此 `save` 只写入本实例设置或删除的键，在锁文件保护下
+    合并到当前文件中；`refresh` 用于获取其他进程写入的记录。
+    """
+    def __init__(self, manifest_path: str):
+        """
+        Load the manifest if it exists.
+        如果清单文件存在则加载。
+
+        Args:
+            manifest_path (str): Path of the JSON manifest file. JSON 清单文件路径。
+        """
+        self.path = Path(manifest_path)
+        self.records = {}
+        self._changes = {}  # key -> record or _REMOVED
+        self._lock = FileLock(self.path.with_suffix(self.path.suffix + ".lock"))
+        self.refresh()
+
+    def _read(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return {}
+
+    def _merged(self) -> dict:
+        records = self._read()
+        for key, record in self._changes.items():
+            if record is _REMOVED:
+                records.pop(key, None)
+            else:
+                records[key] = record
+        return records
+
+    def refresh(self):
+        """
+        Re-read the file, keeping this instance's unsaved changes on top.
+        重新读取文件，并在其上保留本实例尚未保存的修改。
+        """
+        with self._lock:
+            self.records = self._merged()
+
+    def get(self, key: str):
+        return self.records.get(key)
+
+    def set(self, key: str, record: dict):
+        self.records[key] = record
+        self._changes[key] = record
+
+    def pop(self, key: str):
+        self._changes[key] = _REMOVED
+        return self.records.pop(key, None)
+
+    def keys_under(self, root: str) -> list[str]:
+        """
+        Keys located inside a directory.
+        位于某目录下的键。
+        """
+        prefix = str(Path(root)) + os.sep
+        return [k for k in self.records if k.startswith(prefix)]
+
+    def save(self):
+        """
+        Atomically merge this instance's changes into the manifest on disk.
+        原子地将本实例的修改合并到磁盘上的清单中。
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            records = self._merged()
+            tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(records, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.records = records
+            self._changes = {}
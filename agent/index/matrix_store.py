@@ -0,0 +1,546 @@
+import json
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+import numpy as np
+from agent.config import Config
+from agent.utils.file_lock import FileLock
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+_COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+def where_to_sql(where: dict) -> tuple:
+    """
+    Translate a Chroma `where` clause into a SQL condition over the JSON metadata column.
+    将 Chroma `where` 子句转换为针对 JSON 元数据列的 SQL 条件。
+
+    Supports field equality, $eq/$ne/$gt/$gte/$lt/$lte, $in/$nin and nested $and/$or.
+    支持字段相等、$eq/$ne/$gt/$gte/$lt/$lte、$in/$nin 以及嵌套的 $and/$or。
+
+    Returns:
+        tuple[str, list]: SQL condition and its parameters. SQL 条件及其参数。
+    """
+    conditions, params = [], []
+    for field, value in where.items():
+        if field in ("$and", "$or"):
+            parts = [where_to_sql(clause) for clause in value]
+            joiner = " AND " if field == "$and" else " OR "
+            conditions.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            params.extend(p for _, part_params in parts for p in part_params)
+            continue
+        column = "json_extract(metadata, ?)"
+        path = '$."' + field.replace('"', '""') + '"'
+        operators = value if isinstance(value, dict) else {"$eq": value}
+        for op, operand in operators.items():
+            if op in _COMPARISONS:
+                conditions.append(f"{column} {_COMPARISONS[op]} ?")
+                params.extend([path, operand])
+            elif op in ("$in", "$nin"):
+                negate = "NOT " if op == "$nin" else ""
+                conditions.append(f"{column} {negate}IN ({','.join('?' * len(operand))})")
+                params.append(path)
+                params.extend(operand)
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+    return " AND ".join(conditions) or "1", params
+
+class MatrixCollection:
+    """
+    Exact brute-force vector collection over a contiguous memory-mapped embedding matrix.
+    基于连续内存映射嵌入矩阵的精确暴力检索集合。
+
+    Vectors live in a raw row-major file (float32 or float16) with a parallel SQLite table of
+    ids, metadata and documents. Queries are answered with a blocked matrix product and
+    `argpartition` top-k. The subset of the Chroma collection API used by `VectorStore` is mirrored
+    (`upsert`, `get`, `query`, `update`, `delete`, `count`), including its result dict shape and its
+    default squared-L2 distance.
+
+    With int8 quantization each row also gets an int8 code plus a per-row scale. Queries scan the
+    codes (a quarter of the float32 bytes) with asymmetric distances, i.e. the float query against
+    the dequantized rows. The best `k * rerank_factor` candidates are then re-ranked exactly from the
+    float matrix, which stays on disk and is only paged in for those rows.
+    向量存放在行主序原始文件（float32 或 float16）中，并配有保存 ID、元数据与文档的 SQLite 并行表。
+    查询通过分块矩阵乘法与 `argpartition` 求 top-k。本类实现了 `VectorStore` 所用的 Chroma 集合接口子集
+    （`upsert`、`get`、`query`、`update`、`delete`、`count`），结果字典形状与默认的平方 L2 距离均与 Chroma 一致。
+
+    启用 int8 量化时，每行额外保存 int8 编码及逐行缩放系数。查询以非对称距离（浮点查询对反量化行）扫描编码
+    （仅为 float32 字节数的四分之一），再从浮点矩阵中精确重排前 `k * rerank_factor` 个候选；浮点矩阵保留在磁盘上，
+    仅为这些行换入内存。
+
+    Several processes may open the same directory: writes hold a file lock and rewrite a generation token,
+    and every call first reloads the row bookkeeping if another process has written since.
+    多个进程可以打开同一目录：写入时持有文件锁并重写代数令牌，每次调用前若其他进程在此期间有写入，则先重新加载行记录。
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, collection_dir: str, dtype: str = Config.MATRIX_DTYPE, scan_block: int = Config.MATRIX_SCAN_BLOCK,
+                 quantization: str = Config.MATRIX_QUANTIZATION, rerank_factor: int = Config.MATRIX_RERANK_FACTOR):
+        """
+        Open (or create) a collection directory.
+        打开（或创建）集合目录。
+
+        Args:
+            collection_dir (str): Directory holding the matrix files and metadata table. 存放矩阵文件与元数据表的目录。
+            dtype (str): Storage dtype of new collections, "float32" or "float16". 新集合的存储类型。
+            scan_block (int): Rows scored per block, bounding temporary memory. 每块计算的行数，限制临时内存。
+            quantization (str, optional): None for exact float scans, or "int8". 为 None 时精确浮点扫描，或为 "int8"。
+            rerank_factor (int): Candidates per result re-ranked exactly when quantized. 量化时每个结果精确重排的候选数倍数。
+        """
+        if quantization not in (None, "int8"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        self.dir = Path(collection_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.name = self.dir.name
+        self.scan_block = scan_block
+        self._vectors_path = self.dir / "vectors.bin"
+        self._norms_path = self.dir / "norms.f32"
+        self._codes_path = self.dir / "codes.i8"
+        self._scales_path = self.dir / "scales.f32"
+        self.quantization = quantization
+        self.rerank_factor = max(1, rerank_factor)
+        self._lock = threading.RLock()
+        # Token rewritten by every write, so other processes know to reload the row bookkeeping
+        # 每次写入都会重写的令牌，使其他进程知道需要重新加载行记录
+        self._generation_path = self.dir / "generation"
+        self._file_lock = FileLock(self.dir / "lock")
+        self._generation = None
+
+        self._db = sqlite3.connect(str(self.dir / "meta.sqlite3"), check_same_thread=False)
+        self.dtype = np.dtype(dtype)
+        self._vectors = None
+        self._norms = None
+        self._codes = None
+        self._scales = None
+
+        with self._lock, self._file_lock:
+            self._db.execute("CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, metadata TEXT, document TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.commit()
+            info = self._load()
+            if self._row_of:
+                logger.info(f"Loaded matrix collection '{self.name}' with {len(self._row_of)} vectors")
+            if self.quantization and self._capacity and info.get("quantization") != self.quantization:
+                self._build_codes()
+            elif not self.quantization and "quantization" in info:
+                # Rows written without quantization would leave the codes stale; they are rebuilt when re-enabled
+                # 未启用量化时写入的行会使编码过期；重新启用时将重建编码
+                self._db.execute("DELETE FROM info WHERE key = 'quantization'")
+                self._db.commit()
+
+    def _read_generation(self) -> str:
+        try:
+            return self._generation_path.read_text(encoding="utf-8")
+        except OSError:
+            return ""
+
+    def _bump_generation(self):
+        self._generation = uuid.uuid4().hex
+        self._generation_path.write_text(self._generation, encoding="utf-8")
+
+    def _load(self) -> dict:
+        """
+        (Re)build the row bookkeeping from the metadata table; called with the file lock held.
+        根据元数据表 (重新) 构建行记录；调用时须持有文件锁。
+
+        Returns:
+            dict: The collection info table. 集合信息表。
+        """
+        self._generation = self._read_generation()
+        info = dict(self._db.execute("SELECT key, value FROM info"))
+        self.dtype = np.dtype(info.get("dtype", self.dtype))
+        self._dim = int(info["dim"]) if "dim" in info else None
+        self._capacity = int(info.get("capacity", 0))
+        self._vectors = self._norms = self._codes = self._scales = None
+
+        # Row bookkeeping: id -> row, row -> id, and the mask of live rows
+        # 行记录：ID -> 行号、行号 -> ID，以及存活行掩码
+        self._row_of = {}
+        self._ids = np.empty(self._capacity, dtype=object)
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        if self._capacity:
+            self._open_arrays()
+            for row, doc_id in self._db.execute("SELECT row, id FROM rows"):
+                self._row_of[doc_id] = row
+                self._ids[row] = doc_id
+                self._alive[row] = True
+        self._free = [r for r in range(self._capacity - 1, -1, -1) if not self._alive[r]]
+        # Scans stop at the highest row ever used
+        # 扫描在曾使用过的最高行处停止
+        self._n_rows = int(np.flatnonzero(self._alive).max()) + 1 if self._row_of else 0
+        return info
+
+    def _sync(self):
+        # Called with `_lock` held: pick up rows written by other processes
+        # 调用时须持有 `_lock`：获取其他进程写入的行
+        if self._read_generation() != self._generation:
+            with self._file_lock:
+                if self._read_generation() != self._generation:
+                    for arr in (self._vectors, self._norms, self._codes, self._scales):
+                        if arr is not None:
+                            arr.flush()
+                    self._load()
+
+    def _build_codes(self):
+        # Quantization was just enabled on an existing collection: encode all rows once
+        # 已有集合刚启用量化：一次性编码所有行
+        logger.info(f"Quantizing {len(self._row_of)} vectors of '{self.name}' to int8")
+        for start in range(0, self._n_rows, self.scan_block):
+            end = min(start + self.scan_block, self._n_rows)
+            self._encode_rows(np.arange(start, end), np.asarray(self._vectors[start:end], dtype=np.float32))
+        self._codes.flush()
+        self._scales.flush()
+        self._db.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", ("quantization", self.quantization))
+        self._db.commit()
+
+    def _encode_rows(self, rows: np.ndarray, vectors: np.ndarray):
+        # Symmetric per-row int8 quantization: x ~= code * scale, scale = max|x| / 127
+        # 逐行对称 int8 量化：x ~= code * scale，scale = max|x| / 127
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        self._codes[rows] = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        self._scales[rows] = scales
+
+    def _open_arrays(self):
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(self._capacity, self._dim))
+        self._norms = np.memmap(self._norms_path, dtype=np.float32, mode="r+", shape=(self._capacity,))
+        if self.quantization:
+            for path, size in ((self._codes_path, self._capacity * self._dim), (self._scales_path, self._capacity * 4)):
+                if not path.exists() or path.stat().st_size < size:
+                    with open(path, "ab") as f:
+                        f.truncate(size)
+            self._codes = np.memmap(self._codes_path, dtype=np.int8, mode="r+", shape=(self._capacity, self._dim))
+            self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r+", shape=(self._capacity,))
+
+    def _grow(self, needed: int):
+        new_capacity = max(self.INITIAL_CAPACITY, self._capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        if new_capacity == self._capacity:
+            return
+        for arr in (self._vectors, self._norms, self._codes, self._scales):
+            if arr is not None:
+                arr.flush()
+        self._vectors = self._norms = self._codes = self._scales = None
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self._dim * self.dtype.itemsize)
+        with open(self._norms_path, "ab") as f:
+            f.truncate(new_capacity * 4)
+        old_capacity = self._capacity
+        self._capacity = new_capacity
+        self._open_arrays()
+
+        ids = np.empty(new_capacity, dtype=object)
+        ids[:old_capacity] = self._ids
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:old_capacity] = self._alive
+        self._ids, self._alive = ids, alive
+        self._free = list(range(new_capacity - 1, old_capacity - 1, -1)) + self._free
+        info = [("dim", str(self._dim)), ("capacity", str(new_capacity)), ("dtype", self.dtype.name)]
+        if self.quantization and old_capacity == 0:
+            info.append(("quantization", self.quantization))
+        self._db.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", info)
+
+    def count(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._row_of)
+
+    def upsert(self, ids: list[str], embeddings, metadatas: list[dict] = None, documents: list[str] = None):
+        """
+        Insert or replace rows.
+        插入或替换行。
+        """
+        if not ids:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        with self._lock, self._file_lock:
+            self._sync()
+            if self._dim is None:
+                self._dim = embeddings.shape[1]
+            elif embeddings.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match collection dimension {self._dim}")
+
+            n_new = len({i for i in ids if i not in self._row_of})
+            if n_new > len(self._free):
+                self._grow(self._capacity - len(self._free) + n_new)
+
+            rows = []
+            for doc_id in ids:
+                row = self._row_of.get(doc_id)
+                if row is None:
+                    row = self._free.pop()
+                    self._row_of[doc_id] = row
+                    self._ids[row] = doc_id
+                    self._alive[row] = True
+                rows.append(row)
+            rows = np.asarray(rows)
+            self._vectors[rows] = embeddings.astype(self.dtype, copy=False)
+            stored = np.asarray(self._vectors[rows], dtype=np.float32)
+            self._norms[rows] = np.einsum("ij,ij->i", stored, stored)
+            if self.quantization:
+                self._encode_rows(rows, stored)
+            self._n_rows = max(self._n_rows, int(rows.max()) + 1)
+
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, metadata, document) VALUES (?, ?, ?, ?)",
+                [(int(row), doc_id,
+                  json.dumps(metadatas[i], ensure_ascii=False) if metadatas is not None and metadatas[i] is not None else None,
+                  documents[i] if documents is not None else None)
+                 for i, (row, doc_id) in enumerate(zip(rows, ids))]
+            )
+            self._commit()
+            self._bump_generation()
+
+    def _commit(self):
+        for arr in (self._vectors, self._norms, self._codes, self._scales):
+            if arr is not None:
+                arr.flush()
+        self._db.commit()
+
+    def _fetch(self, rows: list[int], include: list[str]) -> tuple:
+        # Metadata and documents of the given rows, in the given order
+        # 按给定顺序获取指定行的元数据与文档
+        if "metadatas" not in include and "documents" not in include:
+            return None, None
+        found = {}
+        rows = [int(r) for r in rows]
+        for start in range(0, len(rows), 900):
+            part = rows[start:start + 900]
+            query = f"SELECT row, metadata, document FROM rows WHERE row IN ({','.join('?' * len(part))})"
+            for row, metadata, document in self._db.execute(query, part):
+                found[row] = (json.loads(metadata) if metadata else None, document)
+        metadatas = [found[r][0] for r in rows] if "metadatas" in include else None
+        documents = [found[r][1] for r in rows] if "documents" in include else None
+        return metadatas, documents
+
+    def _where_rows(self, where: dict) -> set:
+        # Rows whose metadata satisfies `where`, evaluated by SQLite
+        # 由 SQLite 求出元数据满足 `where` 的行
+        sql, params = where_to_sql(where)
+        return {row for (row,) in self._db.execute(f"SELECT row FROM rows WHERE {sql}", params)}
+
+    def _allowed_mask(self, where: dict = None, ids: list[str] = None):
+        # Live rows restricted by `where` and `ids`, or None when unrestricted
+        # 受 `where` 与 `ids` 限定的存活行掩码；无限定时为 None
+        if where is None and ids is None:
+            return None
+        mask = self._alive.copy()
+        if ids is not None:
+            allowed = np.zeros_like(mask)
+            allowed[[self._row_of[i] for i in ids if i in self._row_of]] = True
+            mask &= allowed
+        if where is not None:
+            allowed = np.zeros_like(mask)
+            allowed[list(self._where_rows(where))] = True
+            mask &= allowed
+        return mask
+
+    def get(self, ids: list[str] = None, include: list[str] = ("metadatas", "documents"), limit: int = None, offset: int = 0,
+            where: dict = None) -> dict:
+        """
+        Fetch rows by id (all rows, paged by `limit`/`offset`, if `ids` is None); unknown ids are skipped.
+        按 ID 获取行（`ids` 为 None 时按 `limit`/`offset` 分页获取全部）；未知 ID 将被跳过。
+
+        A `where` clause (see `where_to_sql`) keeps only the rows whose metadata matches, before paging.
+        `where` 子句（见 `where_to_sql`）在分页前仅保留元数据匹配的行。
+        """
+        include = list(include)
+        with self._lock:
+            self._sync()
+            if ids is None:
+                ids = list(self._row_of)
+                if where is not None:
+                    rows = self._where_rows(where)
+                    ids = [i for i in ids if self._row_of[i] in rows]
+                ids = ids[offset:None if limit is None else offset + limit]
+            elif where is not None:
+                rows = self._where_rows(where)
+                ids = [i for i in ids if i in self._row_of and self._row_of[i] in rows]
+            found = [i for i in ids if i in self._row_of]
+            rows = [self._row_of[i] for i in found]
+            metadatas, documents = self._fetch(rows, include)
+            embeddings = np.asarray(self._vectors[rows], dtype=np.float32) if "embeddings" in include and rows else None
+        if "embeddings" in include and embeddings is None:
+            embeddings = np.empty((0, self._dim or 0), dtype=np.float32)
+        return {
+            "ids": found,
+            "embeddings": embeddings,
+            "metadatas": metadatas,
+            "documents": documents,
+            "uris": None,
+            "data": None,
+            "included": include,
+        }
+
+    def update(self, ids: list[str], metadatas: list[dict] = None, documents: list[str] = None):
+        """
+        Merge new metadata fields into existing rows (Chroma semantics); unknown ids are skipped.
+        将新的元数据字段合并到已有行（与 Chroma 语义一致）；未知 ID 将被跳过。
+        """
+        with self._lock, self._file_lock:
+            self._sync()
+            pairs = [(k, self._row_of[doc_id]) for k, doc_id in enumerate(ids) if doc_id in self._row_of]
+            if not pairs:
+                return
+            rows = [row for _, row in pairs]
+            current, _ = self._fetch(rows, ["metadatas"])
+            updates = []
+            for (k, row), old in zip(pairs, current):
+                metadata = dict(old or {})
+                if metadatas is not None:
+                    metadata.update(metadatas[k])
+                updates.append((json.dumps(metadata, ensure_ascii=False), row))
+            self._db.executemany("UPDATE rows SET metadata = ? WHERE row = ?", updates)
+            if documents is not None:
+                self._db.executemany("UPDATE rows SET document = ? WHERE row = ?", [(documents[k], row) for k, row in pairs])
+            self._db.commit()
+
+    def delete(self, ids: list[str]):
+        """
+        Delete rows by id; their slots are reused by later inserts.
+        按 ID 删除行；其位置会被后续插入复用。
+        """
+        with self._lock, self._file_lock:
+            self._sync()
+            rows = [self._row_of.pop(doc_id) for doc_id in ids if doc_id in self._row_of]
+            if not rows:
+                return
+            self._alive[rows] = False
+            self._ids[rows] = None
+            self._free.extend(rows)
+            self._db.executemany("DELETE FROM rows WHERE row = ?", [(int(r),) for r in rows])
+            self._db.commit()
+            self._bump_generation()
+
+    def _scan(self, queries: np.ndarray, k: int, block_dists, alive: np.ndarray = None):
+        """
+        Blocked top-k over the live rows, given a function computing squared-L2 distances of a row block.
+        在存活行上分块求 top-k；`block_dists` 计算一个行块的平方 L2 距离。
+
+        `alive` optionally narrows the live rows (filtered queries). 可选的 `alive` 掩码用于进一步限定存活行（过滤查询）。
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (rows, distances), each of shape (n_queries, k), nearest first.
+            (行号, 距离)，形状均为 (n_queries, k)，按距离升序。
+        """
+        alive = self._alive if alive is None else alive
+        n_queries = len(queries)
+        best_rows = np.empty((n_queries, 0), dtype=np.int64)
+        best_dists = np.empty((n_queries, 0), dtype=np.float32)
+        for start in range(0, self._n_rows, self.scan_block):
+            end = min(start + self.scan_block, self._n_rows)
+            dists = block_dists(start, end)
+            dists[:, ~alive[start:end]] = np.inf
+
+            rows = np.broadcast_to(np.arange(start, end), dists.shape)
+            if end - start > k:
+                part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+                dists = np.take_along_axis(dists, part, axis=1)
+                rows = np.take_along_axis(rows, part, axis=1)
+            best_dists = np.concatenate([best_dists, dists], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_dists.shape[1] > k:
+                part = np.argpartition(best_dists, k - 1, axis=1)[:, :k]
+                best_dists = np.take_along_axis(best_dists, part, axis=1)
+                best_rows = np.take_along_axis(best_rows, part, axis=1)
+
+        order = np.argsort(best_dists, axis=1, kind="stable")
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_dists, order, axis=1)
+
+    def _exact_rows(self, queries: np.ndarray, query_norms: np.ndarray, rows: np.ndarray, k: int):
+        # Exact top-k over an explicit, small set of rows
+        # 在显式给定的少量行上精确求 top-k
+        vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+        dists = query_norms[:, None] + self._norms[rows][None, :] - 2.0 * (queries @ vectors.T)
+        order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        return rows[order], np.take_along_axis(dists, order, axis=1)
+
+    def _top_k(self, queries: np.ndarray, k: int, alive: np.ndarray = None):
+        """
+        Top-k squared-L2 neighbours of each query: an exact float scan, or an int8 scan plus exact re-rank.
+        每个查询的 top-k 平方 L2 近邻：精确浮点扫描，或 int8 扫描加精确重排。
+
+        With an `alive` mask only those rows are searched; a selective mask is scored directly on its rows.
+        给定 `alive` 掩码时仅检索这些行；选择性较强的掩码直接在其行上打分。
+        """
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        if alive is not None:
+            rows = np.flatnonzero(alive[:self._n_rows])
+            if len(rows) <= self.scan_block:
+                return self._exact_rows(queries, query_norms, rows, k)
+
+        def float_dists(start, end):
+            block = self._vectors[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            # ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x
+            return query_norms[:, None] + self._norms[start:end][None, :] - 2.0 * (queries @ block.T)
+
+        if not self.quantization:
+            return self._scan(queries, k, float_dists, alive)
+
+        def int8_dists(start, end):
+            # Asymmetric distance: float query against the dequantized codes, with the exact row norms
+            # 非对称距离：浮点查询对反量化编码，并使用精确的行范数
+            dots = (queries @ self._codes[start:end].T.astype(np.float32)) * self._scales[start:end][None, :]
+            return query_norms[:, None] + self._norms[start:end][None, :] - 2.0 * dots
+
+        n_live = len(self._row_of) if alive is None else int(alive.sum())
+        n_candidates = min(k * self.rerank_factor, n_live)
+        candidates, _ = self._scan(queries, n_candidates, int8_dists, alive)
+
+        # Exact re-rank of the candidates from the float matrix
+        # 基于浮点矩阵精确重排候选
+        best_rows = np.empty((len(queries), k), dtype=np.int64)
+        best_dists = np.empty((len(queries), k), dtype=np.float32)
+        for i, rows in enumerate(candidates):
+            # Sorted rows read the memory map sequentially
+            # 排序后的行号使内存映射按顺序读取
+            rows = np.sort(rows)
+            vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+            dists = query_norms[i] + self._norms[rows] - 2.0 * (vectors @ queries[i])
+            dists[~(self._alive if alive is None else alive)[rows]] = np.inf
+            order = np.argsort(dists, kind="stable")[:k]
+            best_rows[i], best_dists[i] = rows[order], dists[order]
+        return best_rows, best_dists
+
+    def query(self, query_embeddings, n_results: int = 10, include: list[str] = ("metadatas", "documents", "distances"),
+              where: dict = None, ids: list[str] = None) -> dict:
+        """
+        Nearest-neighbour search, returning the same dict shape as a Chroma query.
+        近邻检索，返回与 Chroma 查询相同形状的字典。
+
+        `where` and `ids` restrict the searched rows as in Chroma, so top-k is exact within the subset.
+        `where` 与 `ids` 与 Chroma 一样限定被检索的行，使 top-k 在子集内保持精确。
+        """
+        include = list(include)
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock:
+            self._sync()
+            alive = self._allowed_mask(where, ids)
+            k = min(n_results, len(self._row_of) if alive is None else int(alive.sum()))
+            if k > 0:
+                rows, dists = self._top_k(queries, k, alive)
+            else:
+                rows = np.empty((len(queries), 0), dtype=np.int64)
+                dists = np.empty((len(queries), 0), dtype=np.float32)
+
+            results = {"ids": [], "embeddings": None, "documents": [], "uris": None, "included": include,
+                       "data": None, "metadatas": [], "distances": []}
+            for q_rows, q_dists in zip(rows, dists):
+                # Guard against rows masked out with an infinite distance
+                # 排除被掩码为无穷距离的行
+                keep = np.isfinite(q_dists)
+                q_rows, q_dists = q_rows[keep], q_dists[keep]
+                metadatas, documents = self._fetch(q_rows.tolist(), include)
+                results["ids"].append([self._ids[r] for r in q_rows])
+                results["distances"].append(np.maximum(q_dists, 0.0).tolist())
+                results["metadatas"].append(metadatas)
+                results["documents"].append(documents)
+        for key in ("metadatas", "documents", "distances"):
+            if key not in include:
+                results[key] = None
+        return results
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from agent.config import Config
+
+class QueryCache:
+    """
+    In-process LRU cache of query string to embedding.
+    进程内的查询字符串到嵌入向量的 LRU 缓存。
+
+    Repeated queries skip tokenization, hashing and the persistent cache entirely.
+    重复查询将完全跳过分词、哈希与持久化缓存。
+    """
+    def __init__(self, max_entries: int = Config.QUERY_CACHE_SIZE):
+        """
+        Args:
+            max_entries (int): Maximum number of cached queries. 最大缓存查询数。
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, queries: list[str], encode):
+        """
+        Return embeddings for `queries`, calling `encode` once on the distinct queries that are not cached.
+        返回 `queries` 的嵌入，仅对未缓存的不同查询调用一次 `encode`。
+
+        Args:
+            queries (list[str]): Query strings. 查询字符串。
+            encode (callable): Function mapping a list of queries to an embedding array. 将查询列表映射为嵌入数组的函数。
+
+        Returns:
+            np.ndarray: float32 array of shape (len(queries), dim). 形状为 (len(queries), dim) 的 float32 数组。
+        """
+        found = {}
+        with self._lock:
+            for q in queries:
+                vec = self._entries.get(q)
+                if vec is not None:
+                    self._entries.move_to_end(q)
+                    found[q] = vec
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+        missing = list(dict.fromkeys(q for q in queries if q not in found))
+        if missing:
+            vectors = np.asarray(encode(missing), dtype=np.float32)
+            with self._lock:
+                for q, vec in zip(missing, vectors):
+                    found[q] = vec
+                    self._entries[q] = vec
+                    self._entries.move_to_end(q)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return np.stack([found[q] for q in queries])
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters.
+        命中/未命中计数。
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
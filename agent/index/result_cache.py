@@ -0,0 +1,92 @@
+import copy
+import threading
+from collections import OrderedDict
+from agent.config import Config
+
+class ResultCache:
+    """
+    Bounded LRU cache of search results, tagged with the index generation they were computed at.
+    有界的检索结果 LRU 缓存，每条结果记录其计算时的索引代数。
+
+    An entry computed with a larger `top_k` also answers smaller `top_k` requests for the same key,
+    since nearest-neighbour results are ordered by distance. Callers whose results are not such prefixes
+    include `top_k` in the key.
+    由于近邻结果按距离排序，以较大 `top_k` 计算的条目也可满足同一键较小 `top_k` 的请求。
+    结果不满足这一前缀关系的调用方应将 `top_k` 纳入键中。
+    """
+    def __init__(self, max_entries: int = Config.SEARCH_RESULT_CACHE_SIZE):
+        """
+        Args:
+            max_entries (int): Maximum number of cached results. 最大缓存结果数。
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (generation, top_k, results)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _truncate(results: dict, top_k: int) -> dict:
+        # Keep the first `top_k` hits of each single-query Chroma result
+        # 保留每个单查询 Chroma 结果的前 `top_k` 个命中
+        return {
+            name: {k: [v[0][:top_k]] if isinstance(v, list) and v and isinstance(v[0], list) else v for k, v in result.items()}
+            for name, result in results.items()
+        }
+
+    def get(self, key: tuple, top_k: int, generation):
+        """
+        Look up a result; entries from an older index generation are dropped.
+        查找结果；来自旧索引代数的条目将被丢弃。
+
+        Returns:
+            dict | None: A copy of the cached result, or None on a miss. 缓存结果的副本，未命中时为 None。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != generation:
+                del self._entries[key]
+                entry = None
+            if entry is None or entry[1] < top_k:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            results = entry[2] if entry[1] == top_k else self._truncate(entry[2], top_k)
+            return copy.deepcopy(results)
+
+    def put(self, key: tuple, top_k: int, generation, results: dict):
+        """
+        Store a result computed at `generation`.
+        存储在 `generation` 代数下计算的结果。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation and entry[1] > top_k:
+                return
+            self._entries[key] = (generation, top_k, copy.deepcopy(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters and occupancy.
+        命中/未命中计数及占用情况。
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
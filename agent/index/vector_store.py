@@ -1,93 +1,498 @@
-import chromadb
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
 from agent.config import Config
+from agent.index.filters import SearchFilter
+from agent.index.lexical_index import LexicalIndex
 from agent.utils.logging import setup_logger
 
 logger = setup_logger(__name__)
 
 class VectorStore:
     """
-    Wrapper for ChromaDB vector store.
-    ChromaDB 向量数据库的封装类。
+    Wrapper for the vector store: ChromaDB, or the exact in-memory matrix backend.
+    向量数据库的封装类：ChromaDB 或精确的内存矩阵后端。
     """
-    def __init__(self, persist_dir: str = str(Config.INDEX_DIR)):
+    def __init__(self, persist_dir: str = str(Config.INDEX_DIR), backend: str = None):
         """
         Initialize the VectorStore.
         初始化向量数据库。
 
         Args:
             persist_dir (str): Directory to persist data. 数据持久化目录。
+            backend (str, optional): "chroma" or "memory". Defaults to Config.VECTOR_BACKEND. 后端类型，默认为 Config.VECTOR_BACKEND。
         """
-        logger.info(f"Initializing VectorStore at {persist_dir}")
-        self.client = chromadb.PersistentClient(path=persist_dir)
-        
-        self.papers_files = self.client.get_or_create_collection(name=Config.COLLECTION_PAPERS_FILES)
-        self.papers_chunks = self.client.get_or_create_collection(name=Config.COLLECTION_PAPERS_CHUNKS)
-        self.images = self.client.get_or_create_collection(name=Config.COLLECTION_IMAGES)
+        self.backend = backend or Config.VECTOR_BACKEND
+        logger.info(f"Initializing VectorStore at {persist_dir} ({self.backend} backend)")
+        self.persist_dir = persist_dir
+
+        if self.backend == "memory":
+            from agent.index.matrix_store import MatrixCollection
+
+            # Each collection keeps its own matrix; the directories are separate from Chroma's files
+            # 每个集合各自维护矩阵；目录与 Chroma 的文件相互独立
+            self.client = None
+            self.state_dir = Path(persist_dir) / "matrix"
+            self.papers_files = MatrixCollection(self.state_dir / Config.COLLECTION_PAPERS_FILES)
+            self.papers_chunks = MatrixCollection(self.state_dir / Config.COLLECTION_PAPERS_CHUNKS)
+            self.images = MatrixCollection(self.state_dir / Config.COLLECTION_IMAGES)
+            self.write_batch_size = Config.VECTOR_WRITE_BATCH_SIZE
+        elif self.backend == "chroma":
+            # Imported on first use to keep CLI startup fast
+            # 首次使用时才导入，以加快命令行启动
+            import chromadb
+
+            self.client = chromadb.PersistentClient(path=persist_dir)
+            self.state_dir = Path(persist_dir)
+
+            self.papers_files = self.client.get_or_create_collection(name=Config.COLLECTION_PAPERS_FILES)
+            self.papers_chunks = self.client.get_or_create_collection(name=Config.COLLECTION_PAPERS_CHUNKS)
+            self.images = self.client.get_or_create_collection(name=Config.COLLECTION_IMAGES)
+
+            # Largest upsert Chroma accepts in one call bounds the write batch size
+            # Chroma 单次写入允许的最大批次限制了写入批大小
+            max_batch = getattr(self.client, "get_max_batch_size", lambda: Config.VECTOR_WRITE_BATCH_SIZE)()
+            self.write_batch_size = min(Config.VECTOR_WRITE_BATCH_SIZE, max_batch)
+        else:
+            raise ValueError(f"Unknown vector backend: {self.backend}")
+
+        # Index generation: bumped by every write so result caches never serve stale results.
+        # The token file also reflects writes made by other processes on the same index.
+        # 索引代数：每次写入都会递增，使结果缓存不会返回过期结果；令牌文件同时反映其他进程对同一索引的写入。
+        self._generation = 0
+        self._generation_path = self.state_dir / Config.INDEX_GENERATION_NAME
+
+        # BM25 index over the chunk texts, kept in step with the papers_chunks collection
+        # 片段文本的 BM25 索引，与 papers_chunks 集合同步更新
+        self.lexical = LexicalIndex(self.state_dir / Config.LEXICAL_INDEX_NAME) if Config.USE_LEXICAL_INDEX else None
+        # Concurrent searches must not backfill the lexical index twice 并发检索不能重复回填词法索引
+        self._lexical_backfill_lock = threading.Lock()
+        # Ids matching filename/directory filters: (collection, filter key) -> (index generation, ids)
+        # 匹配文件名/目录过滤器的 ID：(集合, 过滤器键) -> (索引代数, ID 列表)
+        self._filter_ids = OrderedDict()
+        self._filter_ids_lock = threading.Lock()
+
+    @property
+    def generation(self) -> tuple:
+        """
+        Current index generation; changes whenever the index is written.
+        当前索引代数；每次写入索引时改变。
+        """
+        try:
+            token = self._generation_path.read_text(encoding="utf-8")
+        except OSError:
+            token = ""
+        return self._generation, token
+
+    def _bump_generation(self):
+        self._generation += 1
+        try:
+            self._generation_path.write_text(uuid.uuid4().hex, encoding="utf-8")
+        except OSError as e:
+            logger.warning(f"Failed to update index generation file: {e}")
+
+    def _upsert(self, collection, ids: list[str], embeddings, metadatas: list[dict], documents: list[str] = None):
+        """
+        Upsert rows in slices of `write_batch_size`, passing embeddings as one float32 array.
+        按 `write_batch_size` 分片写入，嵌入以单个 float32 数组传入（无逐行 tolist 拷贝）。
+        """
+        if not ids:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        step = self.write_batch_size
+        for start in range(0, len(ids), step):
+            end = start + step
+            collection.upsert(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=metadatas[start:end],
+                documents=documents[start:end] if documents is not None else None
+            )
+        if collection is self.papers_chunks and self.lexical is not None and documents is not None:
+            self.lexical.add(ids, documents)
+        self._bump_generation()
+
+    def copy_from(self, source: "VectorStore"):
+        """
+        Copy every collection and the ingest manifests of another store, e.g. to switch backends.
+        复制另一个存储的所有集合及摄入清单，例如用于切换后端。
+
+        Args:
+            source (VectorStore): Store to copy from. 复制来源。
+        """
+        for name in ("papers_files", "papers_chunks", "images"):
+            src, dst = getattr(source, name), getattr(self, name)
+            total, offset = src.count(), 0
+            while offset < total:
+                page = src.get(include=["embeddings", "metadatas", "documents"], limit=self.write_batch_size, offset=offset)
+                if not page["ids"]:
+                    break
+                documents = page["documents"] if any(d is not None for d in page["documents"]) else None
+                self._upsert(dst, page["ids"], page["embeddings"], page["metadatas"], documents)
+                offset += len(page["ids"])
+            logger.info(f"Copied {offset} entries of '{name}'")
+        for manifest_name in (Config.PAPER_MANIFEST_NAME, Config.IMAGE_MANIFEST_NAME):
+            if (source.state_dir / manifest_name).exists():
+                shutil.copyfile(source.state_dir / manifest_name, self.state_dir / manifest_name)
+
+    def writer(self, batch_size: int = None) -> "BufferedWriter":
+        """
+        Create a buffered writer that groups upserts into large batches.
+        创建一个将写入合并为大批次的缓冲写入器。
+
+        Args:
+            batch_size (int, optional): Rows buffered before a flush. Defaults to `write_batch_size`. 触发写入前缓冲的行数。
+        """
+        return BufferedWriter(self, batch_size or self.write_batch_size)
 
     def add_paper_file(self, doc_id: str, embedding, metadata: dict):
         """
         Add a paper file entry.
         添加论文文件条目。
         """
-        self.papers_files.upsert(
-            ids=[doc_id],
-            embeddings=[embedding.tolist()],
-            metadatas=[metadata]
-        )
+        self._upsert(self.papers_files, [doc_id], np.asarray(embedding)[None, :], [metadata])
+
+    def add_paper_files(self, doc_ids: list[str], embeddings, metadatas: list[dict]):
+        """
+        Add several paper file entries in one upsert.
+        在一次写入中添加多个论文文件条目。
+        """
+        self._upsert(self.papers_files, doc_ids, embeddings, metadatas)
 
     def add_paper_chunks(self, ids: list[str], embeddings, metadatas: list[dict], documents: list[str]):
         """
         Add paper chunks.
         添加论文片段。
         """
-        if not ids:
-            return
-        self.papers_chunks.upsert(
-            ids=ids,
-            embeddings=[e.tolist() for e in embeddings],
-            metadatas=metadatas,
-            documents=documents
-        )
+        self._upsert(self.papers_chunks, ids, embeddings, metadatas, documents)
 
     def add_images(self, ids: list[str], embeddings, metadatas: list[dict]):
         """
         Add image embeddings.
         添加图像嵌入。
         """
+        self._upsert(self.images, ids, embeddings, metadatas)
+
+    def get_paper_file_embeddings(self, doc_ids: list[str]) -> dict:
+        """
+        Fetch stored file embeddings.
+        获取已存储的文件嵌入。
+
+        Returns:
+            dict: Mapping of doc id to embedding for the ids that exist. 已存在 ID 到嵌入的映射。
+        """
+        if not doc_ids:
+            return {}
+        result = self.papers_files.get(ids=doc_ids, include=["embeddings"])
+        return {doc_id: np.asarray(e, dtype=np.float32) for doc_id, e in zip(result["ids"], result["embeddings"])}
+
+    def get_paper_chunks(self, chunk_ids: list[str]) -> list[dict]:
+        """
+        Fetch stored chunks (text plus metadata) in the order of `chunk_ids`.
+        按 `chunk_ids` 顺序获取已存储的片段（文本及元数据）。
+        """
+        if not chunk_ids:
+            return []
+        result = self.papers_chunks.get(ids=chunk_ids, include=["documents", "metadatas"])
+        by_id = {i: dict(m, text=d) for i, d, m in zip(result["ids"], result["documents"], result["metadatas"])}
+        return [by_id[i] for i in chunk_ids if i in by_id]
+
+    def update_paper_metadata(self, doc_ids: list[str], chunk_ids: list[list[str]], metadatas: list[dict]):
+        """
+        Update metadata fields of paper file entries and their chunks without re-embedding.
+        更新论文文件条目及其片段的元数据字段，无需重新嵌入。
+
+        Args:
+            doc_ids (list[str]): File entry ids. 文件条目 ID。
+            chunk_ids (list[list[str]]): Chunk ids of each file. 每个文件的片段 ID。
+            metadatas (list[dict]): Fields to set on each file and its chunks. 每个文件及其片段需更新的字段。
+        """
+        if not doc_ids:
+            return
+        self.papers_files.update(ids=doc_ids, metadatas=metadatas)
+        flat_ids, flat_metadatas = [], []
+        for ids, metadata in zip(chunk_ids, metadatas):
+            flat_ids.extend(ids)
+            flat_metadatas.extend([metadata] * len(ids))
+        if flat_ids:
+            self.papers_chunks.update(ids=flat_ids, metadatas=flat_metadatas)
+        self._bump_generation()
+
+    def delete_paper(self, doc_id: str, chunk_ids: list[str]):
+        """
+        Delete a paper file entry and its chunks.
+        删除论文文件条目及其片段。
+        """
+        self.papers_files.delete(ids=[doc_id])
+        self.delete_paper_chunks(chunk_ids)
+
+    def delete_paper_chunks(self, chunk_ids: list[str]):
+        """
+        Delete paper chunks from the collection and the lexical index.
+        从集合与词法索引中删除论文片段。
+        """
+        if chunk_ids:
+            self.papers_chunks.delete(ids=chunk_ids)
+            if self.lexical is not None:
+                self.lexical.delete(chunk_ids)
+        self._bump_generation()
+
+    def delete_images(self, ids: list[str]):
+        """
+        Delete image embeddings.
+        删除图像嵌入。
+        """
         if not ids:
             return
-        self.images.upsert(
-            ids=ids,
-            embeddings=[e.tolist() for e in embeddings],
-            metadatas=metadatas
-        )
+        self.images.delete(ids=ids)
+        self._bump_generation()
 
-    def search_paper_files(self, query_embedding, n_results=5):
+    @staticmethod
+    def _as_queries(query_embedding):
+        # One query vector or a matrix of query vectors, as float32 rows
+        # 单个查询向量或查询向量矩阵，统一为 float32 行
+        return np.atleast_2d(np.asarray(query_embedding, dtype=np.float32))
+
+    @staticmethod
+    def split_results(results: dict) -> list[dict]:
         """
-        Search for paper files.
-        搜索论文文件。
+        Split a multi-vector query result into one single-query result per query vector.
+        将多向量查询结果拆分为每个查询向量各自的单查询结果。
+
+        Returns:
+            list[dict]: Results in the same shape as a single-query call. 与单查询调用形状相同的结果列表。
         """
-        return self.papers_files.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=n_results
-        )
+        n = len(results["ids"])
+        return [
+            {k: [v[i]] if isinstance(v, list) and len(v) == n and k != "included" else v for k, v in results.items()}
+            for i in range(n)
+        ]
+
+    def _matching_ids(self, collection, search_filter: SearchFilter) -> list[str]:
+        # Ids satisfying a filter with predicates that have no `where` form: the `where` part is
+        # evaluated by the index, the rest on the returned metadata. The scan is remembered until the next write.
+        # 求满足含非 `where` 谓词的过滤器的 ID：`where` 部分由索引执行，其余部分在返回的元数据上判断。扫描结果保留至下一次写入。
+        key = (collection.name, search_filter.key())
+        generation = self.generation
+        with self._filter_ids_lock:
+            cached = self._filter_ids.get(key)
+            if cached is not None and cached[0] == generation:
+                self._filter_ids.move_to_end(key)
+                return cached[1]
 
-    def search_paper_chunks(self, query_embedding, n_results=5):
+        where = search_filter.where()
+        matched, offset = [], 0
+        while True:
+            page = collection.get(where=where, include=["metadatas"], limit=self.write_batch_size, offset=offset)
+            if not page["ids"]:
+                break
+            matched.extend(i for i, meta in zip(page["ids"], page["metadatas"]) if search_filter.matches(meta))
+            offset += len(page["ids"])
+
+        with self._filter_ids_lock:
+            self._filter_ids[key] = (generation, matched)
+            self._filter_ids.move_to_end(key)
+            while len(self._filter_ids) > Config.FILTER_ID_CACHE_SIZE:
+                self._filter_ids.popitem(last=False)
+        return matched
+
+    def _query(self, collection, query_embedding, n_results: int, search_filter: SearchFilter = None) -> dict:
+        queries = self._as_queries(query_embedding)
+        if search_filter is None or search_filter.is_empty():
+            return collection.query(query_embeddings=queries, n_results=n_results)
+        ids = None
+        if search_filter.needs_id_scan():
+            ids = self._matching_ids(collection, search_filter)
+            if not ids:
+                return {"ids": [[] for _ in queries], "embeddings": None, "documents": [[] for _ in queries],
+                        "uris": None, "data": None, "metadatas": [[] for _ in queries],
+                        "distances": [[] for _ in queries], "included": ["metadatas", "documents", "distances"]}
+            n_results = min(n_results, len(ids))
+        return collection.query(query_embeddings=queries, n_results=n_results, where=search_filter.where(), ids=ids)
+
+    def search_paper_files(self, query_embedding, n_results=5, search_filter: SearchFilter = None):
         """
-        Search for paper chunks.
-        搜索论文片段。
+        Search for paper files. A 2-D `query_embedding` runs one multi-vector query.
+        搜索论文文件。二维 `query_embedding` 将作为一次多向量查询执行。
+
+        `search_filter` restricts the search inside the index; its page range does not apply to whole files.
+        `search_filter` 在索引内部限定检索范围；页码范围不适用于整篇文件。
+        """
+        if search_filter is not None:
+            search_filter = search_filter.without_pages()
+        return self._query(self.papers_files, query_embedding, n_results, search_filter)
+
+    def search_paper_chunks(self, query_embedding, n_results=5, search_filter: SearchFilter = None):
         """
-        return self.papers_chunks.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=n_results
-        )
+        Search for paper chunks. A 2-D `query_embedding` runs one multi-vector query.
+        搜索论文片段。二维 `query_embedding` 将作为一次多向量查询执行。
+
+        `search_filter` restricts the search inside the index. `search_filter` 在索引内部限定检索范围。
+        """
+        return self._query(self.papers_chunks, query_embedding, n_results, search_filter)
         
-    def search_images(self, query_embedding, n_results=5):
+    def search_images(self, query_embedding, n_results=5, search_filter: SearchFilter = None):
+        """
+        Search for images. A 2-D `query_embedding` runs one multi-vector query.
+        搜索图片。二维 `query_embedding` 将作为一次多向量查询执行。
+
+        `search_filter` restricts the search inside the index (filename and directory predicates).
+        `search_filter` 在索引内部限定检索范围（文件名与目录谓词）。
+        """
+        return self._query(self.images, query_embedding, n_results, search_filter)
+
+    def _ensure_lexical(self):
+        # Indexes created before the lexical index existed are backfilled once
+        # 对在词法索引出现之前创建的索引进行一次性回填
+        with self._lexical_backfill_lock:
+            if self.lexical.count() or not self.papers_chunks.count():
+                return
+            logger.info("Building the BM25 index over existing paper chunks...")
+            total, offset = self.papers_chunks.count(), 0
+            while offset < total:
+                page = self.papers_chunks.get(include=["documents"], limit=self.write_batch_size, offset=offset)
+                if not page["ids"]:
+                    break
+                self.lexical.add(page["ids"], page["documents"])
+                offset += len(page["ids"])
+
+    def search_paper_chunks_lexical(self, query: str, n_results=5) -> list[tuple]:
+        """
+        BM25 search over paper chunk texts.
+        在论文片段文本上进行 BM25 检索。
+
+        Returns:
+            list[tuple[str, float]]: (chunk id, BM25 score), best first. (片段 ID, BM25 分数)，按分数降序。
+        """
+        if self.lexical is None:
+            return []
+        self._ensure_lexical()
+        return self.lexical.search(query, n_results)
+
+    def score_paper_chunks(self, query_embedding, chunk_ids: list[str], n_results: int = None, keep_order: bool = False,
+                           search_filter: SearchFilter = None) -> dict:
+        """
+        Dense-score a given set of chunks against one query, returning a single-query result dict.
+        针对单个查询对给定片段集合进行稠密打分，返回单查询结果字典。
+
+        Args:
+            query_embedding: Query vector. 查询向量。
+            chunk_ids (list[str]): Candidate chunk ids. 候选片段 ID。
+            n_results (int, optional): Keep the best `n_results` by distance. 按距离保留前 `n_results` 个。
+            keep_order (bool): Keep the order of `chunk_ids` instead of sorting by distance. 保持 `chunk_ids` 的顺序而不按距离排序。
+            search_filter (SearchFilter, optional): Drop chunks that do not match. 丢弃不匹配的片段。
+
+        Returns:
+            dict: Same shape as `search_paper_chunks`, with squared-L2 distances. 与 `search_paper_chunks` 形状相同，距离为平方 L2。
+        """
+        entries = self.papers_chunks.get(ids=chunk_ids, include=["embeddings", "metadatas", "documents"]) if chunk_ids else None
+        if not entries or not entries["ids"]:
+            return {"ids": [[]], "embeddings": None, "documents": [[]], "uris": None, "data": None,
+                    "metadatas": [[]], "distances": [[]], "included": ["metadatas", "documents", "distances"]}
+        query = np.asarray(query_embedding, dtype=np.float32)
+        dists = ((np.asarray(entries["embeddings"], dtype=np.float32) - query) ** 2).sum(axis=1)
+        position = {chunk_id: i for i, chunk_id in enumerate(entries["ids"])}
+        if keep_order:
+            order = [position[c] for c in chunk_ids if c in position]
+        else:
+            order = np.argsort(dists, kind="stable").tolist()
+        if search_filter is not None:
+            order = [i for i in order if search_filter.matches(entries["metadatas"][i])]
+        order = order[:n_results] if n_results is not None else order
+        return {
+            "ids": [[entries["ids"][i] for i in order]],
+            "embeddings": None,
+            "documents": [[entries["documents"][i] for i in order]],
+            "uris": None,
+            "data": None,
+            "metadatas": [[entries["metadatas"][i] for i in order]],
+            "distances": [[float(dists[i]) for i in order]],
+            "included": ["metadatas", "documents", "distances"],
+        }
+
+class BufferedWriter:
+    """
+    Buffers file, chunk and image upserts and writes them to the VectorStore in large batches.
+    缓冲文件、片段和图像的写入，并以大批次写入 VectorStore。
+
+    Use as a context manager; everything still buffered is flushed on exit.
+    作为上下文管理器使用；退出时写入所有剩余的缓冲数据。
+    """
+    def __init__(self, store: VectorStore, batch_size: int):
+        self.store = store
+        self.batch_size = batch_size
+        self._buffers = {
+            "papers_files": self._new_buffer(),
+            "papers_chunks": self._new_buffer(),
+            "images": self._new_buffer(),
+        }
+        self._callbacks = []
+
+    @staticmethod
+    def _new_buffer():
+        return {"ids": [], "embeddings": [], "metadatas": [], "documents": [], "rows": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def _add(self, name: str, ids: list[str], embeddings, metadatas: list[dict], documents: list[str] = None):
+        if not ids:
+            return
+        buf = self._buffers[name]
+        buf["ids"].extend(ids)
+        # Whole blocks are kept and concatenated once at flush time
+        # 保留整块数组，在写入时一次性拼接
+        buf["embeddings"].append(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+        buf["metadatas"].extend(metadatas)
+        if documents is not None:
+            buf["documents"].extend(documents)
+        buf["rows"] += len(ids)
+        if buf["rows"] >= self.batch_size:
+            self.flush()
+
+    def add_paper_file(self, doc_id: str, embedding, metadata: dict):
+        self._add("papers_files", [doc_id], embedding, [metadata])
+
+    def add_paper_files(self, doc_ids: list[str], embeddings, metadatas: list[dict]):
+        self._add("papers_files", doc_ids, embeddings, metadatas)
+
+    def add_paper_chunks(self, ids: list[str], embeddings, metadatas: list[dict], documents: list[str]):
+        self._add("papers_chunks", ids, embeddings, metadatas, documents)
+
+    def add_images(self, ids: list[str], embeddings, metadatas: list[dict]):
+        self._add("images", ids, embeddings, metadatas)
+
+    def on_flush(self, callback):
+        """
+        Run `callback` once everything added so far has been written.
+        在此前添加的所有数据写入后执行 `callback`。
+        """
+        self._callbacks.append(callback)
+
+    def flush(self):
         """
-        Search for images.
-        搜索图片。
+        Write all buffered rows, then run the pending callbacks.
+        If a write fails the buffered rows and their callbacks are dropped and the error is raised.
+        写入所有缓冲行，然后执行待处理的回调。写入失败时丢弃缓冲行及其回调，并抛出异常。
         """
-        return self.images.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=n_results
-        )
+        buffers, callbacks = self._buffers, self._callbacks
+        self._buffers = {name: self._new_buffer() for name in buffers}
+        self._callbacks = []
+        for name, buf in buffers.items():
+            if not buf["ids"]:
+                continue
+            self.store._upsert(
+                getattr(self.store, name),
+                buf["ids"],
+                np.concatenate(buf["embeddings"]),
+                buf["metadatas"],
+                buf["documents"] or None
+            )
+        for callback in callbacks:
+            callback()
@@ -0,0 +1,190 @@
+import importlib
+import json
+import re
+import sys
+import warnings
+import numpy as np
+from agent.config import Config
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+# "torch": float32 PyTorch; "int8": dynamic int8 quantization of the linear layers (CPU only)
+# "torch"：float32 PyTorch；"int8"：线性层动态 int8 量化（仅 CPU）
+BACKENDS = ("torch", "int8")
+
+# Fixed inputs of the accuracy check, mixing English, Chinese, short queries and passage-like text
+# 精度检查使用的固定输入，混合英文、中文、短查询与段落式文本
+PROBE_TEXTS = [
+    "transformer architecture",
+    "graph neural networks for molecule property prediction",
+    "We propose a self-supervised method that learns visual representations without labels.",
+    "The convergence rate of stochastic gradient descent depends on the step size schedule and the noise variance.",
+    "Table 3 reports the BLEU scores on WMT14 English-German for all baselines.",
+    "a photo of a cat sleeping on a sofa",
+    "a diagram of a neural network",
+    "强化学习",
+    "基于注意力机制的机器翻译模型",
+    "本文提出了一种新的图像分割方法，在多个公开数据集上取得了最优结果。",
+    "深度学习在医学影像分析中的应用综述",
+    "一只在草地上奔跑的狗",
+]
+
+def probe_images(count: int = 8, size: int = 256, seed: int = 0):
+    """
+    Deterministic synthetic images for the accuracy check: smooth colour fields upsampled from random noise.
+    精度检查使用的确定性合成图像：由随机噪声上采样得到的平滑色块。
+    """
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        cells = 2 + i  # coarse to fine structure 从粗到细的结构
+        pixels = rng.integers(0, 256, size=(cells, cells, 3), dtype=np.uint8)
+        images.append(Image.fromarray(pixels).resize((size, size), Image.BICUBIC))
+    return images
+
+def configure_threads(threads: int = Config.EMBEDDER_THREADS):
+    """
+    Set the number of threads PyTorch uses for CPU inference (process-wide); None keeps the default.
+    设置 PyTorch CPU 推理使用的线程数（进程级）；None 表示保持默认值。
+    """
+    if not threads:
+        return
+    import torch
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+        logger.info(f"PyTorch CPU threads set to {threads}")
+
+def artifact_path(model_id: str, backend: str):
+    """
+    Where the converted model of `model_id` is cached; the accuracy report sits next to it as JSON.
+    `model_id` 转换后模型的缓存路径；精度报告以 JSON 形式存放在旁边。
+    """
+    slug = re.sub(r"[^0-9A-Za-z._-]+", "_", model_id).strip("_")
+    return Config.ACCELERATED_MODELS_DIR / f"{slug}-{backend}.pt"
+
+def _library_versions(packages: list[str]) -> dict:
+    versions = {}
+    for package in packages:
+        module = sys.modules.get(package) or importlib.import_module(package)
+        versions[package] = getattr(module, "__version__", "unknown")
+    return versions
+
+def compare_embeddings(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """
+    Row-wise cosine similarity between float and converted embeddings.
+    float 嵌入与转换后嵌入逐行的余弦相似度。
+
+    Returns:
+        dict: min_cosine, mean_cosine and top1_agreement (share of rows whose nearest reference row is unchanged).
+            最小余弦、平均余弦与 top1_agreement（最近邻参考行保持不变的比例）。
+    """
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = (reference * candidate).sum(axis=1)
+    # Does each converted row still retrieve its own float row first?
+    # 每个转换后的行是否仍最先检索到其对应的 float 行？
+    top1 = (candidate @ reference.T).argmax(axis=1) == np.arange(len(reference))
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean()), "top1_agreement": float(top1.mean())}
+
+def quantize_int8(module):
+    """
+    Replace every `nn.Linear` of `module` in place by a dynamically quantized int8 linear layer.
+    将 `module` 中的每个 `nn.Linear` 原地替换为动态量化的 int8 线性层。
+
+    Weights are quantized once; activations are quantized per batch at run time, so no calibration data is needed.
+    权重只量化一次；激活在运行时按批次量化，因此无需校准数据。
+    """
+    import torch
+    dtypes = {name: m.weight.dtype for name, m in module.named_modules() if isinstance(m, torch.nn.Linear)}
+    with warnings.catch_warnings():
+        # Eager-mode quantization is deprecated in favour of torchao, but still ships with torch
+        # eager 模式量化已被标记为弃用（推荐 torchao），但仍随 torch 提供
+        warnings.simplefilter("ignore")
+        module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    # Quantized layers have no float `weight`; open_clip reads `int8_original_dtype` instead to cast activations
+    # 量化层没有浮点 `weight`；open_clip 改为读取 `int8_original_dtype` 来确定激活的类型
+    for name, m in module.named_modules():
+        if name in dtypes and not isinstance(m, torch.nn.Linear):
+            m.int8_original_dtype = dtypes[name]
+    return module
+
+def load_accelerated(model_id: str, backend: str, load_float, probe, packages: list[str],
+                     min_cosine: float = Config.EMBEDDER_MIN_COSINE):
+    """
+    Load a model with a CPU inference backend, converting and checking it on first use.
+    以指定的 CPU 推理后端加载模型，首次使用时完成转换与精度检查。
+
+    The first load runs `probe` on the float model, converts it, runs `probe` again and compares the embeddings.
+    A model that passes is saved whole under `Config.ACCELERATED_MODELS_DIR`, so later loads skip both the
+    float weights and the conversion; one that fails is recorded and the float model is used from then on.
+    Artifacts are rebuilt when the torch or model library version changes.
+    首次加载时先在 float 模型上运行 `probe`，转换后再次运行并比较嵌入。通过检查的模型整体保存到
+    `Config.ACCELERATED_MODELS_DIR`，之后的加载既不读取 float 权重也不重复转换；未通过的结果会被记录，
+    此后直接使用 float 模型。torch 或模型库版本变化时重新转换。
+
+    Args:
+        model_id (str): Identifies the weights, e.g. model name and pretrained tag. 标识权重，例如模型名与预训练标签。
+        backend (str): One of `BACKENDS`. `BACKENDS` 之一。
+        load_float (callable): Builds the float model on the CPU. 在 CPU 上构建 float 模型。
+        probe (callable): Maps a model to embeddings of fixed inputs (np.ndarray). 将模型映射为固定输入的嵌入。
+        packages (list[str]): Libraries whose classes are pickled with the model. 模型序列化时涉及其类的库。
+        min_cosine (float): Lowest acceptable cosine between float and converted embeddings. 可接受的最小余弦相似度。
+
+    Returns:
+        tuple: (model, backend actually in use). (模型, 实际使用的后端)。
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedder backend: {backend}. Expected one of {BACKENDS}")
+    if backend == "torch":
+        return load_float(), "torch"
+
+    import torch
+    path = artifact_path(model_id, backend)
+    report_path = path.with_suffix(".json")
+    versions = _library_versions(["torch"] + packages)
+    report = None
+    if report_path.exists():
+        with open(report_path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        if report.get("versions") != versions:
+            logger.info(f"Cached {backend} model of {model_id} was built with {report.get('versions')}; converting again.")
+            report = None
+
+    if report is not None and report["min_cosine"] < min_cosine:
+        logger.warning(f"{backend} model of {model_id} failed the accuracy check "
+                       f"(min cosine {report['min_cosine']:.4f} < {min_cosine}); using float weights.")
+        return load_float(), "torch"
+    if report is not None and path.exists():
+        try:
+            # The artifact is a pickled module written by this function, not downloaded content
+            # 该文件是本函数写出的序列化模块，而非下载内容
+            model = torch.load(path, map_location="cpu", weights_only=False)
+            logger.info(f"Loaded {backend} model of {model_id} from {path}")
+            return model, backend
+        except Exception as e:
+            logger.warning(f"Could not load {path} ({e}); converting again.")
+
+    logger.info(f"Converting {model_id} to {backend}...")
+    model = load_float()
+    reference = np.asarray(probe(model))
+    model = quantize_int8(model)
+    report = compare_embeddings(reference, np.asarray(probe(model)))
+    report.update({"backend": backend, "model_id": model_id, "versions": versions})
+    passed = report["min_cosine"] >= min_cosine
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if passed:
+        tmp_path = path.with_suffix(".tmp")
+        torch.save(model, tmp_path)
+        tmp_path.replace(path)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    logger.info(f"{backend} accuracy of {model_id}: min cosine {report['min_cosine']:.4f}, "
+                f"mean cosine {report['mean_cosine']:.4f}, top-1 agreement {report['top1_agreement']:.0%}")
+    if not passed:
+        logger.warning(f"{backend} model of {model_id} is below the required cosine {min_cosine}; using float weights.")
+        return load_float(), "torch"
+    return model, backend
@@ -1,17 +1,105 @@
-import torch
-import open_clip
+import hashlib
+import os
+import threading
 from PIL import Image
 from agent.config import Config
+from agent.index.embedding_cache import EmbeddingCache
+from agent.index.query_cache import QueryCache
+from agent.models.query_scheduler import QueryScheduler
 from agent.utils.logging import setup_logger
 
 logger = setup_logger(__name__)
 
+def _read_tensors(checkpoint_path: str, keep) -> dict:
+    """
+    Read only the checkpoint tensors whose name passes `keep`, without materializing the rest.
+    只读取名称满足 `keep` 的检查点张量，其余张量不会载入内存。
+
+    safetensors files are read tensor by tensor; torch zip checkpoints are memory-mapped, so only the pages
+    of the selected tensors are ever read from disk.
+    safetensors 文件逐个张量读取；torch zip 检查点以内存映射方式打开，只有被选中张量所在的页会从磁盘读取。
+    """
+    import torch
+    if str(checkpoint_path).endswith(".safetensors"):
+        from safetensors import safe_open
+        with safe_open(str(checkpoint_path), framework="pt", device="cpu") as f:
+            return {k.removeprefix("module."): f.get_tensor(k) for k in f.keys() if keep(k.removeprefix("module."))}
+    try:
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError:
+        # Legacy (non-zip) checkpoints cannot be memory-mapped 旧格式（非 zip）检查点无法内存映射
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
+    if isinstance(checkpoint, dict) and "state_dict" in checkpoint:
+        checkpoint = checkpoint["state_dict"]
+    state = {k.removeprefix("module."): v for k, v in checkpoint.items()}
+    return {k: v for k, v in state.items() if keep(k)}
+
+def load_text_tower(model_name: str, pretrained: str = None, device: str = "cpu"):
+    """
+    Build only the text tower of an OpenCLIP model and load its weights from the full CLIP checkpoint.
+    仅构建 OpenCLIP 模型的文本编码器，并从完整的 CLIP 检查点中加载其权重。
+
+    The vision tower is neither constructed nor read from disk. Calling the returned module on token ids
+    gives the same features as `model.encode_text`.
+    视觉编码器既不构建也不从磁盘读取。以 token ID 调用返回的模块，得到与 `model.encode_text` 相同的特征。
+
+    Args:
+        model_name (str): Name of the OpenCLIP model. OpenCLIP 模型名称。
+        pretrained (str, optional): Pretrained tag or checkpoint file; None leaves the weights random. 预训练标签或检查点文件；None 表示随机初始化。
+        device (str): Device to place the tower on. 放置编码器的设备。
+
+    Returns:
+        torch.nn.Module: Text tower in eval mode. 处于 eval 模式的文本编码器。
+    """
+    from open_clip.factory import get_model_config
+    from open_clip.model import _build_text_tower
+    from open_clip.pretrained import download_pretrained, get_pretrained_cfg
+
+    model_cfg = get_model_config(model_name)
+    if model_cfg is None:
+        raise RuntimeError(f"No built-in OpenCLIP config for {model_name}")
+    checkpoint_path = None
+    if pretrained:
+        pretrained_cfg = get_pretrained_cfg(model_name, pretrained)
+        if pretrained_cfg:
+            checkpoint_path = download_pretrained(pretrained_cfg)
+        elif os.path.isfile(pretrained):
+            checkpoint_path = pretrained
+        else:
+            raise RuntimeError(f"Pretrained value '{pretrained}' is not a known tag or file for {model_name}")
+
+    text_cfg = dict(model_cfg["text_cfg"])
+    if "hf_model_name" in text_cfg:
+        # As in open_clip: base Hugging Face weights only when no CLIP checkpoint overrides them
+        # 与 open_clip 一致：仅在没有 CLIP 检查点覆盖时才加载 Hugging Face 基础权重
+        text_cfg["hf_model_pretrained"] = checkpoint_path is None
+    text = _build_text_tower(model_cfg["embed_dim"], text_cfg, quick_gelu=model_cfg.get("quick_gelu", False))
+
+    if checkpoint_path is not None:
+        expected = text.state_dict()
+        # Towers of custom-text models live under "text."; plain CLIP stores text weights at the top level
+        # 自定义文本模型的编码器位于 "text." 下；普通 CLIP 将文本权重存放在顶层
+        state = _read_tensors(checkpoint_path, lambda k: k in expected or (k.startswith("text.") and k[5:] in expected))
+        prefixed = {k[5:]: v for k, v in state.items() if k.startswith("text.")}
+        state = prefixed or state
+        missing = [k for k in expected if k not in state]
+        if missing:
+            raise RuntimeError(f"Text tower weights missing from {checkpoint_path}: {missing[:5]}")
+        text.load_state_dict(state)
+    return text.to(device).eval()
+
 class ImageEmbedder:
     """
     Wrapper for OpenCLIP image embedding model.
     OpenCLIP 图像嵌入模型的包装器。
+
+    With `load_vision=False` only the text tower is loaded, which is all text-to-image search needs; the full
+    model (vision tower and preprocessing) is loaded the first time images are embedded.
+    当 `load_vision=False` 时只加载文本编码器，这正是以文搜图所需的全部；完整模型（视觉编码器与预处理）
+    在首次嵌入图像时才加载。
     """
-    def __init__(self, model_name: str = Config.IMAGE_MODEL_NAME, pretrained: str = Config.IMAGE_MODEL_PRETRAINED, device: str = Config.DEVICE):
+    def __init__(self, model_name: str = Config.IMAGE_MODEL_NAME, pretrained: str = Config.IMAGE_MODEL_PRETRAINED, device: str = None, use_cache: bool = Config.USE_EMBEDDING_CACHE,
+                 backend: str = Config.EMBEDDER_BACKEND, load_vision: bool = True):
         """
         Initialize the ImageEmbedder.
         初始化 ImageEmbedder。
@@ -19,29 +107,178 @@ class ImageEmbedder:
         Args:
             model_name (str): Name of the OpenCLIP model. OpenCLIP 模型名称。
             pretrained (str): Pretrained weights name. 预训练权重名称。
-            device (str): Device to run the model on ('cpu' or 'cuda'). 运行模型的设备（'cpu' 或 'cuda'）。
+            device (str, optional): Device to run the model on ('cpu' or 'cuda'). Defaults to Config.DEVICE. 运行模型的设备（'cpu' 或 'cuda'），默认为 Config.DEVICE。
+            use_cache (bool): Whether to consult the persistent embedding cache. 是否使用持久化嵌入缓存。
+            backend (str): CPU inference backend, "torch" or "int8"; ignored on GPU. CPU 推理后端，"torch" 或 "int8"；GPU 上忽略。
+            load_vision (bool): Load the vision tower now; if False it is loaded on first image use. 是否立即加载视觉编码器；为 False 时在首次处理图像时加载。
         """
-        logger.info(f"Loading Image Embedder: {model_name} ({pretrained}) on {device}")
+        # Imported here so that importing this module does not pull in torch and open_clip
+        # 在此处导入，使导入本模块时不会加载 torch 与 open_clip
+        import open_clip
+        from agent.models.acceleration import configure_threads
+
+        device = device or Config.DEVICE
+        if device != "cpu" and backend != "torch":
+            logger.warning(f"Embedder backend '{backend}' only applies to CPU inference; using float weights on {device}.")
+            backend = "torch"
+        logger.info(f"Loading Image Embedder: {model_name} ({pretrained}) on {device} ({backend})")
+        configure_threads()
+        self.model_name = model_name
+        self.pretrained = pretrained
         self.device = device
-        self.model, _, self.preprocess = open_clip.create_model_and_transforms(model_name, pretrained=pretrained, device=device)
+        self.use_cache = use_cache
+        self.requested_backend = backend
+        self.backend = None
+        self.cache = None
+        self.query_cache = QueryCache()
         self.tokenizer = open_clip.get_tokenizer(model_name)
-        self.model.eval()
+        self._model = None
+        self._preprocess = None
+        self._text_tower = None
+        self._load_lock = threading.Lock()
+        # Serializes text encoding: the Hugging Face tokenizers of multilingual models are not thread-safe
+        # 串行化文本编码：多语言模型使用的 Hugging Face 分词器不是线程安全的
+        self._text_lock = threading.Lock()
+        # Query embeddings of concurrent callers are coalesced into batched forward passes
+        # 并发调用方的查询嵌入被合并为批量前向计算
+        self.scheduler = QueryScheduler(self.embed_text, name="image-text") if Config.QUERY_BATCHING else None
+
+        if not load_vision:
+            try:
+                self._load_text_tower()
+            except Exception as e:
+                logger.warning(f"Could not load the text tower of {model_name} alone ({e}); loading the full model.")
+        if self._text_tower is None:
+            self._load_model()
+
+    def _set_backend(self, backend: str):
+        # Image and text embeddings share one space, so they share one namespace
+        # 图像与文本嵌入处于同一空间，因此共用一个命名空间
+        if backend == self.backend:
+            return
+        if self.backend is not None:
+            # A different backend gives different vectors; drop queries embedded with the previous one
+            # 不同后端产生的向量不同；丢弃用之前后端嵌入的查询
+            self.query_cache = QueryCache()
+        self.backend = backend
+        namespace = f"{self.model_name}-{self.pretrained}"
+        if backend != "torch":
+            namespace += f"-{backend}"
+        self.cache = EmbeddingCache(namespace) if self.use_cache else None
+
+    def _load_text_tower(self):
+        from agent.models.acceleration import load_accelerated
+        logger.info(f"Loading the text tower of {self.model_name} only")
+        tower, backend = load_accelerated(
+            f"{self.model_name}-{self.pretrained}-text", self.requested_backend,
+            load_float=lambda: load_text_tower(self.model_name, self.pretrained, self.device),
+            probe=self._probe, packages=["open_clip"]
+        )
+        self._text_tower = tower.eval()
+        self._set_backend(backend)
+
+    def _load_model(self):
+        import open_clip
+        from open_clip.transform import PreprocessCfg, image_transform_v2
+        from agent.models.acceleration import load_accelerated
+
+        def load_float():
+            model = open_clip.create_model(self.model_name, pretrained=self.pretrained, device=self.device)
+            model.eval()
+            return model
+
+        model, backend = load_accelerated(
+            f"{self.model_name}-{self.pretrained}", self.requested_backend, load_float=load_float, probe=self._probe,
+            packages=["open_clip"]
+        )
+        model.eval()
+        # The preprocessing config travels with the model, so a converted model loaded from disk needs no float weights
+        # 预处理配置随模型保存，因此从磁盘加载转换后的模型无需 float 权重
+        self._preprocess = image_transform_v2(PreprocessCfg(**open_clip.get_model_preprocess_cfg(model)), is_train=False)
+        self._model = model
+        self._set_backend(backend)
+        # The full model has its own text tower 完整模型自带文本编码器
+        self._text_tower = None
+
+    def _ensure_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    logger.info(f"Loading the vision tower of {self.model_name}")
+                    self._load_model()
+        return self._model
 
-    def embed_images(self, images: list[Image.Image]):
+    @property
+    def model(self):
         """
-        Embed a list of PIL Images.
-        嵌入 PIL 图像列表。
+        The full OpenCLIP model, loaded on first access when the embedder started with the text tower only.
+        完整的 OpenCLIP 模型；若嵌入器仅以文本编码器启动，则在首次访问时加载。
+        """
+        return self._ensure_model()
+
+    @property
+    def preprocess(self):
+        """
+        OpenCLIP image preprocessing transform (loads the full model if needed).
+        OpenCLIP 图像预处理变换（必要时加载完整模型）。
+        """
+        self._ensure_model()
+        return self._preprocess
+
+    def _probe(self, model):
+        """
+        Embeddings of fixed images and texts, for the accuracy check of a converted model (texts only for a text tower).
+        固定图像与文本的嵌入，用于转换后模型的精度检查（文本编码器仅使用文本）。
+        """
+        import open_clip
+        import torch
+        from open_clip.transform import PreprocessCfg, image_transform_v2
+        from agent.models.acceleration import PROBE_TEXTS, probe_images
+        with torch.no_grad():
+            if not hasattr(model, "encode_image"):
+                return model(self.tokenizer(PROBE_TEXTS)).float().numpy()
+            preprocess = image_transform_v2(PreprocessCfg(**open_clip.get_model_preprocess_cfg(model)), is_train=False)
+            images = model.encode_image(torch.stack([preprocess(img) for img in probe_images()]))
+            texts = model.encode_text(self.tokenizer(PROBE_TEXTS))
+        return torch.cat([images, texts]).float().numpy()
+
+    def close(self):
+        """
+        Stop the query scheduler and persist pending embedding-cache writes; called when the shared instance is unloaded.
+        停止查询调度器并持久化嵌入缓存中待写入的内容；在共享实例被卸载时调用。
+        """
+        if self.scheduler is not None:
+            self.scheduler.close()
+        if self.cache is not None:
+            self.cache.flush()
+
+    @staticmethod
+    def image_key(img: Image.Image) -> bytes:
+        """
+        Cache key of a decoded image, derived from its pixel bytes.
+        根据像素字节计算已解码图像的缓存键。
+        """
+        header = f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode()
+        return EmbeddingCache.key_for_bytes(hashlib.sha256(header + img.tobytes()).digest())
+
+    def _encode_images(self, images: list[Image.Image]):
+        import torch
+        processed_images = [self.preprocess(img).unsqueeze(0) for img in images]
+        return self.encode_preprocessed(torch.cat(processed_images))
+
+    def encode_preprocessed(self, image_input):
+        """
+        Run the vision tower on an already preprocessed image batch (bypasses the cache).
+        对已预处理的图像批次运行视觉编码器（不经过缓存）。
 
         Args:
-            images (list[Image.Image]): List of images. 图像列表。
+            image_input (torch.Tensor): Batch of shape (N, 3, H, W), optionally in pinned memory. 形状为 (N, 3, H, W) 的批次，可位于锁页内存。
 
         Returns:
-            np.ndarray: Array of image embeddings. 图像嵌入数组。
+            np.ndarray: Array of normalized image embeddings. 归一化的图像嵌入数组。
         """
-        if not images:
-            return []
-        processed_images = [self.preprocess(img).unsqueeze(0) for img in images]
-        image_input = torch.cat(processed_images).to(self.device)
+        import torch
+        image_input = image_input.to(self.device, non_blocking=True)
         
         with torch.no_grad():
             # Use autocast if on cuda
@@ -53,7 +290,47 @@ class ImageEmbedder:
                 
             image_features /= image_features.norm(dim=-1, keepdim=True)
             
-        return image_features.cpu().numpy()
+        return image_features.float().cpu().numpy()
+
+    def _encode_text(self, text: list[str]):
+        import torch
+        # The standalone text tower when only it is loaded, otherwise the full model's
+        # 仅加载了文本编码器时使用独立的文本编码器，否则使用完整模型的
+        tower = self._text_tower
+        encode = tower if tower is not None else self.model.encode_text
+
+        with self._text_lock, torch.no_grad():
+            text_input = self.tokenizer(text).to(self.device)
+            if self.device == "cuda":
+                with torch.cuda.amp.autocast():
+                    text_features = encode(text_input)
+            else:
+                text_features = encode(text_input)
+                
+            text_features /= text_features.norm(dim=-1, keepdim=True)
+            
+        return text_features.float().cpu().numpy()
+
+    def embed_images(self, images: list[Image.Image], keys: list[bytes] = None):
+        """
+        Embed a list of PIL Images.
+        嵌入 PIL 图像列表。
+
+        Args:
+            images (list[Image.Image]): List of images. 图像列表。
+            keys (list[bytes], optional): Cache keys, e.g. hashes of the source file bytes. Derived from pixels if omitted.
+                缓存键，例如源文件字节的哈希；省略时根据像素计算。
+
+        Returns:
+            np.ndarray: Array of image embeddings. 图像嵌入数组。
+        """
+        if not images:
+            return []
+        if self.cache is None:
+            return self._encode_images(images)
+        if keys is None:
+            keys = [self.image_key(img) for img in images]
+        return self.cache.get_or_compute(keys, images, self._encode_images)
 
     def embed_text(self, text: list[str]):
         """
@@ -68,15 +345,24 @@ class ImageEmbedder:
         """
         if not text:
             return []
-        text_input = self.tokenizer(text).to(self.device)
-        
-        with torch.no_grad():
-            if self.device == "cuda":
-                with torch.cuda.amp.autocast():
-                    text_features = self.model.encode_text(text_input)
-            else:
-                text_features = self.model.encode_text(text_input)
-                
-            text_features /= text_features.norm(dim=-1, keepdim=True)
-            
-        return text_features.cpu().numpy()
+        if self.cache is None:
+            return self._encode_text(text)
+        keys = [EmbeddingCache.key_for_text(t) for t in text]
+        return self.cache.get_or_compute(keys, text, self._encode_text)
+
+    def embed_queries(self, queries: list[str]):
+        """
+        Embed text queries for image retrieval through the in-process query LRU cache.
+        通过进程内查询 LRU 缓存嵌入用于图像检索的文本查询。
+
+        Safe to call from many threads: with `Config.QUERY_BATCHING`, misses of concurrent callers are embedded together.
+        可从多个线程调用：启用 `Config.QUERY_BATCHING` 时，并发调用方未命中的查询一起嵌入。
+
+        Args:
+            queries (list[str]): Query strings. 查询字符串。
+
+        Returns:
+            np.ndarray: Array of text embeddings. 文本嵌入数组。
+        """
+        encode = self.scheduler.embed_queries if self.scheduler is not None else self.embed_text
+        return self.query_cache.get_or_compute(queries, encode)
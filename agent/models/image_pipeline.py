@@ -0,0 +1,119 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from agent.config import Config
+from agent.utils.hashing import file_sha256
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+# Preprocess transform of the current worker process, set by the pool initializer
+# 当前工作进程的预处理变换，由进程池初始化函数设置
+_worker_preprocess = None
+
+def _init_worker(preprocess):
+    import torch
+    global _worker_preprocess
+    _worker_preprocess = preprocess
+    # Each worker decodes one image at a time; avoid oversubscribing the cores used by the model
+    # 每个工作进程一次处理一张图片；避免与模型争用 CPU 核心
+    torch.set_num_threads(1)
+
+def _load_image(path: str, preprocess=None):
+    """
+    Decode, resize and normalize one image in a worker process.
+    在工作进程中解码、缩放并归一化一张图片。
+
+    Returns:
+        np.ndarray | None: Preprocessed CHW float32 array, or None if decoding failed. 预处理后的数组，解码失败时为 None。
+    """
+    try:
+        with Image.open(path) as img:
+            return (preprocess or _worker_preprocess)(img.convert("RGB")).numpy()
+    except Exception as e:
+        logger.error(f"Failed to open image {path}: {e}")
+        return None
+
+def hash_files(paths: list[str], workers: int = Config.IMAGE_DECODE_WORKERS) -> list:
+    """
+    Compute sha256 digests of files in parallel.
+    并行计算文件的 sha256 摘要。
+
+    Returns:
+        list: Hex digest per path, or None where the file could not be read. 每个路径的十六进制摘要，无法读取时为 None。
+    """
+    def safe_hash(path):
+        try:
+            return file_sha256(path)
+        except OSError as e:
+            logger.error(f"Failed to read image {path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(safe_hash, paths))
+
+def iter_preprocessed_batches(paths: list[str], preprocess, batch_size: int = Config.IMAGE_BATCH_SIZE,
+                              workers: int = Config.IMAGE_DECODE_WORKERS, prefetch: int = Config.IMAGE_PREFETCH_BATCHES,
+                              pin_memory: bool = False):
+    """
+    Decode and preprocess images in a process pool, yielding ready-to-encode tensor batches in order.
+    在进程池中解码和预处理图片，按顺序产出可直接编码的张量批次。
+
+    At most `prefetch` batches are in flight, so workers prepare the next batches while the caller runs
+    the model on the current one and memory stays bounded.
+    最多同时处理 `prefetch` 个批次：调用方在当前批次上运行模型时，工作进程准备后续批次，且内存有界。
+
+    Args:
+        paths (list[str]): Image paths. 图片路径。
+        preprocess (callable): OpenCLIP preprocess transform. OpenCLIP 预处理变换。
+        batch_size (int): Images per batch. 每批图片数。
+        workers (int): Decoder processes; 0 decodes in the calling process, as does a single batch. 解码进程数；0 表示在调用进程中解码，仅一个批次时同样如此。
+        prefetch (int): Maximum number of batches queued ahead of the consumer. 消费者之前最多排队的批次数。
+        pin_memory (bool): Place batches in pinned memory for faster host-to-GPU copies. 将批次放入锁页内存以加速拷贝到 GPU。
+
+    Yields:
+        tuple[list[int], torch.Tensor]: (Indices into `paths` that decoded successfully, stacked batch tensor).
+        (成功解码的 `paths` 索引, 堆叠后的批次张量)。
+    """
+    import torch
+    batches = [list(range(i, min(i + batch_size, len(paths)))) for i in range(0, len(paths), batch_size)]
+
+    def assemble(indices, arrays):
+        ok = [(i, a) for i, a in zip(indices, arrays) if a is not None]
+        if not ok:
+            return [], None
+        tensor = torch.from_numpy(np.stack([a for _, a in ok]))
+        if pin_memory:
+            tensor = tensor.pin_memory()
+        return [i for i, _ in ok], tensor
+
+    # A single batch does not repay starting the pool (each spawned worker imports torch)
+    # 单个批次不值得启动进程池（每个 spawn 出的工作进程都要导入 torch）
+    if workers <= 0 or len(batches) <= 1:
+        for indices in batches:
+            yield assemble(indices, [_load_image(str(paths[i]), preprocess) for i in indices])
+        return
+
+    # Workers are spawned rather than forked: the caller already holds the model and initialized OpenMP thread
+    # pools, which forked children can deadlock on. The initializer ships the transform to each worker.
+    # 工作进程以 spawn 而非 fork 方式创建：调用方已持有模型并初始化了 OpenMP 线程池，fork 出的子进程可能因此死锁。
+    # 初始化函数将预处理变换传给每个工作进程。
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(preprocess,)) as pool:
+        pending = deque()
+        batch_iter = iter(batches)
+
+        def submit_next():
+            indices = next(batch_iter, None)
+            if indices is not None:
+                pending.append((indices, [pool.submit(_load_image, str(paths[i])) for i in indices]))
+
+        for _ in range(max(1, prefetch)):
+            submit_next()
+        while pending:
+            indices, futures = pending.popleft()
+            arrays = [f.result() for f in futures]
+            submit_next()
+            yield assemble(indices, arrays)
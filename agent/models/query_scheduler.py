@@ -0,0 +1,200 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from agent.config import Config
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class QueryScheduler:
+    """
+    Coalesces query embeddings submitted concurrently from many threads into batched model calls.
+    将多个线程并发提交的查询嵌入合并为批量模型调用。
+
+    A single worker thread takes the first waiting request, gathers whatever else arrives within `window`
+    seconds (up to `max_batch` queries) and embeds the distinct queries in one forward pass. The window is only
+    waited for until the batch holds the expected number of requests, one less than the previous batch: under
+    steady load the last callers are picked up from the queue without waiting, and a lone caller is served at
+    once. The trade-off is that the first request after a burst waits up to one `window` (after which the
+    expectation is back to one), and that two alternating callers are not waited for, so they batch only when
+    they happen to be queued together.
+    Requests wait in a bounded queue: when it is full, `submit` blocks and eventually fails instead of letting work pile up.
+    单个工作线程取出第一个等待的请求，收集 `window` 秒内到达的其他请求（最多 `max_batch` 个查询），
+    并在一次前向计算中嵌入其中不同的查询。时间窗口只等待到本批的请求数达到预期数量（上一批的请求数减一）为止：
+    在稳定负载下最后的调用方可直接从队列中取得而无需等待，单独的调用方会立即得到处理。代价是突发之后的第一个请求
+    最多等待一个 `window`（之后预期回到一），且两个交替的调用方不会被等待，只有恰好同时排队时才会合批。
+    请求在有界队列中等待：队列满时 `submit` 会阻塞并最终失败，而不会无限堆积。
+    """
+    def __init__(self, embed, window: float = Config.QUERY_BATCH_WINDOW_MS / 1000, max_batch: int = Config.QUERY_BATCH_MAX,
+                 max_queue: int = Config.QUERY_QUEUE_SIZE, name: str = "queries"):
+        """
+        Args:
+            embed (callable): Maps a list of queries to an embedding array. 将查询列表映射为嵌入数组。
+            window (float): Seconds to wait for more requests after the first one. 收到第一个请求后等待更多请求的秒数。
+            max_batch (int): Maximum queries per model call (a larger single request is still run whole). 每次模型调用的最大查询数（单个更大的请求仍整体执行）。
+            max_queue (int): Maximum waiting requests. 等待中的请求数上限。
+            name (str): Name of the worker thread, for logs. 工作线程名称，用于日志。
+        """
+        self.embed = embed
+        self.window = window
+        self.max_batch = max_batch
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # Requests to wait for in the next batch, decayed from the previous batch size
+        # 下一批需要等待的请求数，由上一批的大小衰减而来
+        self._expected = 1
+        self._stopped = threading.Event()
+        self._stats = {"requests": 0, "queries": 0, "batches": 0, "forward_queries": 0}
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Query scheduler '{self.name}' is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"query-scheduler-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, queries: list[str], timeout: float = Config.QUERY_SUBMIT_TIMEOUT) -> Future:
+        """
+        Queue queries for embedding.
+        将查询加入嵌入队列。
+
+        Args:
+            queries (list[str]): Query strings. 查询字符串。
+            timeout (float, optional): Seconds to wait for room in a full queue; None waits indefinitely. 队列满时等待空位的秒数；None 表示一直等待。
+
+        Returns:
+            Future: Resolves to an array of shape (len(queries), dim). 结果为形状 (len(queries), dim) 的数组。
+
+        Raises:
+            TimeoutError: The queue stayed full for `timeout` seconds. 队列在 `timeout` 秒内一直是满的。
+            RuntimeError: The scheduler is closed. 调度器已关闭。
+        """
+        future = Future()
+        if not queries:
+            future.set_result(np.asarray(self.embed([]), dtype=np.float32))
+            return future
+        self._ensure_worker()
+        try:
+            self._queue.put((list(queries), future), timeout=timeout)
+        except queue.Full:
+            raise TimeoutError(f"Query scheduler '{self.name}' is overloaded: {self._queue.maxsize} requests "
+                               f"still waiting after {timeout}s") from None
+        if self._closed:
+            # Closed while this caller waited for room: once the worker has stopped, fail what it left behind
+            # 调用方等待空位期间调度器被关闭：待工作线程停止后，使其遗留的请求失败
+            self._stopped.wait()
+            self._fail_pending()
+        return future
+
+    def embed_queries(self, queries: list[str]) -> np.ndarray:
+        """
+        Embed queries through the scheduler, blocking until the result is ready.
+        通过调度器嵌入查询，阻塞直至结果就绪。
+        """
+        return self.submit(queries).result()
+
+    def _run(self):
+        try:
+            self._serve()
+        finally:
+            self._stopped.set()
+
+    def _serve(self):
+        stop = False
+        while not stop:
+            # `close` could not queue its wake-up item into a full queue; stop once the queue is drained
+            # `close` 无法向已满的队列放入唤醒项；队列清空后停止
+            if self._closed and self._queue.empty():
+                break
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, count = [item], len(item[0])
+            deadline = time.monotonic() + self.window
+            while count < self.max_batch:
+                # Past the window or with enough callers, still take requests that are already waiting
+                # 超过时间窗口或调用方已足够后，仍取走已在等待的请求
+                remaining = deadline - time.monotonic() if len(batch) < self._expected else 0
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                count += len(item[0])
+            self._expected = max(1, len(batch) - 1)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: list[tuple]):
+        # Cancelled futures are skipped 跳过已取消的 future
+        batch = [(queries, future) for queries, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        distinct = list(dict.fromkeys(q for queries, _ in batch for q in queries))
+        try:
+            vectors = np.asarray(self.embed(distinct), dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Batched embedding of {len(distinct)} queries failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        row = {q: i for i, q in enumerate(distinct)}
+        for queries, future in batch:
+            future.set_result(vectors[[row[q] for q in queries]])
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["queries"] += sum(len(queries) for queries, _ in batch)
+            self._stats["batches"] += 1
+            self._stats["forward_queries"] += len(distinct)
+
+    def stats(self) -> dict:
+        """
+        Requests and queries served, model calls made and the mean number of queries per call.
+        已处理的请求数与查询数、模型调用次数以及每次调用的平均查询数。
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["waiting"] = self._queue.qsize()
+        stats["mean_batch"] = stats["forward_queries"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _fail_pending(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError(f"Query scheduler '{self.name}' is closed"))
+
+    def close(self):
+        """
+        Finish the requests already queued, then stop the worker; later submissions raise RuntimeError.
+        处理完已排队的请求后停止工作线程；之后的提交将抛出 RuntimeError。
+
+        Never blocks on a full queue: the worker is woken without waiting for room and stops once the queue is empty.
+        不会因队列已满而阻塞：唤醒工作线程时不等待空位，工作线程在队列清空后停止。
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        try:
+            # Wakes a worker idle in `get` 唤醒在 `get` 中空闲的工作线程
+            self._queue.put_nowait(None)
+        except queue.Full:
+            # The worker is busy and checks `_closed` before its next `get` 工作线程正忙，会在下一次 `get` 前检查 `_closed`
+            pass
+        thread.join()
+        self._fail_pending()
@@ -1,5 +1,10 @@
-from sentence_transformers import SentenceTransformer
+import threading
+import time
+import numpy as np
 from agent.config import Config
+from agent.index.embedding_cache import EmbeddingCache
+from agent.index.query_cache import QueryCache
+from agent.models.query_scheduler import QueryScheduler
 from agent.utils.logging import setup_logger
 
 logger = setup_logger(__name__)
@@ -9,29 +14,220 @@ class TextEmbedder:
     Wrapper for text embedding model (SentenceTransformer).
     文本嵌入模型（SentenceTransformer）的封装类。
     """
-    def __init__(self, model_name: str = Config.TEXT_MODEL_NAME, device: str = Config.DEVICE):
+    def __init__(self, model_name: str = Config.TEXT_MODEL_NAME, device: str = None, use_cache: bool = Config.USE_EMBEDDING_CACHE,
+                 backend: str = Config.EMBEDDER_BACKEND):
         """
         Initialize the TextEmbedder.
         初始化文本嵌入器。
 
         Args:
             model_name (str): Name of the model. 模型名称。
-            device (str): Device to run the model on. 运行模型的设备。
+            device (str, optional): Device to run the model on. Defaults to Config.DEVICE. 运行模型的设备，默认为 Config.DEVICE。
+            use_cache (bool): Whether to consult the persistent embedding cache. 是否使用持久化嵌入缓存。
+            backend (str): CPU inference backend, "torch" or "int8"; ignored on GPU. CPU 推理后端，"torch" 或 "int8"；GPU 上忽略。
         """
-        logger.info(f"Loading Text Embedder: {model_name} on {device}")
-        self.model = SentenceTransformer(model_name, device=device)
+        # Imported here so that importing this module does not pull in torch
+        # 在此处导入，使导入本模块时不会加载 torch
+        from sentence_transformers import SentenceTransformer
+        from agent.models.acceleration import PROBE_TEXTS, configure_threads, load_accelerated
+
+        device = device or Config.DEVICE
+        if device != "cpu" and backend != "torch":
+            logger.warning(f"Embedder backend '{backend}' only applies to CPU inference; using float weights on {device}.")
+            backend = "torch"
+        logger.info(f"Loading Text Embedder: {model_name} on {device} ({backend})")
+        configure_threads()
+        self.model_name = model_name
+        self.model, self.backend = load_accelerated(
+            model_name, backend,
+            load_float=lambda: SentenceTransformer(model_name, device=device),
+            probe=lambda model: model.encode(PROBE_TEXTS, convert_to_numpy=True, normalize_embeddings=True),
+            packages=["sentence_transformers", "transformers"]
+        )
+        # Converted weights give slightly different vectors, so they are cached apart from the float ones
+        # 转换后的权重产生的向量略有不同，因此与 float 向量分开缓存
+        cache_namespace = model_name if self.backend == "torch" else f"{model_name}-{self.backend}"
+        self.cache = EmbeddingCache(cache_namespace) if use_cache else None
+        self.query_cache = QueryCache()
+        self.batch_size = Config.TEXT_EMBED_BATCH_SIZE
+        # Cumulative throughput counters of model inference
+        # 模型推理的累计吞吐计数
+        self._stats = {"texts": 0, "tokens": 0, "padded_tokens": 0, "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+        # Serializes model calls: the fast tokenizer cannot be used from two threads at once
+        # 串行化模型调用：fast tokenizer 不能被两个线程同时使用
+        self._model_lock = threading.Lock()
+        # Query embeddings of concurrent callers are coalesced into batched forward passes
+        # 并发调用方的查询嵌入被合并为批量前向计算
+        self.scheduler = QueryScheduler(self.embed_texts, name="text") if Config.QUERY_BATCHING else None
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        # Token count of each text as the model will see it (special tokens included, truncated to the window)
+        # 模型实际看到的每个文本的 token 数（含特殊标记，截断到窗口长度）
+        encoded = self.model.tokenizer(texts, add_special_tokens=True, truncation=True,
+                                       max_length=self.model.max_seq_length, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def _encode(self, texts: list[str]):
+        """
+        Run the model on texts sorted by token length, in fixed-size batches, and scatter the results back.
+        按 token 长度排序后以固定大小分批运行模型，并将结果按原顺序写回。
+
+        Neighbouring texts in a batch have similar lengths, so little compute is spent on padding.
+        同一批中的文本长度相近，填充带来的计算浪费很小。
+        """
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        with self._model_lock:
+            start_time = time.perf_counter()
+            lengths = np.asarray(self._token_lengths(texts))
+            order = np.argsort(lengths, kind="stable")
+            vectors = None
+            padded = 0
+            for start in range(0, len(texts), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                padded += len(batch) * int(lengths[batch].max())
+                # Normalize embeddings for cosine similarity
+                # 归一化嵌入向量以用于余弦相似度计算
+                batch_vectors = self.model.encode([texts[i] for i in batch], batch_size=len(batch),
+                                                  convert_to_numpy=True, normalize_embeddings=True)
+                if vectors is None:
+                    vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=batch_vectors.dtype)
+                vectors[batch] = batch_vectors
+            elapsed = time.perf_counter() - start_time
+
+        tokens = int(lengths.sum())
+        with self._stats_lock:
+            self._stats["texts"] += len(texts)
+            self._stats["tokens"] += tokens
+            self._stats["padded_tokens"] += padded
+            self._stats["seconds"] += elapsed
+        if len(texts) >= self.batch_size:
+            logger.info(f"Embedded {len(texts)} texts ({tokens} tokens) in {elapsed:.2f}s: "
+                        f"{tokens / max(elapsed, 1e-9):.0f} tokens/s, padding overhead {padded / max(tokens, 1) - 1:.1%}")
+        return vectors
+
+    def throughput(self) -> dict:
+        """
+        Cumulative inference throughput, to tune `batch_size` and `Config.TEXT_EMBED_ACCUMULATE`.
+        累计推理吞吐，用于调整 `batch_size` 与 `Config.TEXT_EMBED_ACCUMULATE`。
+
+        Returns:
+            dict: texts, tokens, padded_tokens, seconds, tokens_per_sec and padding_overhead. 文本数、token 数、含填充 token 数、耗时、每秒 token 数与填充开销。
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["tokens_per_sec"] = stats["tokens"] / stats["seconds"] if stats["seconds"] else 0.0
+        stats["padding_overhead"] = stats["padded_tokens"] / stats["tokens"] - 1 if stats["tokens"] else 0.0
+        return stats
         
+    def close(self):
+        """
+        Stop the query scheduler and persist pending embedding-cache writes; called when the shared instance is unloaded.
+        停止查询调度器并持久化嵌入缓存中待写入的内容；在共享实例被卸载时调用。
+        """
+        if self.scheduler is not None:
+            self.scheduler.close()
+        if self.cache is not None:
+            self.cache.flush()
+
     def embed_texts(self, texts: list[str]):
         """
         Embed a list of texts.
         对文本列表进行嵌入。
 
+        Texts already present in the embedding cache skip model inference.
+        已存在于嵌入缓存中的文本将跳过模型推理。
+
         Args:
             texts (list[str]): List of texts. 文本列表。
 
         Returns:
             numpy.ndarray: Array of embeddings. 嵌入向量数组。
         """
-        # Normalize embeddings for cosine similarity
-        # 归一化嵌入向量以用于余弦相似度计算
-        return self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+        if self.cache is None or not texts:
+            return self._encode(texts)
+
+        keys = [EmbeddingCache.key_for_text(t) for t in texts]
+        return self.cache.get_or_compute(keys, texts, self._encode)
+
+    def embed_queries(self, queries: list[str]):
+        """
+        Embed search queries through the in-process query LRU cache, in one forward pass for all misses.
+        通过进程内查询 LRU 缓存嵌入搜索查询，所有未命中的查询在一次前向计算中完成。
+
+        Safe to call from many threads: with `Config.QUERY_BATCHING`, misses of concurrent callers share that forward pass.
+        可从多个线程调用：启用 `Config.QUERY_BATCHING` 时，并发调用方未命中的查询共享同一次前向计算。
+
+        Args:
+            queries (list[str]): Query strings. 查询字符串。
+
+        Returns:
+            numpy.ndarray: Array of embeddings. 嵌入向量数组。
+        """
+        encode = self.scheduler.embed_queries if self.scheduler is not None else self.embed_texts
+        return self.query_cache.get_or_compute(queries, encode)
+
+class PendingEmbedding:
+    """
+    Embeddings of one `EmbeddingBatcher.submit` call, available after the batcher flushes.
+    一次 `EmbeddingBatcher.submit` 调用的嵌入结果，在批处理器刷新后可用。
+    """
+    def __init__(self, count: int):
+        self.count = count
+        self._vectors = None
+
+    @property
+    def done(self) -> bool:
+        return self._vectors is not None
+
+    def result(self) -> np.ndarray:
+        if self._vectors is None:
+            raise RuntimeError("Embeddings are not computed yet; flush the batcher first.")
+        return self._vectors
+
+class EmbeddingBatcher:
+    """
+    Accumulates texts from many documents and embeds them in one pass, so the model runs large, length-sorted
+    batches instead of one small batch per document.
+    累积多个文档的文本并一次性嵌入，使模型运行按长度排序的大批次，而不是每个文档一个小批次。
+    """
+    def __init__(self, embedder, max_pending: int = Config.TEXT_EMBED_ACCUMULATE):
+        """
+        Args:
+            embedder: Text embedder exposing `embed_texts`. 提供 `embed_texts` 的文本嵌入器。
+            max_pending (int): Pending texts after which `full` becomes true. 待处理文本达到该数量后 `full` 为真。
+        """
+        self.embedder = embedder
+        self.max_pending = max_pending
+        self._texts = []
+        self._pending = []
+
+    def submit(self, texts: list[str]) -> PendingEmbedding:
+        """
+        Queue texts; their embeddings are filled in by the next `flush`.
+        将文本加入队列；其嵌入在下一次 `flush` 时填充。
+        """
+        pending = PendingEmbedding(len(texts))
+        self._texts.extend(texts)
+        self._pending.append(pending)
+        return pending
+
+    @property
+    def full(self) -> bool:
+        return len(self._texts) >= self.max_pending
+
+    def flush(self):
+        """
+        Embed every queued text and hand each caller its rows.
+        嵌入所有排队的文本，并将对应的行交给各调用方。
+        """
+        if not self._pending:
+            return
+        texts, pending = self._texts, self._pending
+        self._texts, self._pending = [], []
+        vectors = self.embedder.embed_texts(texts) if texts else None
+        offset = 0
+        for p in pending:
+            p._vectors = vectors[offset:offset + p.count] if vectors is not None else np.empty((0, 0), dtype=np.float32)
+            offset += p.count
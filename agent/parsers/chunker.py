@@ -0,0 +1,225 @@
+import bisect
+import functools
+import re
+from agent.config import Config
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+# Sentence ends (Latin terminator followed by whitespace, or a CJK terminator) and blank-line paragraph breaks
+# 句子结尾（拉丁终止符后跟空白，或中文终止符）以及空行分段
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+|(?<=[\u3002\uff01\uff1f\uff1b])\s*|\n[ \t]*\n\s*")
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+# Rough token estimate used when the model tokenizer is unavailable: one token per CJK character,
+# per 6 letters/digits of a word and per punctuation mark (an over-estimate for the XLM-R vocabulary)
+# 无法加载模型分词器时使用的粗略 token 估计：每个中文字符、单词中每 6 个字母/数字、每个标点各计一个 token
+# （对 XLM-R 词表偏高估计）
+_APPROX_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[^\W_]{1,6}|[^\w\s]")
+# Chunks with fewer non-blank characters are dropped, as with the character window
+# 非空白字符少于该值的分块将被丢弃（与字符滑窗一致）
+MIN_CHUNK_CHARS = 50
+# A trailing unfinished sentence is carried to the next page unless it is longer than this
+# 末尾未结束的句子会延续到下一页，除非其长度超过该值
+MAX_CARRY_CHARS = 4000
+
+def approximate_token_counts(texts: list[str]) -> list[int]:
+    return [len(_APPROX_TOKEN_RE.findall(t)) for t in texts]
+
+@functools.lru_cache(maxsize=4)
+def load_token_counter(model_name: str = Config.TEXT_MODEL_NAME):
+    """
+    Token counter backed by the embedding model's tokenizer, loaded once per process.
+    基于嵌入模型分词器的 token 计数器，每个进程仅加载一次。
+
+    Only the local model cache is consulted (the tokenizer is downloaded together with the text model), so parser
+    processes never wait on the network; without it `approximate_token_counts` is used.
+    仅查找本地模型缓存（分词器随文本模型一同下载），解析进程不会等待网络；缓存中没有时使用 `approximate_token_counts`。
+
+    Returns:
+        callable: Maps a list of texts to their token counts, without special tokens. 将文本列表映射为 token 数（不含特殊标记）。
+    """
+    try:
+        # Imported here so that parsing without the sentence chunker never imports transformers
+        # 在此处导入，使不使用句子分块时不会加载 transformers
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+    except Exception as e:
+        logger.warning(f"Tokenizer of {model_name} unavailable ({e}); estimating chunk sizes instead.")
+        return approximate_token_counts
+
+    def count(texts: list[str]) -> list[int]:
+        if not texts:
+            return []
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]]
+    return count
+
+class _Unit:
+    # A sentence (or a piece of an over-long one) with document offsets
+    # 一个句子（或超长句子的一段），带文档偏移
+    __slots__ = ("start", "end", "tokens", "paragraph")
+
+    def __init__(self, start: int, end: int, tokens: int, paragraph: bool):
+        self.start, self.end, self.tokens, self.paragraph = start, end, tokens, paragraph
+
+class SentenceChunker:
+    """
+    Split a document into chunks on sentence and paragraph boundaries, packed up to a token budget.
+    按句子与段落边界切分文档，并按 token 预算打包为分块。
+
+    Pages are streamed: sentences continue across page breaks and every chunk records the pages it spans.
+    Consecutive chunks share the last whole sentences of the previous chunk (up to `overlap_tokens`),
+    except across paragraph breaks. Offsets refer to the document text with pages joined by newlines.
+    页面以流式读入：句子可跨页延续，每个分块记录其覆盖的页码范围。相邻分块共享前一分块末尾的完整句子
+    （不超过 `overlap_tokens`），段落边界处除外。偏移量均相对于以换行连接各页得到的文档文本。
+    """
+    def __init__(self, max_tokens: int = Config.CHUNK_MAX_TOKENS, overlap_tokens: int = Config.CHUNK_OVERLAP_TOKENS,
+                 count_tokens=None):
+        """
+        Args:
+            max_tokens (int): Token budget per chunk. 每个分块的 token 预算。
+            overlap_tokens (int): Context carried into the next chunk. 延续到下一分块的上下文 token 数。
+            count_tokens (callable, optional): Token counter, defaults to the text model's tokenizer. token 计数器，默认为文本模型的分词器。
+        """
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.count_tokens = count_tokens or load_token_counter()
+
+    def _split(self, buffer: str, base: int, start: int, paragraph: bool, final: bool):
+        """
+        Sentence spans of `buffer[start:]`; the last, possibly unfinished, one is held back unless `final`.
+        `buffer[start:]` 中的句子区间；最后一个可能未结束的句子会被保留，除非 `final` 为真。
+
+        Returns:
+            tuple: (list of (start, end, paragraph) in document offsets, new scan position in `buffer`,
+                whether the held-back text starts a paragraph). (文档偏移下的句子区间列表, `buffer` 中新的扫描位置, 保留文本是否为段首)。
+        """
+        spans = []
+        pos = start
+        for match in _BOUNDARY_RE.finditer(buffer, start):
+            if match.end() == pos:
+                continue
+            spans.append((pos, match.start(), paragraph))
+            paragraph = bool(_PARAGRAPH_RE.search(match.group()))
+            pos = match.end()
+        if final or len(buffer) - pos > MAX_CARRY_CHARS:
+            spans.append((pos, len(buffer), paragraph))
+            pos, paragraph = len(buffer), False
+
+        units = []
+        for s, e, para in spans:
+            # Trim surrounding whitespace; skip empty spans
+            # 去除首尾空白；跳过空区间
+            text = buffer[s:e]
+            stripped = text.strip()
+            if stripped:
+                s += len(text) - len(text.lstrip())
+                units.append((base + s, base + s + len(stripped), para))
+        return units, pos, paragraph
+
+    def _measure(self, buffer: str, base: int, spans: list[tuple]) -> list[_Unit]:
+        """
+        Count tokens of sentence spans, cutting over-long sentences into pieces within budget.
+        统计句子区间的 token 数，将超长句子切分为不超过预算的若干段。
+        """
+        counts = self.count_tokens([buffer[s - base:e - base] for s, e, _ in spans])
+        units = []
+        for (s, e, para), tokens in zip(spans, counts):
+            if tokens <= self.max_tokens:
+                units.append(_Unit(s, e, tokens, para))
+            else:
+                units.extend(self._cut(buffer, base, s, e, tokens, para))
+        return units
+
+    def _cut(self, buffer: str, base: int, start: int, end: int, tokens: int, paragraph: bool) -> list[_Unit]:
+        # Cut at whitespace where possible (tables, reference lists and text without punctuation)
+        # 尽量在空白处切分（表格、参考文献列表及无标点文本）
+        pieces = []
+        while tokens > self.max_tokens:
+            stop = start + max(1, int((end - start) * self.max_tokens / tokens * 0.9))
+            while True:
+                space = max(buffer.rfind(" ", start - base + 1, stop - base), buffer.rfind("\n", start - base + 1, stop - base))
+                cut = base + space if space != -1 else stop
+                piece_tokens = self.count_tokens([buffer[start - base:cut - base]])[0]
+                if piece_tokens <= self.max_tokens or cut - start <= 1:
+                    break
+                stop = start + max(1, (cut - start) * 4 // 5)
+            pieces.append(_Unit(start, cut, piece_tokens, paragraph and not pieces))
+            start = cut
+            while start < end and buffer[start - base].isspace():
+                start += 1
+            if start >= end:
+                return pieces
+            tokens = self.count_tokens([buffer[start - base:end - base]])[0]
+        pieces.append(_Unit(start, end, tokens, paragraph and not pieces))
+        return pieces
+
+    def iter_chunks(self, pages):
+        """
+        Chunk a stream of pages.
+        对页面流进行分块。
+
+        Args:
+            pages (iterable[tuple[int, str]]): (page number, page text), in order. 按顺序的 (页码, 页面文本)。
+
+        Yields:
+            dict: Chunk with text, page_id (first page), page_end (last page), char_start and char_end.
+                包含 text、page_id（起始页）、page_end（结束页）、char_start、char_end 的块。
+        """
+        page_starts, page_ids = [], []
+        buffer, base = "", 0  # buffer holds document text from offset `base`
+        scan = 0              # document offset up to which sentences have been split off
+        paragraph = True      # whether the text at `scan` starts a paragraph
+        current = []          # units of the chunk being packed
+
+        def page_of(offset: int) -> int:
+            return page_ids[bisect.bisect_right(page_starts, offset) - 1]
+
+        def emit(units):
+            start, end = units[0].start, units[-1].end
+            text = buffer[start - base:end - base]
+            if len(text.strip()) > MIN_CHUNK_CHARS:
+                return {"text": text, "page_id": page_of(start), "page_end": page_of(end - 1),
+                        "char_start": start, "char_end": end}
+            return None
+
+        def pack(units):
+            nonlocal current
+            for unit in units:
+                used = sum(u.tokens for u in current)
+                if current and (used + unit.tokens > self.max_tokens or (unit.paragraph and used >= self.max_tokens // 2)):
+                    chunk = emit(current)
+                    if chunk is not None:
+                        yield chunk
+                    # Carry the last whole sentences into the next chunk, within the overlap budget
+                    # 在重叠预算内将末尾的完整句子延续到下一分块
+                    carried, carried_tokens = [], 0
+                    if not unit.paragraph:
+                        for u in reversed(current):
+                            if carried_tokens + u.tokens > self.overlap_tokens or carried_tokens + u.tokens + unit.tokens > self.max_tokens:
+                                break
+                            carried.insert(0, u)
+                            carried_tokens += u.tokens
+                    current = carried
+                current.append(unit)
+
+        for page_id, text in pages:
+            if page_ids:
+                buffer += "\n"
+            page_starts.append(base + len(buffer))
+            page_ids.append(page_id)
+            buffer += text
+            spans, pos, paragraph = self._split(buffer, base, scan - base, paragraph, final=False)
+            scan = base + pos
+            yield from pack(self._measure(buffer, base, spans))
+            # Drop text no longer referenced by the open chunk or the unfinished sentence
+            # 丢弃已不被当前分块或未结束句子引用的文本
+            keep = min([scan] + [u.start for u in current[:1]])
+            buffer, base = buffer[keep - base:], keep
+
+        if page_ids:
+            spans, _, _ = self._split(buffer, base, scan - base, paragraph, final=True)
+            yield from pack(self._measure(buffer, base, spans))
+            if current:
+                chunk = emit(current)
+                if chunk is not None:
+                    yield chunk
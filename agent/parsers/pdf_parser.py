@@ -1,5 +1,8 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import fitz  # PyMuPDF
 from agent.config import Config
+from agent.parsers.chunker import SentenceChunker
 from agent.utils.logging import setup_logger
 
 logger = setup_logger(__name__)
@@ -10,56 +13,179 @@ class PDFParser:
     用于解析 PDF 文件的静态工具类。
     """
     @staticmethod
-    def parse(file_path: str, chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.CHUNK_OVERLAP):
+    def iter_pages(file_path: str):
         """
-        Parse a PDF file into text and chunks.
-        将 PDF 文件解析为文本和块。
+        Lazily yield the text of each page; only one page is held in memory at a time.
+        惰性地逐页产出文本；同一时间内存中只保留一页。
 
         Args:
             file_path (str): Path to the PDF file. PDF 文件路径。
-            chunk_size (int): Size of each text chunk. 每个文本块的大小。
-            overlap (int): Overlap between chunks. 块之间的重叠。
 
-        Returns:
-            tuple[str, list[dict]]: (Full text, List of chunk dictionaries). (全文, 块字典列表)。
+        Yields:
+            tuple[int, str]: (1-based page number, page text). (从 1 开始的页码, 页面文本)。
         """
         try:
             doc = fitz.open(file_path)
         except Exception as e:
             logger.error(f"Failed to open PDF {file_path}: {e}")
-            return "", []
+            return
+
+        try:
+            for page_num, page in enumerate(doc):
+                yield page_num + 1, page.get_text()
+        finally:
+            doc.close()
 
-        all_chunks = []
-        full_text = []
+    @staticmethod
+    def _hashed_pages(file_path: str, text_hash=None):
+        # Pages, feeding the document text to `text_hash` as it streams by
+        # 逐页产出，同时将文档文本送入 `text_hash`
+        for page_id, text in PDFParser.iter_pages(file_path):
+            if text_hash is not None:
+                if page_id > 1:
+                    text_hash.update(b"\n")
+                text_hash.update(text.encode())
+            yield page_id, text
+
+    @staticmethod
+    def iter_chunks(file_path: str, chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.CHUNK_OVERLAP, text_hash=None,
+                    chunker: str = Config.CHUNKER):
+        """
+        Lazily yield chunk dictionaries page by page.
+        逐页惰性地产出块字典。
+
+        Args:
+            file_path (str): Path to the PDF file. PDF 文件路径。
+            chunk_size (int): Size of each text chunk ("window" chunker). 每个文本块的大小（"window" 分块）。
+            overlap (int): Overlap between chunks ("window" chunker). 块之间的重叠（"window" 分块）。
+            text_hash (hashlib object, optional): Updated with the document text as it streams by, giving the same
+                digest as hashing the joined full text. 在文本流过时更新，结果与对完整拼接文本求哈希一致。
+            chunker (str): "sentence" for token-budgeted sentence chunks spanning pages (see `SentenceChunker`),
+                or "window" for per-page character windows. "sentence" 为按 token 预算打包、可跨页的句子分块
+                （见 `SentenceChunker`），"window" 为逐页字符滑窗。
 
-        for page_num, page in enumerate(doc):
-            text = page.get_text()
-            full_text.append(text)
-            
+        Yields:
+            dict: Chunk with text, page_id, char_start and char_end; sentence chunks add page_end and use document
+                offsets. 包含 text、page_id、char_start、char_end 的块；句子分块另含 page_end，并使用文档级偏移。
+        """
+        pages = PDFParser._hashed_pages(file_path, text_hash)
+        if chunker == "sentence":
+            yield from SentenceChunker().iter_chunks(pages)
+            return
+        if chunker != "window":
+            raise ValueError(f"Unknown chunker: {chunker}")
+
+        for page_id, text in pages:
             if not text.strip():
                 continue
 
             # Sliding window on this page
             start = 0
             text_len = len(text)
-            
+
             while start < text_len:
                 end = min(start + chunk_size, text_len)
                 chunk_text = text[start:end]
-                
+
                 # Only add substantial chunks
                 if len(chunk_text.strip()) > 50:
-                    all_chunks.append({
+                    yield {
                         "text": chunk_text,
-                        "page_id": page_num + 1,
+                        "page_id": page_id,
                         "char_start": start,
                         "char_end": end
-                    })
-                
+                    }
+
                 if end == text_len:
                     break
-                
+
                 start += chunk_size - overlap
 
-        doc.close()
-        return "\n".join(full_text), all_chunks
+    @staticmethod
+    def parse_chunks(file_path: str, chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.CHUNK_OVERLAP,
+                     chunker: str = Config.CHUNKER):
+        """
+        Parse a PDF file into its document id and chunks without materializing the full text.
+        将 PDF 文件解析为文档 ID 和块，而不构建完整文本。
+
+        Returns:
+            tuple[str, list[dict]]: (sha256 of the full text, list of chunk dictionaries). (全文的 sha256, 块字典列表)。
+        """
+        text_hash = hashlib.sha256()
+        chunks = list(PDFParser.iter_chunks(file_path, chunk_size, overlap, text_hash=text_hash, chunker=chunker))
+        return text_hash.hexdigest(), chunks
+
+    @staticmethod
+    def read_text(file_path: str) -> str:
+        """
+        Read the full text of a PDF file, pages joined by newlines.
+        读取 PDF 文件的全文，各页以换行连接。
+        """
+        return "\n".join(text for _, text in PDFParser.iter_pages(file_path))
+
+    @staticmethod
+    def parse(file_path: str, chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.CHUNK_OVERLAP,
+              chunker: str = Config.CHUNKER):
+        """
+        Parse a PDF file into text and chunks.
+        将 PDF 文件解析为文本和块。
+
+        Args:
+            file_path (str): Path to the PDF file. PDF 文件路径。
+            chunk_size (int): Size of each text chunk. 每个文本块的大小。
+            overlap (int): Overlap between chunks. 块之间的重叠。
+            chunker (str): "sentence" or "window", see `iter_chunks`. 分块方式，见 `iter_chunks`。
+
+        Returns:
+            tuple[str, list[dict]]: (Full text, List of chunk dictionaries). (全文, 块字典列表)。
+        """
+        return PDFParser.read_text(file_path), list(PDFParser.iter_chunks(file_path, chunk_size, overlap, chunker=chunker))
+
+    @staticmethod
+    def parse_many(file_paths: list[str], workers: int = Config.PDF_PARSE_WORKERS, chunk_size: int = Config.CHUNK_SIZE, overlap: int = Config.CHUNK_OVERLAP,
+                   chunker: str = Config.CHUNKER):
+        """
+        Parse PDF files in a process pool, yielding results as soon as each file finishes.
+        在进程池中解析 PDF 文件，每个文件完成后立即产出结果。
+
+        At most `2 * workers` files are in flight, so the consumer can start embedding the first
+        documents while the rest are still being parsed without results piling up in memory.
+        最多同时处理 `2 * workers` 个文件，调用方可以在其余文件仍在解析时开始嵌入，且结果不会在内存中堆积。
+
+        Args:
+            file_paths (list[str]): Paths to the PDF files. PDF 文件路径列表。
+            workers (int): Parser processes; 0 parses in the calling process. 解析进程数；0 表示在调用进程中解析。
+            chunk_size (int): Size of each text chunk. 每个文本块的大小。
+            overlap (int): Overlap between chunks. 块之间的重叠。
+            chunker (str): "sentence" or "window", see `iter_chunks`. 分块方式，见 `iter_chunks`。
+
+        Yields:
+            tuple[str, str, list[dict]]: (Path, sha256 of the full text, chunks) in completion order.
+            按完成顺序产出 (路径, 全文的 sha256, 块列表)。
+        """
+        if workers <= 0:
+            for file_path in file_paths:
+                yield _parse_job(file_path, chunk_size, overlap, chunker)
+            return
+
+        max_pending = workers * 2
+        path_iter = iter(file_paths)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            while True:
+                while len(pending) < max_pending:
+                    file_path = next(path_iter, None)
+                    if file_path is None:
+                        break
+                    pending.add(pool.submit(_parse_job, file_path, chunk_size, overlap, chunker))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+def _parse_job(file_path: str, chunk_size: int, overlap: int, chunker: str = Config.CHUNKER):
+    # Module-level so it can be pickled into worker processes
+    # 定义在模块级别，以便序列化到工作进程
+    doc_id, chunks = PDFParser.parse_chunks(file_path, chunk_size, overlap, chunker)
+    return file_path, doc_id, chunks
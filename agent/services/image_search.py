@@ -1,13 +1,20 @@
 from pathlib import Path
-from PIL import Image
 import hashlib
+import numpy as np
+from agent.index.embedding_cache import EmbeddingCache
+from agent.index.filters import SearchFilter
+from agent.index.manifest import Manifest
 from agent.index.vector_store import VectorStore
 from agent.models.image_embedder import ImageEmbedder
+from agent.models.image_pipeline import hash_files, iter_preprocessed_batches
+from agent.services.registry import SharedResources
 from agent.utils.logging import setup_logger
 from agent.config import Config
 
 logger = setup_logger(__name__)
 
+VALID_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif"}
+
 class ImageSearchService:
     """
     Service for image indexing and searching.
@@ -22,53 +29,170 @@ class ImageSearchService:
             image_embedder: Image embedding model. 图像嵌入模型。
             vector_store: Vector store instance. 向量数据库实例。
         """
-        self.image_embedder = image_embedder or ImageEmbedder()
-        self.vector_store = vector_store or VectorStore()
+        # Models and stores not passed in are shared with every other service in the process. Searching needs
+        # only the text tower; the vision tower is loaded when images are indexed
+        # 未传入的模型与向量数据库在进程内的所有服务之间共享。检索只需要文本编码器；视觉编码器在索引图片时才加载
+        self._shared = SharedResources()
+        self.image_embedder = image_embedder or self._shared.image_embedder(load_vision=False)
+        self.vector_store = vector_store or self._shared.vector_store()
+        # Manifest of indexed files: path -> (size, mtime, content hash, vector id)
+        # 已索引文件清单：路径 -> (大小, 修改时间, 内容哈希, 向量 ID)
+        self.manifest = Manifest(self.vector_store.state_dir / Config.IMAGE_MANIFEST_NAME)
 
-    def index_images(self, image_dir: str = str(Config.IMAGES_DIR)):
+    def close(self):
+        """
+        Release the shared image embedder and vector store this service acquired.
+        释放本服务获取的共享图像嵌入模型与向量数据库。
         """
-        Index all images in a directory.
-        索引目录下的所有图片。
+        self._shared.release()
+
+    def index_images(self, image_dir: str = str(Config.IMAGES_DIR), workers: int = None):
+        """
+        Incrementally index all images in a directory.
+        增量索引目录下的所有图片。
+
+        Only new or modified files are embedded; files deleted from disk are removed from the index.
+        仅嵌入新增或修改的文件；已从磁盘删除的文件会从索引中移除。
 
         Args:
             image_dir (str): Directory containing images. 图片目录。
+            workers (int, optional): Decoder processes, defaults to Config.IMAGE_DECODE_WORKERS. 解码进程数，默认为 Config.IMAGE_DECODE_WORKERS。
         """
-        root = Path(image_dir)
-        valid_exts = {".jpg", ".jpeg", ".png", ".bmp", ".gif"}
+        root = Path(image_dir).resolve()
         
         image_paths = []
         for p in root.glob("**/*"):
-            if p.suffix.lower() in valid_exts:
+            if p.suffix.lower() in VALID_IMAGE_EXTS and p.is_file():
                 image_paths.append(p)
                 
         logger.info(f"Found {len(image_paths)} images.")
-        
-        batch_size = 32
-        for i in range(0, len(image_paths), batch_size):
-            batch_paths = image_paths[i:i+batch_size]
-            images = []
-            valid_batch_paths = []
-            
-            for p in batch_paths:
-                try:
-                    img = Image.open(p).convert("RGB")
-                    images.append(img)
-                    valid_batch_paths.append(p)
-                except Exception as e:
-                    logger.error(f"Failed to open image {p}: {e}")
-            
-            if not images:
+
+        # Drop entries whose files no longer exist (reading entries other processes have written since)
+        # 删除文件已不存在的条目（先读取其他进程在此期间写入的条目）
+        self.manifest.refresh()
+        present = {str(p) for p in image_paths}
+        removed = [k for k in self.manifest.keys_under(str(root)) if k not in present]
+        if removed:
+            self.vector_store.delete_images([self.manifest.get(k)["id"] for k in removed])
+            for k in removed:
+                self.manifest.pop(k)
+            self.manifest.save()
+            logger.info(f"Removed {len(removed)} deleted images from the index.")
+
+        self._index_paths(image_paths, workers)
+
+    def index_image_files(self, paths: list[str]):
+        """
+        Incrementally index specific image files without scanning their directory.
+        增量索引指定的图片文件，而不扫描其所在目录。
+
+        Args:
+            paths (list[str]): Image file paths. 图片文件路径。
+        """
+        self.manifest.refresh()
+        self._index_paths([Path(p).resolve() for p in paths])
+
+    def _index_paths(self, image_paths: list[Path], workers: int = None):
+        # Cheap stat check first; only files whose size or mtime changed are read
+        # 先进行廉价的 stat 检查；仅读取大小或修改时间发生变化的文件
+        candidates = []
+        for p in image_paths:
+            try:
+                st = p.stat()
+            except OSError as e:
+                logger.error(f"Failed to stat image {p}: {e}")
                 continue
-                
-            embeddings = self.image_embedder.embed_images(images)
-            
-            ids = [hashlib.sha256(str(p).encode()).hexdigest() for p in valid_batch_paths]
-            metadatas = [{"path": str(p), "filename": p.name} for p in valid_batch_paths]
-            
-            self.vector_store.add_images(ids, embeddings, metadatas)
-            logger.info(f"Indexed batch {i // batch_size + 1}")
-
-    def search_image(self, query: str, top_k: int = 5):
+            record = self.manifest.get(str(p))
+            if record and record["size"] == st.st_size and record["mtime"] == st.st_mtime:
+                continue
+            candidates.append((p, st))
+
+        logger.info(f"{len(candidates)} new or modified images to check.")
+        if not candidates:
+            return
+
+        workers = Config.IMAGE_DECODE_WORKERS if workers is None else workers
+        batch_size = Config.IMAGE_BATCH_SIZE
+        embedded = 0
+        # One buffered writer for the whole run; manifest entries are set once their rows are written
+        # 整次运行共用一个缓冲写入器；行写入成功后才设置清单条目
+        writer = self.vector_store.writer()
+        try:
+            # Hash changed files in parallel; identical content only refreshes the stat fields
+            # 并行哈希变化的文件；内容相同时仅更新 stat 字段
+            pending = []
+            hashes = hash_files([str(p) for p, _ in candidates], workers)
+            for (p, st), content_hash in zip(candidates, hashes):
+                if content_hash is None:
+                    continue
+                record = self.manifest.get(str(p))
+                if record and record["sha256"] == content_hash:
+                    # Set, not updated in place, so the manifest records the change
+                    # 使用 set 而非原地修改，使清单记录这一修改
+                    self.manifest.set(str(p), {**record, "size": st.st_size, "mtime": st.st_mtime})
+                    continue
+                pending.append((p, st, content_hash))
+
+            # Images already in the embedding cache need neither decoding nor inference
+            # 已在嵌入缓存中的图片无需解码与推理
+            cache = self.image_embedder.cache
+            keys = [EmbeddingCache.key_for_digest(h) for _, _, h in pending]
+            cached = cache.get_many(keys) if cache is not None else [None] * len(pending)
+            hits = [i for i, v in enumerate(cached) if v is not None]
+            misses = [i for i, v in enumerate(cached) if v is None]
+            for i in range(0, len(hits), batch_size):
+                batch = hits[i:i+batch_size]
+                self._store_batch(writer, [pending[j] for j in batch], np.stack([cached[j] for j in batch]))
+            if hits:
+                logger.info(f"Reused cached embeddings for {len(hits)} images.")
+
+            # Worker processes decode and preprocess upcoming batches while the model encodes the current one.
+            # With nothing left to encode, the vision tower is never loaded.
+            # 模型编码当前批次的同时，工作进程解码并预处理后续批次。没有需要编码的图片时不会加载视觉编码器。
+            batches = iter_preprocessed_batches(
+                [str(pending[j][0]) for j in misses],
+                self.image_embedder.preprocess,
+                batch_size=batch_size,
+                workers=workers,
+                pin_memory=self.image_embedder.device == "cuda"
+            ) if misses else []
+            for n, (ok, image_input) in enumerate(batches):
+                if not ok:
+                    continue
+                embeddings = self.image_embedder.encode_preprocessed(image_input)
+                if cache is not None:
+                    cache.put_many([keys[misses[j]] for j in ok], embeddings)
+                self._store_batch(writer, [pending[misses[j]] for j in ok], embeddings)
+                embedded += len(ok)
+                logger.info(f"Encoded batch {n + 1}")
+            writer.flush()
+        finally:
+            self.manifest.save()
+            if self.image_embedder.cache is not None:
+                self.image_embedder.cache.flush()
+
+        logger.info(f"Embedded {embedded} images.")
+
+    def _store_batch(self, writer, batch: list[tuple], embeddings):
+        """
+        Buffer a batch of (path, stat, content hash) entries and record them in the manifest once written.
+        缓冲一批 (路径, stat, 内容哈希) 条目，写入后记录到清单中。
+        """
+        ids = [hashlib.sha256(str(p).encode()).hexdigest() for p, _, _ in batch]
+        metadatas = [{"path": str(p), "filename": p.name} for p, _, _ in batch]
+        writer.add_images(ids, embeddings, metadatas)
+
+        def record():
+            for (p, st, content_hash), doc_id in zip(batch, ids):
+                self.manifest.set(str(p), {
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "sha256": content_hash,
+                    "id": doc_id
+                })
+        writer.on_flush(record)
+
+    def search_image(self, query: str, top_k: int = 5, search_filter: SearchFilter = None):
         """
         Search for images using a text query.
         使用文本查询搜索图片。
@@ -76,11 +200,32 @@ class ImageSearchService:
         Args:
             query (str): Search query. 搜索查询。
             top_k (int): Number of results to return. 返回结果数量。
+            search_filter (SearchFilter, optional): Filename glob / directory restriction. 文件名通配 / 目录限定。
 
         Returns:
             dict: Search results. 搜索结果。
         """
         logger.info(f"Searching images for: {query}")
-        text_embedding = self.image_embedder.embed_text([query])[0]
-        results = self.vector_store.search_images(text_embedding, n_results=top_k)
+        text_embedding = self.image_embedder.embed_queries([query])[0]
+        results = self.vector_store.search_images(text_embedding, n_results=top_k, search_filter=search_filter)
         return results
+
+    def search_images_batch(self, queries: list[str], top_k: int = 5, search_filter: SearchFilter = None):
+        """
+        Search images for many text queries with one embedding pass and one multi-vector query.
+        以一次嵌入计算和一次多向量查询，为多个文本查询搜索图片。
+
+        Args:
+            queries (list[str]): Search queries. 搜索查询列表。
+            top_k (int): Number of results per query. 每个查询返回的结果数量。
+            search_filter (SearchFilter, optional): Applied to every query. 应用于每个查询的过滤器。
+
+        Returns:
+            list[dict]: One result per query, in the same shape as `search_image`. 每个查询一个结果，形状与 `search_image` 相同。
+        """
+        if not queries:
+            return []
+        logger.info(f"Searching images for {len(queries)} queries")
+        text_embeddings = self.image_embedder.embed_queries(queries)
+        results = self.vector_store.search_images(text_embeddings, n_results=top_k, search_filter=search_filter)
+        return self.vector_store.split_results(results)
@@ -1,15 +1,34 @@
+import functools
 import shutil
-import hashlib
 import numpy as np
 from pathlib import Path
 from agent.config import Config
-from agent.models.text_embedder import TextEmbedder
+from agent.models.text_embedder import EmbeddingBatcher, TextEmbedder
+from agent.index.doc_spill import DocumentSpillStore
+from agent.index.manifest import Manifest
 from agent.index.vector_store import VectorStore
 from agent.parsers.pdf_parser import PDFParser
+from agent.services.registry import SharedResources
+from agent.utils.hashing import file_sha256
 from agent.utils.logging import setup_logger
 
 logger = setup_logger(__name__)
 
+class DocumentEmbedding:
+    """
+    Embedding result of one document: the pooled file vector plus the chunk vectors it came from.
+    单个文档的嵌入结果：池化后的文件向量及其来源的片段向量。
+    """
+    def __init__(self, file_embedding, chunk_embeddings=None):
+        """
+        Args:
+            file_embedding (np.ndarray): Normalized file-level embedding. 归一化的文件级嵌入。
+            chunk_embeddings (np.ndarray, optional): Per-chunk embeddings, None if the document has no chunks.
+                每个片段的嵌入，若文档无片段则为 None。
+        """
+        self.file_embedding = file_embedding
+        self.chunk_embeddings = chunk_embeddings
+
 class PaperManager:
     """
     Service for managing paper ingestion, classification, and organization.
@@ -24,24 +43,202 @@ class PaperManager:
             text_embedder (TextEmbedder, optional): Text embedding model. 文本嵌入模型。
             vector_store (VectorStore, optional): Vector database interface. 向量数据库接口。
         """
-        self.text_embedder = text_embedder or TextEmbedder()
-        self.vector_store = vector_store or VectorStore()
+        # Models and stores not passed in are shared with every other service in the process
+        # 未传入的模型与向量数据库在进程内的所有服务之间共享
+        self._shared = SharedResources()
+        self.text_embedder = text_embedder or self._shared.text_embedder()
+        self.vector_store = vector_store or self._shared.vector_store()
+        # Ingest manifest: path -> (size, mtime, PDF byte hash, doc id, chunk count, topic)
+        # 摄入清单：路径 -> (大小, 修改时间, PDF 字节哈希, 文档 ID, 片段数, 主题)
+        self.manifest = Manifest(self.vector_store.state_dir / Config.PAPER_MANIFEST_NAME)
+
+    def close(self):
+        """
+        Release the shared text embedder and vector store this service acquired.
+        释放本服务获取的共享文本嵌入模型与向量数据库。
+        """
+        self._shared.release()
+
+    @staticmethod
+    def _chunk_ids(doc_id: str, n_chunks: int, start: int = 0) -> list[str]:
+        return [f"{doc_id}_{i}" for i in range(start, n_chunks)]
 
     def _compute_file_embedding(self, full_text: str, chunks: list[dict]):
         """
         Compute file embedding using mean pooling of chunks if available.
         如果可用，使用块的平均池化计算文件嵌入。
+
+        `full_text` is only needed (and only read) for documents without chunks.
+        仅当文档没有块时才需要（并读取）`full_text`。
+
+        Returns:
+            DocumentEmbedding: File embedding together with the chunk embeddings it was pooled from.
+            文件嵌入及其池化所用的块嵌入。
+        """
+        return self._pool(self.text_embedder.embed_texts(self._embedding_inputs(full_text, chunks)), bool(chunks))
+
+    @staticmethod
+    def _embedding_inputs(full_text: str, chunks: list[dict]) -> list[str]:
+        # Chunk texts, or the full text for documents without chunks
+        # 片段文本；无片段的文档使用全文
+        return [c["text"] for c in chunks] if chunks else [full_text]
+
+    @staticmethod
+    def _pool(vectors, has_chunks: bool) -> DocumentEmbedding:
         """
+        Build a DocumentEmbedding from the vectors of `_embedding_inputs`: mean-pooled chunks, or the full-text vector.
+        由 `_embedding_inputs` 的向量构建 DocumentEmbedding：片段均值池化，或全文向量。
+        """
+        if not has_chunks:
+            return DocumentEmbedding(vectors[0])
+        file_embedding = np.mean(vectors, axis=0)
+        norm = np.linalg.norm(file_embedding)
+        if norm > 0:
+            file_embedding = file_embedding / norm
+        return DocumentEmbedding(file_embedding, vectors)
+
+    def _paper_entries(self, final_path: Path, doc_id: str, chunks: list[dict], topic: str):
+        """
+        Build the index entries of a paper: file metadata plus chunk ids, metadata and texts.
+        构建论文的索引条目：文件元数据以及片段 ID、元数据和文本。
+        """
+        metadata = {
+            "path": str(final_path),
+            "filename": final_path.name,
+            "sha256": doc_id,
+            "topic": topic
+        }
+        chunk_ids = self._chunk_ids(doc_id, len(chunks))
+        chunk_metadatas = []
+        chunk_texts = []
+        for c in chunks:
+            m = c.copy()
+            chunk_texts.append(m.pop("text"))
+            m["path"] = str(final_path)
+            m["filename"] = final_path.name
+            m["sha256"] = doc_id
+            m["topic"] = topic
+            chunk_metadatas.append(m)
+        return metadata, chunk_ids, chunk_metadatas, chunk_texts
+
+    def _index_paper(self, final_path: Path, doc_id: str, chunks: list[dict], doc_embedding: DocumentEmbedding, topic: str) -> str:
+        """
+        Write the file entry and its chunks to the vector store, reusing precomputed embeddings.
+        将文件条目及其片段写入向量数据库，复用已计算的嵌入。
+
+        Returns:
+            str: Document id (sha256 of the extracted text). 文档 ID（提取文本的 sha256）。
+        """
+        metadata, chunk_ids, chunk_metadatas, chunk_texts = self._paper_entries(final_path, doc_id, chunks, topic)
+        self.vector_store.add_paper_file(doc_id, doc_embedding.file_embedding, metadata)
         if chunks:
-            chunk_texts = [c["text"] for c in chunks]
-            chunk_embeddings = self.text_embedder.embed_texts(chunk_texts)
-            file_embedding = np.mean(chunk_embeddings, axis=0)
-            norm = np.linalg.norm(file_embedding)
-            if norm > 0:
-                file_embedding = file_embedding / norm
-            return file_embedding
+            self.vector_store.add_paper_chunks(chunk_ids, doc_embedding.chunk_embeddings, chunk_metadatas, chunk_texts)
+        return doc_id
+
+    def _check_manifest(self, path: Path):
+        """
+        Compare a PDF against the ingest manifest.
+        将 PDF 与摄入清单进行比对。
+
+        Returns:
+            tuple[str, dict]: (PDF byte hash, manifest record if the bytes are unchanged else None).
+            (PDF 字节哈希, 若字节未变化则返回清单记录，否则为 None)。
+        """
+        record = self.manifest.get(str(path))
+        st = path.stat()
+        if record and record["size"] == st.st_size and record["mtime"] == st.st_mtime:
+            return record["pdf_sha256"], record
+        pdf_hash = file_sha256(str(path))
+        if record and record["pdf_sha256"] == pdf_hash:
+            # Set, not updated in place, so the manifest records the change
+            # 使用 set 而非原地修改，使清单记录这一修改
+            record = {**record, "size": st.st_size, "mtime": st.st_mtime}
+            self.manifest.set(str(path), record)
+            return pdf_hash, record
+        return pdf_hash, None
+
+    def _doc_id_in_use(self, doc_id: str, exclude: str = None) -> bool:
+        """
+        Whether any manifest record other than `exclude` still references `doc_id`.
+        除 `exclude` 外是否仍有清单记录引用 `doc_id`。
+        """
+        return any(record.get("doc_id") == doc_id for key, record in self.manifest.records.items() if key != exclude)
+
+    def _record_ingest(self, original_path: Path, final_path: Path, pdf_hash: str, doc_id: str, n_chunks: int, topic: str):
+        """
+        Update the manifest after indexing and delete chunks left over from a previous version of the file.
+        索引后更新清单，并删除文件旧版本遗留的片段。
+        """
+        previous = self.manifest.pop(str(original_path))
+        if previous:
+            if previous["doc_id"] != doc_id:
+                # doc_id is a content hash: another path with the same text may still use the old vectors
+                # doc_id 为内容哈希：文本相同的其他路径可能仍在使用旧向量
+                if self._doc_id_in_use(previous["doc_id"], exclude=str(final_path)):
+                    logger.info(f"Keeping vectors of {previous['doc_id']}: still indexed for another file.")
+                else:
+                    self.vector_store.delete_paper(previous["doc_id"], self._chunk_ids(previous["doc_id"], previous["n_chunks"]))
+            elif previous["n_chunks"] > n_chunks:
+                self.vector_store.delete_paper_chunks(self._chunk_ids(doc_id, previous["n_chunks"], start=n_chunks))
+        st = final_path.stat()
+        self.manifest.set(str(final_path), {
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "pdf_sha256": pdf_hash,
+            "doc_id": doc_id,
+            "n_chunks": n_chunks,
+            "topic": topic
+        })
+
+    @staticmethod
+    def _chunks_text(chunks: list[dict]) -> str:
+        """
+        Rebuild document text from its chunks, skipping the overlap between consecutive chunks.
+        由块重建文档文本，跳过相邻块之间的重叠部分。
+
+        Sentence chunks (with "page_end") use document offsets; character-window chunks use offsets within their page.
+        句子分块（含 "page_end"）使用文档级偏移；字符滑窗分块使用页内偏移。
+        """
+        parts = []
+        prev_page, prev_end = None, 0
+        for c in chunks:
+            if "page_end" in c:
+                if parts and c["char_start"] > prev_end:
+                    parts.append("\n")
+                start = max(0, prev_end - c["char_start"]) if parts else 0
+            else:
+                start = max(0, prev_end - c["char_start"]) if c["page_id"] == prev_page else 0
+            parts.append(c["text"][start:])
+            prev_page, prev_end = c["page_id"], c["char_end"]
+        return "".join(parts)
+
+    @staticmethod
+    def _load_doc(doc):
+        """
+        Chunks and embeddings of a batch document, streamed back from disk in spill mode.
+        批处理文档的片段与嵌入；溢出模式下从磁盘读回。
+
+        Returns:
+            tuple[list[dict], DocumentEmbedding]: (Chunks, embeddings). (片段, 嵌入)。
+        """
+        store = doc.get("spill_store")
+        if store is None:
+            return doc["chunks"], doc["embedding"]
+        return store.load_chunks(doc), DocumentEmbedding(doc["embedding"].file_embedding, store.load_chunk_embeddings(doc))
+
+    def _doc_text(self, doc) -> str:
+        """
+        Text of a batch document, streamed back from its chunks only when needed (TF-IDF labeling).
+        For unchanged (cached) documents the chunks are read back from the index.
+        批处理文档的文本，仅在需要时（TF-IDF 标注）由块流式重建；未变化（缓存）的文档从索引中读回块。
+        """
+        if doc["cached"]:
+            chunks = self.vector_store.get_paper_chunks(self._chunk_ids(doc["doc_id"], doc["n_chunks"]))
         else:
-            return self.text_embedder.embed_texts([full_text])[0]
+            chunks, _ = self._load_doc(doc)
+        if not chunks:
+            return PDFParser.read_text(str(doc["path"]))
+        return self._chunks_text(chunks)
 
     def add_paper(self, file_path: str, topics: list[str] = None, move: bool = False, index: bool = True):
         """
@@ -56,25 +253,31 @@ class PaperManager:
         """
         # Implementation with move before index
         path = Path(file_path).resolve()
+        # Pick up files other processes have indexed since 获取其他进程在此期间索引的文件
+        self.manifest.refresh()
         if not path.exists():
             logger.error(f"File not found: {path}")
             return
 
         logger.info(f"Processing paper: {path.name}")
-        full_text, chunks = PDFParser.parse(str(path))
-        if not full_text:
+        pdf_hash = file_sha256(str(path))
+        doc_id, chunks = PDFParser.parse_chunks(str(path))
+        # Documents without substantial chunks fall back to embedding their (short) full text
+        # 没有有效块的文档退而嵌入其（较短的）全文
+        full_text = None if chunks else PDFParser.read_text(str(path))
+        if not chunks and not full_text.strip():
             logger.warning("No text extracted.")
             return
 
         assigned_topic = "Uncategorized"
-        file_embedding = None
+        doc_embedding = None
         
         # Classification
         if topics:
-             file_embedding = self._compute_file_embedding(full_text, chunks)
+             doc_embedding = self._compute_file_embedding(full_text, chunks)
              topic_embeddings = self.text_embedder.embed_texts(topics)
              
-             sims = np.dot(topic_embeddings, file_embedding)
+             sims = np.dot(topic_embeddings, doc_embedding.file_embedding)
              best_idx = np.argmax(sims)
              assigned_topic = topics[best_idx]
              logger.info(f"Classified as: {assigned_topic}")
@@ -92,39 +295,22 @@ class PaperManager:
 
         # Index
         if index:
-            if file_embedding is None:
-                 file_embedding = self._compute_file_embedding(full_text, chunks)
+            if doc_embedding is None:
+                 doc_embedding = self._compute_file_embedding(full_text, chunks)
             
-            file_hash = hashlib.sha256(full_text.encode()).hexdigest()
-            metadata = {
-                "path": str(final_path),
-                "filename": final_path.name,
-                "sha256": file_hash,
-                "topic": assigned_topic
-            }
-            self.vector_store.add_paper_file(file_hash, file_embedding, metadata)
-
+            # Chunk embeddings were produced while pooling the file embedding, so they are reused here
+            # 片段嵌入已在计算文件嵌入时生成，此处直接复用
+            self._index_paper(final_path, doc_id, chunks, doc_embedding, assigned_topic)
+            self._record_ingest(path, final_path, pdf_hash, doc_id, len(chunks), assigned_topic)
             if chunks:
-                chunk_texts = [c["text"] for c in chunks]
-                # If we computed file_embedding using chunks, we might have already computed these embeddings,
-                # but to keep code simple and avoid passing large arrays around or complicating the helper, 
-                # we re-compute or we could have returned them. 
-                # Given the scale, re-computing or just caching in the helper if needed. 
-                # For now, standard re-compute is safer/simpler unless performance is critical.
-                # Optimization: We can reuse chunk embeddings if we want.
-                chunk_embeddings = self.text_embedder.embed_texts(chunk_texts)
-                chunk_ids = [f"{file_hash}_{i}" for i in range(len(chunks))]
-                chunk_metadatas = []
-                for i, c in enumerate(chunks):
-                    m = c.copy()
-                    del m["text"]
-                    m["path"] = str(final_path)
-                    m["filename"] = final_path.name
-                    chunk_metadatas.append(m)
-                self.vector_store.add_paper_chunks(chunk_ids, chunk_embeddings, chunk_metadatas, chunk_texts)
                 logger.info(f"Indexed {len(chunks)} chunks.")
+        elif final_path != path:
+            record = self.manifest.pop(str(path))
+            if record:
+                self.manifest.set(str(final_path), record)
+        self.manifest.save()
 
-    def batch_organize(self, root_dir: str, topics: list[str] = None):
+    def batch_organize(self, root_dir: str, topics: list[str] = None, workers: int = Config.PDF_PARSE_WORKERS, spill: bool = Config.BATCH_SPILL):
         """
         Batch organize all PDFs in a directory.
         批量整理目录中的所有 PDF。
@@ -132,41 +318,138 @@ class PaperManager:
         Args:
             root_dir (str): Root directory to scan. 要扫描的根目录。
             topics (list[str], optional): List of topics for classification. If None, auto-detect. 用于分类的主题列表。如果不提供，则自动检测。
+            workers (int): PDF parser processes, 0 to parse in-process. PDF 解析进程数，0 表示在当前进程中解析。
+            spill (bool): Two-pass mode: spill document records to disk so peak memory does not grow with the corpus.
+                两遍模式：将文档记录溢出到磁盘，使内存峰值不随语料规模增长。
         """
-        root = Path(root_dir)
+        root = Path(root_dir).resolve()
         pdf_files = list(root.glob("**/*.pdf"))
         logger.info(f"Found {len(pdf_files)} PDF files to process.")
         
         if not pdf_files:
             return
 
+        # Files whose bytes match the manifest skip parsing and embedding;
+        # their file embedding is read back from the index for classification
+        # 字节与清单一致的文件跳过解析与嵌入；其文件嵌入从索引中读回用于分类
+        self.manifest.refresh()
+        unchanged = {}
+        for p in pdf_files:
+            if not p.exists(): continue
+            pdf_hash, record = self._check_manifest(p)
+            unchanged[p] = (pdf_hash, record)
+        stored_embeddings = self.vector_store.get_paper_file_embeddings(
+            [record["doc_id"] for _, record in unchanged.values() if record])
+
         # Pre-process all files to avoid redundant parsing
         # 预处理所有文件以避免重复解析
         docs = []
+        spill_store = DocumentSpillStore() if spill else None
+
+        def add_doc(doc):
+            # In spill mode only a compact record stays in memory; chunks and embeddings go to disk
+            # 溢出模式下内存中仅保留精简记录；片段与嵌入写入磁盘
+            if spill_store is not None:
+                doc = spill_store.append(doc, doc["embedding"], doc["chunks"])
+            docs.append(doc)
+
         logger.info("Parsing files and generating embeddings...")
-        for p in pdf_files:
-            if not p.exists(): continue
-            full_text, chunks = PDFParser.parse(str(p))
-            if not full_text: 
-                logger.warning(f"Skipping {p.name}: No text extracted.")
-                continue
-            
-            emb = self._compute_file_embedding(full_text, chunks)
-            docs.append({
-                "path": p,
-                "text": full_text,
-                "chunks": chunks,
-                "embedding": emb
-            })
-
-        if not docs:
-            logger.warning("No valid documents found.")
-            return
+        try:
+            to_parse = {}
+            for p, (pdf_hash, record) in unchanged.items():
+                if record and record["doc_id"] in stored_embeddings:
+                    add_doc({
+                        "path": p,
+                        "chunks": None,
+                        "embedding": DocumentEmbedding(stored_embeddings[record["doc_id"]]),
+                        "pdf_hash": pdf_hash,
+                        "doc_id": record["doc_id"],
+                        "n_chunks": record["n_chunks"],
+                        "cached": True
+                    })
+                else:
+                    to_parse[str(p)] = (p, pdf_hash)
 
-        if topics:
-            self._classify_and_finalize(docs, topics)
-        else:
-            self._auto_organize_hybrid(docs)
+            # Parsing runs in worker processes. Chunks of consecutive documents are accumulated and embedded
+            # together, so the model runs large length-sorted batches rather than one small batch per paper
+            # 解析在工作进程中运行。相邻文档的片段累积后一起嵌入，使模型运行按长度排序的大批次，而不是每篇论文一个小批次
+            batcher = EmbeddingBatcher(self.text_embedder)
+            waiting = []
+
+            def embed_waiting():
+                batcher.flush()
+                for doc, pending in waiting:
+                    doc["embedding"] = self._pool(pending.result(), bool(doc["chunks"]))
+                    add_doc(doc)
+                waiting.clear()
+
+            for path_str, doc_id, chunks in PDFParser.parse_many(list(to_parse), workers=workers):
+                p, pdf_hash = to_parse[path_str]
+                full_text = None if chunks else PDFParser.read_text(path_str)
+                if not chunks and not full_text.strip():
+                    logger.warning(f"Skipping {p.name}: No text extracted.")
+                    continue
+                
+                doc = {
+                    "path": p,
+                    "chunks": chunks,
+                    "pdf_hash": pdf_hash,
+                    "doc_id": doc_id,
+                    "cached": False
+                }
+                waiting.append((doc, batcher.submit(self._embedding_inputs(full_text, chunks))))
+                if batcher.full:
+                    embed_waiting()
+            embed_waiting()
+            if hasattr(self.text_embedder, "throughput"):
+                stats = self.text_embedder.throughput()
+                logger.info(f"Text embedding throughput: {stats['tokens_per_sec']:.0f} tokens/s over {stats['texts']} texts "
+                            f"(padding overhead {stats['padding_overhead']:.1%})")
+
+            if spill_store is not None:
+                # Pass two works from the memory-mapped embedding matrix
+                # 第二遍基于内存映射的嵌入矩阵进行
+                spill_store.finish()
+                for doc in docs:
+                    doc["embedding"] = DocumentEmbedding(spill_store.file_embeddings[doc["spill_row"]])
+
+            n_cached = sum(1 for d in docs if d["cached"])
+            if n_cached:
+                logger.info(f"{n_cached} unchanged papers reuse their indexed embeddings.")
+
+            if not docs:
+                logger.warning("No valid documents found.")
+                return
+
+            if topics:
+                self._classify_and_finalize(docs, topics)
+            else:
+                self._auto_organize_hybrid(docs)
+        finally:
+            self.manifest.save()
+            if spill_store is not None:
+                spill_store.close()
+
+    @staticmethod
+    def _embedding_matrix(docs):
+        """
+        Stack the file embeddings of batch documents into an (N_docs x dim) matrix.
+        In spill mode the rows are gathered from the memory-mapped matrix.
+        将批处理文档的文件嵌入堆叠为 (N_docs x dim) 矩阵；溢出模式下从内存映射矩阵中取行。
+        """
+        store = docs[0].get("spill_store")
+        if store is not None:
+            return np.asarray(store.file_embeddings[[d["spill_row"] for d in docs]])
+        return np.stack([d["embedding"].file_embedding for d in docs])
+
+    def _finalize_by_label(self, docs, labels, names):
+        """
+        Finalize documents grouped by label, one bulk group per topic.
+        按标签分组完成文档处理，每个主题一个批量分组。
+        """
+        for label in np.unique(labels):
+            members = np.flatnonzero(labels == label)
+            self._finalize_group([docs[i] for i in members], names[label])
 
     def _classify_and_finalize(self, docs, topics):
         """
@@ -175,12 +458,11 @@ class PaperManager:
         """
         topic_embeddings = self.text_embedder.embed_texts(topics)
         
-        for doc in docs:
-             file_embedding = doc["embedding"]
-             sims = np.dot(topic_embeddings, file_embedding)
-             best_idx = np.argmax(sims)
-             assigned_topic = topics[best_idx]
-             self._finalize_paper(doc, assigned_topic)
+        # One (N_docs x N_topics) product classifies the whole batch
+        # 一次 (N_docs x N_topics) 矩阵乘法完成整批分类
+        sims = self._embedding_matrix(docs) @ topic_embeddings.T
+        best_idx = np.argmax(sims, axis=1)
+        self._finalize_by_label(docs, best_idx, topics)
 
     def _auto_organize_hybrid(self, docs):
         """
@@ -197,18 +479,17 @@ class PaperManager:
             topic_embeddings = self.text_embedder.embed_texts(existing_topics)
             threshold = 0.35 # Similarity threshold (heuristic) # 相似度阈值（启发式）
             
-            for doc in docs:
-                file_embedding = doc["embedding"]
-                sims = np.dot(topic_embeddings, file_embedding)
-                best_idx = np.argmax(sims)
-                best_score = sims[best_idx]
-                
-                if best_score > threshold:
-                    assigned_topic = existing_topics[best_idx]
-                    logger.info(f"Matched {doc['path'].name} to existing topic '{assigned_topic}' (Score: {best_score:.2f})")
-                    self._finalize_paper(doc, assigned_topic)
-                else:
-                    unassigned_docs.append(doc)
+            sims = self._embedding_matrix(docs) @ topic_embeddings.T
+            best_idx = np.argmax(sims, axis=1)
+            best_scores = sims[np.arange(len(docs)), best_idx]
+            matched = best_scores > threshold
+
+            for label in np.unique(best_idx[matched]):
+                members = np.flatnonzero(matched & (best_idx == label))
+                logger.info(f"Matched {len(members)} papers to existing topic '{existing_topics[label]}' "
+                            f"(Scores: {best_scores[members].min():.2f}-{best_scores[members].max():.2f})")
+                self._finalize_group([docs[i] for i in members], existing_topics[label])
+            unassigned_docs = [docs[i] for i in np.flatnonzero(~matched)]
         else:
             unassigned_docs = docs
 
@@ -223,8 +504,9 @@ class PaperManager:
         对论文进行聚类并生成新主题。
         """
         try:
+            from scipy import sparse
             from sklearn.cluster import KMeans
-            from sklearn.feature_extraction.text import TfidfVectorizer
+            from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
         except ImportError:
             logger.error("scikit-learn is required for auto-organization. Please install it.")
             return
@@ -234,32 +516,36 @@ class PaperManager:
         if num_docs < 2:
             # Too few documents to cluster, put in "General" or "New_Topic"
             # 文档太少无法聚类，放入 "General" 或 "New_Topic"
-            for doc in docs:
-                self._finalize_paper(doc, "General")
+            self._finalize_group(docs, "General")
             return
 
         # Dynamic cluster count
         n_clusters = min(max(2, num_docs // 3), 8)
         logger.info(f"Clustering {num_docs} papers into {n_clusters} topics...")
         
-        embeddings = [d["embedding"] for d in docs]
         kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-        X = np.array(embeddings)
+        X = self._embedding_matrix(docs)
         labels = kmeans.fit_predict(X)
         
         # 3. Label Clusters via TF-IDF
-        cluster_texts = [""] * n_clusters
-        for i, label in enumerate(labels):
-            cluster_texts[label] += " " + docs[i]["text"]
-            
-        vectorizer = TfidfVectorizer(stop_words='english', max_features=100)
+        # Term counts are accumulated one document at a time and summed per cluster,
+        # so document texts are streamed instead of concatenated in memory
+        # 逐文档累计词频并按簇求和，文档文本以流式方式处理而不在内存中拼接
         cluster_names = {}
         
         try:
+            counter = CountVectorizer(stop_words='english')
+            doc_counts = counter.fit_transform(self._doc_text(doc) for doc in docs)
+            membership = sparse.csr_matrix((np.ones(num_docs), (labels, np.arange(num_docs))), shape=(n_clusters, num_docs))
+            cluster_counts = membership @ doc_counts
+
             # Check if we have enough content
-            if any(len(t.strip()) > 0 for t in cluster_texts):
-                tfidf_matrix = vectorizer.fit_transform(cluster_texts)
-                feature_names = vectorizer.get_feature_names_out()
+            if cluster_counts.nnz > 0:
+                # Keep the 100 most frequent terms (same as TfidfVectorizer(max_features=100))
+                # 保留出现频率最高的 100 个词（与 TfidfVectorizer(max_features=100) 一致）
+                top_terms = np.asarray(cluster_counts.sum(axis=0)).ravel().argsort()[::-1][:100]
+                tfidf_matrix = TfidfTransformer().fit_transform(cluster_counts[:, top_terms])
+                feature_names = counter.get_feature_names_out()[top_terms]
                 
                 for i in range(n_clusters):
                     row = tfidf_matrix[i]
@@ -287,18 +573,17 @@ class PaperManager:
 
         # 4. Move and Index
         logger.info("Applying organization...")
-        for i, doc in enumerate(docs):
-            cluster_id = labels[i]
-            topic = cluster_names.get(cluster_id, f"Topic_{cluster_id+1}")
-            self._finalize_paper(doc, topic)
+        names = {i: cluster_names.get(i, f"Topic_{i+1}") for i in range(n_clusters)}
+        self._finalize_by_label(docs, labels, names)
 
-    def _finalize_paper(self, doc, topic):
+    def _move_paper(self, original_path: Path, topic: str) -> Path:
         """
-        Helper to move and index a pre-processed paper.
+        Move a paper into its topic directory.
+        将论文移动到其主题目录。
+
+        Returns:
+            Path: Final location (the original one if the move failed). 最终位置（移动失败时为原位置）。
         """
-        original_path = doc["path"]
-        
-        # Move
         dest_dir = Config.PAPERS_DIR / topic
         dest_dir.mkdir(parents=True, exist_ok=True)
         dest_path = dest_dir / original_path.name
@@ -311,31 +596,51 @@ class PaperManager:
                 logger.info(f"Moved {original_path.name} to {topic}")
             except Exception as e:
                 logger.error(f"Failed to move {original_path.name}: {e}")
-            
-        # Index
-        try:
-            file_hash = hashlib.sha256(doc["text"].encode()).hexdigest()
-            metadata = {
-                "path": str(final_path),
-                "filename": final_path.name,
-                "sha256": file_hash,
-                "topic": topic
-            }
-            self.vector_store.add_paper_file(file_hash, doc["embedding"], metadata)
-            
-            if doc["chunks"]:
-                 chunk_texts = [c["text"] for c in doc["chunks"]]
-                 # Re-embed chunks
-                 chunk_embeddings = self.text_embedder.embed_texts(chunk_texts)
-                 chunk_ids = [f"{file_hash}_{i}" for i in range(len(doc["chunks"]))]
-                 chunk_metadatas = []
-                 for i, c in enumerate(doc["chunks"]):
-                    m = c.copy()
-                    del m["text"]
-                    m["path"] = str(final_path)
-                    m["filename"] = final_path.name
-                    chunk_metadatas.append(m)
-                 self.vector_store.add_paper_chunks(chunk_ids, chunk_embeddings, chunk_metadatas, chunk_texts)
-        except Exception as e:
-            logger.error(f"Failed to index {final_path.name}: {e}")
+        return final_path
+
+    def _finalize_group(self, docs, topic):
+        """
+        Move and index pre-processed papers that share a topic, batching their index writes.
+        移动并索引同一主题下的已预处理论文，并批量写入索引。
+        """
+        updated_ids, updated_chunk_ids, updated_metadatas = [], [], []
+
+        with self.vector_store.writer() as writer:
+            for doc in docs:
+                original_path = doc["path"]
+                final_path = self._move_paper(original_path, topic)
 
+                if doc["cached"]:
+                    # Unchanged content: only the location/topic metadata may need updating
+                    # 内容未变化：仅需更新位置/主题元数据
+                    record = self.manifest.pop(str(original_path))
+                    if final_path != original_path or record["topic"] != topic:
+                        updated_ids.append(doc["doc_id"])
+                        updated_chunk_ids.append(self._chunk_ids(doc["doc_id"], doc["n_chunks"]))
+                        updated_metadatas.append({"path": str(final_path), "filename": final_path.name, "topic": topic})
+                        record["topic"] = topic
+                    self.manifest.set(str(final_path), record)
+                    continue
+
+                chunks, doc_embedding = self._load_doc(doc)
+                metadata, ids, metadatas, texts = self._paper_entries(final_path, doc["doc_id"], chunks, topic)
+                try:
+                    writer.add_paper_file(doc["doc_id"], doc_embedding.file_embedding, metadata)
+                    if chunks:
+                        writer.add_paper_chunks(ids, doc_embedding.chunk_embeddings, metadatas, texts)
+                    # The manifest entry is only recorded once the writes have succeeded
+                    # 仅在写入成功后才记录清单条目
+                    writer.on_flush(functools.partial(
+                        self._record_ingest, original_path, final_path, doc["pdf_hash"], doc["doc_id"], len(chunks), topic))
+                except Exception as e:
+                    logger.error(f"Failed to index papers under '{topic}': {e}")
+            try:
+                writer.flush()
+            except Exception as e:
+                logger.error(f"Failed to index papers under '{topic}': {e}")
+
+        if updated_ids:
+            try:
+                self.vector_store.update_paper_metadata(updated_ids, updated_chunk_ids, updated_metadatas)
+            except Exception as e:
+                logger.error(f"Failed to update metadata of {len(updated_ids)} papers under '{topic}': {e}")
@@ -0,0 +1,214 @@
+import gc
+import os
+import threading
+import time
+from agent.config import Config
+from agent.utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class _Entry:
+    __slots__ = ("instance", "refs", "idle_since", "lock")
+
+    def __init__(self):
+        self.instance = None
+        self.refs = 0
+        self.idle_since = None
+        # Held while the instance is built, so one key is loaded once while other keys load in parallel
+        # 构建实例时持有，使同一个键只加载一次，而不同的键可并行加载
+        self.lock = threading.Lock()
+
+class ResourceRegistry:
+    """
+    Process-wide, reference-counted registry of expensive objects (embedders, vector stores), keyed by their configuration.
+    进程级、带引用计数的昂贵对象（嵌入模型、向量数据库）注册表，以其配置为键。
+
+    Every caller asking for the same key gets the same instance. When the last holder releases it, the instance
+    stays loaded; with `idle_unload` set it is dropped after being unused for that many seconds.
+    对同一个键的所有请求都得到同一个实例。最后一个持有者释放后实例仍保持加载；若设置了 `idle_unload`，
+    则在闲置该秒数后卸载。
+    """
+    def __init__(self, idle_unload: float = Config.REGISTRY_IDLE_UNLOAD):
+        """
+        Args:
+            idle_unload (float, optional): Seconds an unreferenced instance is kept; None keeps it until exit.
+                未被引用的实例保留的秒数；None 表示保留到进程退出。
+        """
+        self.idle_unload = idle_unload
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._keys = {}  # id(instance) -> key
+
+    def acquire(self, key: tuple, factory):
+        """
+        Return the instance for `key`, building it with `factory` if needed, and take a reference to it.
+        返回 `key` 对应的实例（必要时用 `factory` 构建），并持有一个引用。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            # Counted before loading, so an idle unload cannot drop an entry that is being built
+            # 在加载之前计数，使空闲卸载不会移除正在构建的条目
+            entry.refs += 1
+            entry.idle_since = None
+        try:
+            with entry.lock:
+                if entry.instance is None:
+                    instance = factory()
+                    with self._lock:
+                        entry.instance = instance
+                        self._keys[id(instance)] = key
+        except BaseException:
+            self._release_entry(key, entry)
+            raise
+        return entry.instance
+
+    def release(self, instance):
+        """
+        Drop one reference to an instance obtained from `acquire`; unknown instances are ignored.
+        释放一个由 `acquire` 获得的实例引用；未知实例将被忽略。
+        """
+        with self._lock:
+            key = self._keys.get(id(instance))
+            entry = self._entries.get(key) if key is not None else None
+        if entry is not None:
+            self._release_entry(key, entry)
+
+    def _release_entry(self, key: tuple, entry: _Entry):
+        with self._lock:
+            entry.refs = max(0, entry.refs - 1)
+            if entry.refs:
+                return
+            if entry.instance is None:
+                # The factory failed; forget the entry 构建失败；删除该条目
+                self._entries.pop(key, None)
+                return
+            entry.idle_since = time.monotonic()
+        if self.idle_unload is not None:
+            timer = threading.Timer(self.idle_unload, self.unload_idle)
+            timer.daemon = True
+            timer.start()
+
+    def unload_idle(self, max_idle: float = None) -> int:
+        """
+        Unload instances that have had no references for at least `max_idle` seconds (default `idle_unload`).
+        卸载至少 `max_idle` 秒（默认为 `idle_unload`）没有引用的实例。
+
+        Returns:
+            int: Number of unloaded instances. 卸载的实例数。
+        """
+        max_idle = self.idle_unload if max_idle is None else max_idle
+        if max_idle is None:
+            return 0
+        now = time.monotonic()
+        unloaded = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.refs == 0 and entry.idle_since is not None and now - entry.idle_since >= max_idle:
+                    del self._entries[key]
+                    self._keys.pop(id(entry.instance), None)
+                    unloaded.append((key, entry.instance))
+        for key, instance in unloaded:
+            logger.info(f"Unloading idle {key[0]} {key[1:]}")
+            close = getattr(instance, "close", None)
+            if close is not None:
+                close()
+        count = len(unloaded)
+        # Drop the last references before collecting 回收前先丢弃最后的引用
+        unloaded = instance = close = None
+        if count:
+            gc.collect()
+        return count
+
+    def stats(self) -> list[dict]:
+        """
+        Loaded instances with their reference counts.
+        已加载的实例及其引用计数。
+        """
+        with self._lock:
+            return [{"key": key, "refs": entry.refs, "loaded": entry.instance is not None}
+                    for key, entry in self._entries.items()]
+
+_default_registry = ResourceRegistry()
+
+def default_registry() -> ResourceRegistry:
+    return _default_registry
+
+def text_embedder(model_name: str = Config.TEXT_MODEL_NAME, device: str = None, use_cache: bool = Config.USE_EMBEDDING_CACHE,
+                  backend: str = Config.EMBEDDER_BACKEND, registry: ResourceRegistry = None):
+    """
+    Shared `TextEmbedder` for this configuration; release it with `release`.
+    该配置下共享的 `TextEmbedder`；使用完毕后调用 `release` 释放。
+    """
+    device = device or Config.DEVICE
+
+    def build():
+        from agent.models.text_embedder import TextEmbedder
+        return TextEmbedder(model_name, device=device, use_cache=use_cache, backend=backend)
+    return (registry or _default_registry).acquire(("text_embedder", model_name, device, use_cache, backend), build)
+
+def image_embedder(model_name: str = Config.IMAGE_MODEL_NAME, pretrained: str = Config.IMAGE_MODEL_PRETRAINED, device: str = None,
+                   use_cache: bool = Config.USE_EMBEDDING_CACHE, backend: str = Config.EMBEDDER_BACKEND,
+                   load_vision: bool = False, registry: ResourceRegistry = None):
+    """
+    Shared `ImageEmbedder` for this configuration; release it with `release`.
+    该配置下共享的 `ImageEmbedder`；使用完毕后调用 `release` 释放。
+
+    The vision tower is part of the same instance and is loaded on first image use, so `load_vision` is not part
+    of the key: it only decides whether a newly built embedder loads it right away.
+    视觉编码器属于同一实例，并在首次处理图像时加载，因此 `load_vision` 不属于键：它只决定新建的嵌入器是否立即加载。
+    """
+    device = device or Config.DEVICE
+
+    def build():
+        from agent.models.image_embedder import ImageEmbedder
+        return ImageEmbedder(model_name, pretrained=pretrained, device=device, use_cache=use_cache, backend=backend,
+                             load_vision=load_vision)
+    return (registry or _default_registry).acquire(("image_embedder", model_name, pretrained, device, use_cache, backend), build)
+
+def vector_store(persist_dir: str = str(Config.INDEX_DIR), backend: str = None, registry: ResourceRegistry = None):
+    """
+    Shared `VectorStore` for this directory and backend; release it with `release`.
+    该目录与后端下共享的 `VectorStore`；使用完毕后调用 `release` 释放。
+    """
+    backend = backend or Config.VECTOR_BACKEND
+    persist_dir = os.path.abspath(persist_dir)
+
+    def build():
+        from agent.index.vector_store import VectorStore
+        return VectorStore(persist_dir, backend=backend)
+    return (registry or _default_registry).acquire(("vector_store", persist_dir, backend), build)
+
+def release(instance, registry: ResourceRegistry = None):
+    (registry or _default_registry).release(instance)
+
+class SharedResources:
+    """
+    The registry instances one service acquired, so the service can release exactly those in `close`.
+    某个服务从注册表获得的实例，使该服务能在 `close` 中准确释放它们。
+    """
+    def __init__(self, registry: ResourceRegistry = None):
+        self.registry = registry or _default_registry
+        self._held = []
+        self._lock = threading.Lock()
+
+    def _hold(self, instance):
+        with self._lock:
+            self._held.append(instance)
+        return instance
+
+    def text_embedder(self, **kwargs):
+        return self._hold(text_embedder(registry=self.registry, **kwargs))
+
+    def image_embedder(self, **kwargs):
+        return self._hold(image_embedder(registry=self.registry, **kwargs))
+
+    def vector_store(self, **kwargs):
+        return self._hold(vector_store(registry=self.registry, **kwargs))
+
+    def release(self):
+        with self._lock:
+            held, self._held = self._held, []
+        for instance in held:
+            self.registry.release(instance)
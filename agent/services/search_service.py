@@ -1,9 +1,90 @@
+from agent.config import Config
+from agent.index.filters import SearchFilter
+from agent.index.result_cache import ResultCache
 from agent.index.vector_store import VectorStore
 from agent.models.text_embedder import TextEmbedder
+from agent.services.registry import SharedResources
 from agent.utils.logging import setup_logger
 
 logger = setup_logger(__name__)
 
+SEARCH_MODES = ("dense", "hybrid", "prefilter")
+FILE_RANKINGS = ("collection", "chunks")
+# Chunk metadata fields that describe the paper itself
+# 片段元数据中描述论文本身的字段
+FILE_METADATA_KEYS = ("path", "filename", "sha256", "topic")
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = Config.RRF_K) -> list[tuple[str, float]]:
+    """
+    Fuse several ranked id lists with reciprocal rank fusion: score(d) = sum 1 / (k + rank).
+    使用倒数排名融合合并多个排序的 ID 列表：score(d) = sum 1 / (k + rank)。
+
+    Returns:
+        list[tuple[str, float]]: (id, fused score), best first. (ID, 融合分数)，按分数降序。
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+def aggregate_chunk_hits(chunk_results: dict, top_k: int, method: str = None, top_m: int = None) -> dict:
+    """
+    Rank papers from a single-query chunk result, grouping hits by sha256 (or path).
+    由单查询片段结果对论文排序，按 sha256（或路径）对命中分组。
+
+    Each paper is scored by the cosine similarity (1 - d / 2 for normalized vectors) of its best chunk ("max"),
+    or by the sum over its best `top_m` chunks ("topm"), which favours papers that match in several places.
+    每篇论文按其最佳片段的余弦相似度（归一化向量下为 1 - d / 2）打分（"max"），
+    或按其前 `top_m` 个片段的相似度之和打分（"topm"），后者更偏向多处匹配的论文。
+
+    Args:
+        chunk_results (dict): Single-query chunk result, ordered by distance. 按距离排序的单查询片段结果。
+        top_k (int): Number of papers to return. 返回的论文数。
+        method (str, optional): "max" or "topm". Defaults to Config.FILE_AGGREGATION. 聚合方式。
+        top_m (int, optional): Chunks summed per paper for "topm". Defaults to Config.FILE_AGGREGATION_TOP_M. "topm" 时每篇论文累加的片段数。
+
+    Returns:
+        dict: Same shape as `search_paper_files`, with the best chunk distance per paper and a "scores" key.
+            与 `search_paper_files` 形状相同，距离为每篇论文的最佳片段距离，并附 "scores" 键。
+    """
+    method = method or Config.FILE_AGGREGATION
+    if method not in ("max", "topm"):
+        raise ValueError(f"Unknown file aggregation: {method}")
+    top_m = 1 if method == "max" else (top_m or Config.FILE_AGGREGATION_TOP_M)
+
+    papers = {}
+    for meta, dist in zip(chunk_results["metadatas"][0], chunk_results["distances"][0]):
+        key = meta.get("sha256") or meta.get("path")
+        paper = papers.get(key)
+        if paper is None:
+            paper = papers[key] = {"metadata": {k: meta[k] for k in FILE_METADATA_KEYS if k in meta}, "distances": []}
+        # Hits arrive in ascending distance, so the first `top_m` are the best ones
+        # 命中按距离升序到达，前 `top_m` 个即为最佳
+        if len(paper["distances"]) < top_m:
+            paper["distances"].append(dist)
+
+    ranked = sorted(
+        ((sum(1.0 - d / 2.0 for d in paper["distances"]), key, paper) for key, paper in papers.items()),
+        key=lambda item: item[0], reverse=True
+    )[:top_k]
+    return {
+        "ids": [[key for _, key, _ in ranked]],
+        "embeddings": None,
+        "documents": [[None for _ in ranked]],
+        "uris": None,
+        "data": None,
+        "metadatas": [[paper["metadata"] for _, _, paper in ranked]],
+        "distances": [[paper["distances"][0] for _, _, paper in ranked]],
+        "scores": [[score for score, _, _ in ranked]],
+        "included": ["metadatas", "distances"],
+    }
+
+def _head(results: dict, n: int) -> dict:
+    # First `n` hits of a single-query result
+    # 单查询结果的前 `n` 个命中
+    return {k: [v[0][:n]] if isinstance(v, list) and v and isinstance(v[0], list) else v for k, v in results.items()}
+
 class SearchService:
     """
     Service for searching papers.
@@ -18,10 +99,32 @@ class SearchService:
             text_embedder: Text embedding model instance. 文本嵌入模型实例。
             vector_store: Vector store instance. 向量数据库实例。
         """
-        self.text_embedder = text_embedder or TextEmbedder()
-        self.vector_store = vector_store or VectorStore()
+        # Models and stores not passed in are shared with every other service in the process
+        # 未传入的模型与向量数据库在进程内的所有服务之间共享
+        self._shared = SharedResources()
+        self.text_embedder = text_embedder or self._shared.text_embedder()
+        self.vector_store = vector_store or self._shared.vector_store()
+        # Results are keyed by (normalized query, flags) and tagged with the index generation
+        # 结果以 (规范化查询, 标志) 为键，并记录索引代数
+        self.result_cache = ResultCache()
+
+    def close(self):
+        """
+        Release the shared text embedder and vector store this service acquired.
+        释放本服务获取的共享文本嵌入模型与向量数据库。
+        """
+        self._shared.release()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        Collapse whitespace so trivially different spellings of a query share cache entries.
+        合并空白字符，使仅有空白差异的查询共享缓存条目。
+        """
+        return " ".join(query.split())
 
-    def search_paper(self, query: str, top_k: int = 5, return_snippets: bool = False, return_files: bool = True):
+    def search_paper(self, query: str, top_k: int = 5, return_snippets: bool = False, return_files: bool = True,
+                     mode: str = None, file_ranking: str = None, search_filter: SearchFilter = None):
         """
         Search for papers based on a query.
         根据查询内容搜索论文。
@@ -31,27 +134,171 @@ class SearchService:
             top_k (int): Number of top results to return. 返回的前 K 个结果。
             return_snippets (bool): Whether to return chunk snippets. 是否返回文本片段。
             return_files (bool): Whether to return file-level results. 是否返回文件级结果。
+            mode (str, optional): Snippet retrieval mode, one of "dense", "hybrid" (BM25 + dense, RRF) or
+                "prefilter" (BM25 candidates re-scored densely). Defaults to Config.SEARCH_MODE.
+                片段检索模式："dense"（语义）、"hybrid"（BM25 与语义 RRF 融合）或 "prefilter"（BM25 候选再做语义打分）。
+                默认为 Config.SEARCH_MODE。
+            file_ranking (str, optional): "collection" to query the per-paper vectors, or "chunks" to rank papers
+                from their chunk hits (see `aggregate_chunk_hits`). Defaults to Config.FILE_RANKING.
+                "collection" 查询每篇论文的向量；"chunks" 由片段命中对论文排序（见 `aggregate_chunk_hits`）。默认为 Config.FILE_RANKING。
+            search_filter (SearchFilter, optional): Topic / filename / page range / directory restriction, evaluated
+                inside the index. 在索引内部执行的主题 / 文件名 / 页码范围 / 目录限定。
         
         Returns:
             dict: Search results containing files and/or snippets. 包含文件和/或片段的搜索结果字典。
         """
+        mode = mode or Config.SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode} (expected one of {', '.join(SEARCH_MODES)})")
+        file_ranking = self._check_file_ranking(file_ranking)
+        query = self.normalize_query(query)
+        cache_key = (query, return_snippets, return_files, mode, file_ranking,
+                     search_filter.key() if search_filter is not None else None)
+        # Only plain nearest-neighbour results are prefixes of a larger `top_k`; fused, prefiltered and
+        # chunk-aggregated results depend on `top_k` itself, so they are cached per `top_k`
+        # 只有纯近邻结果是较大 `top_k` 结果的前缀；融合、预筛选与片段聚合的结果依赖 `top_k` 本身，因此按 `top_k` 分别缓存
+        if (return_snippets and mode != "dense") or (return_files and file_ranking != "collection"):
+            cache_key += (top_k,)
+        generation = self.vector_store.generation
+        cached = self.result_cache.get(cache_key, top_k, generation)
+        if cached is not None:
+            logger.info(f"Searching for: {query} (cached)")
+            return cached
+
         logger.info(f"Searching for: {query}")
         # Generate embedding for the query
         # 为查询生成嵌入向量
-        query_embedding = self.text_embedder.embed_texts([query])[0]
+        query_embedding = self.text_embedder.embed_queries([query])[0]
         
         results = {}
         
-        if return_files:
+        if return_files and file_ranking == "chunks":
+            # One chunk query ranks the papers; dense snippets are its head
+            # 一次片段查询完成论文排序；语义模式下的片段即其前若干项
+            chunk_results, file_results = self._rank_files_by_chunks(query_embedding, top_k, search_filter)
+            results["files"] = file_results[0]
+            if return_snippets and mode == "dense":
+                results["snippets"] = _head(chunk_results[0], top_k)
+        elif return_files:
             # Search in the papers_files collection
             # 在论文文件集合中搜索
-            file_results = self.vector_store.search_paper_files(query_embedding, n_results=top_k)
+            file_results = self.vector_store.search_paper_files(query_embedding, n_results=top_k, search_filter=search_filter)
             results["files"] = file_results
 
-        if return_snippets:
+        if return_snippets and "snippets" not in results:
             # Search in the papers_chunks collection
             # 在论文片段集合中搜索
-            chunk_results = self.vector_store.search_paper_chunks(query_embedding, n_results=top_k)
-            results["snippets"] = chunk_results
-            
+            results["snippets"] = self._search_chunks(query, query_embedding, top_k, mode, search_filter)
+
+        self.result_cache.put(cache_key, top_k, generation, results)
+        return results
+
+    @staticmethod
+    def _check_file_ranking(file_ranking: str) -> str:
+        file_ranking = file_ranking or Config.FILE_RANKING
+        if file_ranking not in FILE_RANKINGS:
+            raise ValueError(f"Unknown file ranking: {file_ranking} (expected one of {', '.join(FILE_RANKINGS)})")
+        return file_ranking
+
+    def _rank_files_by_chunks(self, query_embeddings, top_k: int, search_filter: SearchFilter = None):
+        """
+        Query chunks with oversampling and aggregate them per paper, widening the query until every query
+        has `top_k` papers or every chunk passing the filter has been returned.
+        以过采样方式查询片段并按论文聚合；若某个查询的论文数不足 `top_k`，则扩大查询直至返回了所有通过过滤器的片段。
+
+        Returns:
+            tuple[list[dict], list[dict]]: Per-query chunk results and file results. 每个查询的片段结果与文件结果。
+        """
+        total = self.vector_store.papers_chunks.count()
+        n_chunks = min(max(total, 1), top_k * Config.FILE_CHUNK_OVERSAMPLE)
+        while True:
+            chunk_results = self.vector_store.split_results(
+                self.vector_store.search_paper_chunks(query_embeddings, n_results=n_chunks, search_filter=search_filter)
+            )
+            file_results = [aggregate_chunk_hits(r, top_k) for r in chunk_results]
+            if n_chunks >= total or all(len(f["ids"][0]) >= top_k for f in file_results):
+                return chunk_results, file_results
+            # Fewer chunks than asked for means the filter (or the collection) is exhausted for every query
+            # 返回的片段少于请求数说明每个查询的过滤结果（或集合）已取尽
+            if all(len(r["ids"][0]) < n_chunks for r in chunk_results):
+                return chunk_results, file_results
+            n_chunks = min(total, n_chunks * 2)
+
+    def _search_chunks(self, query: str, query_embedding, top_k: int, mode: str, search_filter: SearchFilter = None) -> dict:
+        if mode == "prefilter":
+            # Dense-score only the BM25 candidates; too few lexical hits fall back to a full dense search
+            # 仅对 BM25 候选做语义打分；词法命中过少时回退为全量语义检索
+            candidates = self.vector_store.search_paper_chunks_lexical(query, n_results=max(Config.LEXICAL_PREFILTER_CANDIDATES, top_k))
+            if len(candidates) >= top_k:
+                results = self.vector_store.score_paper_chunks(query_embedding, [c for c, _ in candidates], n_results=top_k,
+                                                               search_filter=search_filter)
+                if len(results["ids"][0]) >= top_k:
+                    return results
+        elif mode == "hybrid":
+            n_candidates = top_k * Config.HYBRID_CANDIDATES_FACTOR
+            dense = self.vector_store.search_paper_chunks(query_embedding, n_results=n_candidates, search_filter=search_filter)
+            lexical = [c for c, _ in self.vector_store.search_paper_chunks_lexical(query, n_results=n_candidates)]
+            if search_filter is not None and lexical:
+                lexical = self.vector_store.score_paper_chunks(query_embedding, lexical, keep_order=True,
+                                                               search_filter=search_filter)["ids"][0]
+            fused = reciprocal_rank_fusion([dense["ids"][0], lexical])[:top_k]
+            # Distances stay dense (squared L2) so callers can treat every mode alike; the fused score is added,
+            # looked up per returned id since chunks deleted meanwhile are dropped
+            # 距离仍为语义距离（平方 L2），便于调用方统一处理；另附融合分数，按返回的 ID 查找，因为期间被删除的片段会被丢弃
+            results = self.vector_store.score_paper_chunks(query_embedding, [c for c, _ in fused], keep_order=True)
+            score_of = dict(fused)
+            results["scores"] = [[score_of[i] for i in results["ids"][0]]]
+            return results
+        return self.vector_store.search_paper_chunks(query_embedding, n_results=top_k, search_filter=search_filter)
+
+    def cache_stats(self) -> dict:
+        """
+        Hit-rate metrics of the result cache and the query embedding cache.
+        结果缓存与查询嵌入缓存的命中率指标。
+        """
+        stats = {"results": self.result_cache.stats()}
+        query_cache = getattr(self.text_embedder, "query_cache", None)
+        if query_cache is not None:
+            stats["query_embeddings"] = query_cache.stats()
+        return stats
+
+    def search_papers_batch(self, queries: list[str], top_k: int = 5, return_snippets: bool = False, return_files: bool = True,
+                            file_ranking: str = None, search_filter: SearchFilter = None):
+        """
+        Search for many queries at once: one embedding pass and one multi-vector query per collection.
+        一次搜索多个查询：一次嵌入计算，每个集合一次多向量查询。
+
+        Args:
+            queries (list[str]): Search queries. 查询字符串列表。
+            top_k (int): Number of top results per query. 每个查询返回的前 K 个结果。
+            return_snippets (bool): Whether to return chunk snippets. 是否返回文本片段。
+            return_files (bool): Whether to return file-level results. 是否返回文件级结果。
+            file_ranking (str, optional): "collection" or "chunks", as in `search_paper`. 文件排序方式，同 `search_paper`。
+            search_filter (SearchFilter, optional): Applied to every query. 应用于每个查询的过滤器。
+
+        Returns:
+            list[dict]: One result per query, in the same shape as `search_paper`. 每个查询一个结果，形状与 `search_paper` 相同。
+        """
+        if not queries:
+            return []
+        file_ranking = self._check_file_ranking(file_ranking)
+        logger.info(f"Searching for {len(queries)} queries")
+        query_embeddings = self.text_embedder.embed_queries(queries)
+
+        results = [{} for _ in queries]
+        if return_files and file_ranking == "chunks":
+            chunk_results, file_results = self._rank_files_by_chunks(query_embeddings, top_k, search_filter)
+            for result, chunks, files in zip(results, chunk_results, file_results):
+                result["files"] = files
+                if return_snippets:
+                    result["snippets"] = _head(chunks, top_k)
+            return results
+        if return_files:
+            file_results = self.vector_store.search_paper_files(query_embeddings, n_results=top_k, search_filter=search_filter)
+            for result, files in zip(results, self.vector_store.split_results(file_results)):
+                result["files"] = files
+        if return_snippets:
+            chunk_results = self.vector_store.search_paper_chunks(query_embeddings, n_results=top_k, search_filter=search_filter)
+            for result, snippets in zip(results, self.vector_store.split_results(chunk_results)):
+                result["snippets"] = snippets
         return results
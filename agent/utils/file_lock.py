@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+class FileLock:
+    """
+    Exclusive lock on a sidecar file, shared by every process (and every instance) that opens the same path.
+    基于旁路文件的排他锁，所有打开同一路径的进程（以及实例）之间共享。
+
+    Re-entrant within the owning object: nested `with` blocks only lock the file once. Uses `fcntl.flock` on
+    POSIX and `msvcrt.locking` on Windows; the lock is released by the OS if the process dies.
+    在所属对象内可重入：嵌套的 `with` 块只锁定文件一次。POSIX 上使用 `fcntl.flock`，Windows 上使用
+    `msvcrt.locking`；进程退出时锁由操作系统释放。
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str | Path): Lock file, created if missing. 锁文件，不存在时创建。
+        """
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                _lock_fd(fd)
+            except BaseException:
+                os.close(fd)
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+try:
+    import fcntl
+
+    def _lock_fd(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_fd(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+
+    def _lock_fd(fd: int):
+        # LK_LOCK gives up after ten seconds, so poll the non-blocking variant instead
+        # LK_LOCK 在十秒后放弃，因此改为轮询非阻塞版本
+        while True:
+            os.lseek(fd, 0, os.SEEK_SET)
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.01)
+
+    def _unlock_fd(fd: int):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
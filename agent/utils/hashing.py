@@ -0,0 +1,19 @@
+import hashlib
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Compute the sha256 hex digest of a file, reading it in blocks.
+    分块读取文件并计算其 sha256 十六进制摘要。
+
+    Args:
+        file_path (str): Path to the file. 文件路径。
+        block_size (int): Read size in bytes. 每次读取的字节数。
+
+    Returns:
+        str: Hex digest. 十六进制摘要。
+    """
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
@@ -0,0 +1,94 @@
+"""
+Query-embedding throughput under concurrent load, with and without micro-batching (Config.QUERY_BATCHING).
+并发负载下的查询嵌入吞吐，对比开启与关闭合批（Config.QUERY_BATCHING）。
+
+Each client thread embeds its own distinct queries one at a time through `embed_queries`, as concurrent searches
+from the UI or the daemon do; the embedding cache is disabled and no query repeats, so every call reaches the model.
+每个客户端线程通过 `embed_queries` 逐条嵌入各自不同的查询，与 UI 或常驻进程中的并发检索一致；
+嵌入缓存关闭且查询不重复，因此每次调用都会执行模型。
+
+Usage 用法:
+    python benchmarks/concurrent_queries.py --model text --clients 1,4,16 --queries 32
+    python benchmarks/concurrent_queries.py --model image --clients 1,8 --window_ms 2
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from agent.config import Config
+
+TOPICS = ("transformer attention", "graph neural networks", "contrastive learning", "diffusion models",
+          "reinforcement learning", "机器翻译", "图像分割", "知识蒸馏", "a photo of a cat", "目标检测")
+
+def load(kind: str, model_name: str = None):
+    if kind == "text":
+        from agent.models.text_embedder import TextEmbedder
+        return TextEmbedder(model_name or Config.TEXT_MODEL_NAME, use_cache=False)
+    from agent.models.image_embedder import ImageEmbedder
+    return ImageEmbedder(model_name or Config.IMAGE_MODEL_NAME, use_cache=False, load_vision=False)
+
+def run(embedder, clients: int, per_client: int, tag: str) -> float:
+    """
+    Queries per second with `clients` threads each embedding `per_client` distinct queries.
+    `clients` 个线程各嵌入 `per_client` 个不同查询时的每秒查询数。
+    """
+    barrier = threading.Barrier(clients + 1)
+    errors = []
+
+    def client(c: int):
+        barrier.wait()
+        try:
+            for i in range(per_client):
+                embedder.embed_queries([f"{TOPICS[(c + i) % len(TOPICS)]} {tag} {c} {i}"])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return clients * per_client / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent query-embedding throughput benchmark")
+    parser.add_argument("--model", choices=["text", "image"], default="text", help="Which embedder to benchmark")
+    parser.add_argument("--model_name", default=None, help="Override the model name from Config")
+    parser.add_argument("--clients", default="1,2,4,8,16", help="Comma-separated numbers of concurrent client threads")
+    parser.add_argument("--queries", type=int, default=32, help="Queries per client")
+    parser.add_argument("--window_ms", type=float, default=Config.QUERY_BATCH_WINDOW_MS, help="Batching window in milliseconds")
+    args = parser.parse_args()
+
+    from agent.models.query_scheduler import QueryScheduler
+
+    embedder = load(args.model, args.model_name)
+    encode = embedder.embed_texts if args.model == "text" else embedder.embed_text
+    if embedder.scheduler is not None:
+        embedder.scheduler.close()
+    # Warm up so the first measurement does not include lazy initialization 预热，使首次测量不包含延迟初始化
+    encode(["warm up"])
+
+    print(f"{'clients':>7} {'direct q/s':>11} {'batched q/s':>12} {'speedup':>8} {'mean batch':>11}")
+    for clients in [int(c) for c in args.clients.split(",")]:
+        # Each mode gets its own queries, so neither is served from the query cache
+        # 每种模式使用各自的查询，使两者都不会命中查询缓存
+        embedder.scheduler = None
+        direct_qps = run(embedder, clients, args.queries, f"direct-{clients}")
+        scheduler = QueryScheduler(encode, window=args.window_ms / 1000, name="bench")
+        embedder.scheduler = scheduler
+        batched_qps = run(embedder, clients, args.queries, f"batched-{clients}")
+        scheduler.close()
+        print(f"{clients:>7} {direct_qps:>11.1f} {batched_qps:>12.1f} {batched_qps / direct_qps:>7.2f}x "
+              f"{scheduler.stats()['mean_batch']:>11.1f}")
+
+if __name__ == "__main__":
+    main()
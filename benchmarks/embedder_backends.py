@@ -0,0 +1,87 @@
+"""
+CPU throughput and accuracy of the embedder inference backends (float32 PyTorch vs dynamic int8).
+嵌入模型各 CPU 推理后端（float32 PyTorch 与动态 int8）的吞吐与精度。
+
+Every backend embeds the same synthetic inputs with the embedding cache disabled; converted backends are
+compared with the float32 embeddings of those inputs (which are not the accuracy-check probes).
+The first run of a backend converts and caches the model under Config.ACCELERATED_MODELS_DIR; its load time includes that.
+各后端在关闭嵌入缓存的情况下嵌入同一批合成输入；转换后的后端与这些输入的 float32 嵌入比较（与精度检查的探针输入不同）。
+某后端首次运行时会转换模型并缓存到 Config.ACCELERATED_MODELS_DIR，其加载时间包含转换耗时。
+
+Usage 用法:
+    python benchmarks/embedder_backends.py --model text --n 512 --threads 1,4
+    python benchmarks/embedder_backends.py --model image --n 64 --backends torch,int8
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from agent.config import Config
+
+WORDS = ("model learning network data training results method attention layer performance dataset "
+         "we propose evaluate loss optimization representation image text graph feature baseline "
+         "模型 学习 网络 数据 训练 结果 方法 注意力 性能").split()
+
+def synthetic_texts(n: int, seed: int = 0) -> list[str]:
+    # Chunk-like texts from a few words up to a full 128-token window
+    # 类似分块的文本，长度从几个词到完整的 128 token 窗口
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, size=int(rng.integers(4, 110)))) + "." for _ in range(n)]
+
+def load(kind: str, backend: str, model_name: str = None):
+    if kind == "text":
+        from agent.models.text_embedder import TextEmbedder
+        return TextEmbedder(model_name or Config.TEXT_MODEL_NAME, device="cpu", use_cache=False, backend=backend)
+    from agent.models.image_embedder import ImageEmbedder
+    return ImageEmbedder(model_name or Config.IMAGE_MODEL_NAME, device="cpu", use_cache=False, backend=backend)
+
+def embed(embedder, kind: str, inputs, batch_size: int) -> np.ndarray:
+    if kind == "text":
+        return np.asarray(embedder.embed_texts(inputs))
+    parts = [np.asarray(embedder.embed_images(inputs[i:i + batch_size])) for i in range(0, len(inputs), batch_size)]
+    return np.concatenate(parts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedder backend throughput/accuracy benchmark")
+    parser.add_argument("--model", choices=["text", "image"], default="text", help="Which embedder to benchmark")
+    parser.add_argument("--model_name", default=None, help="Override the model name from Config")
+    parser.add_argument("--backends", default="torch,int8", help="Comma-separated backends; the first is the reference")
+    parser.add_argument("--threads", default=None, help="Comma-separated CPU thread counts (default: PyTorch default)")
+    parser.add_argument("--n", type=int, default=256, help="Number of inputs")
+    parser.add_argument("--batch_size", type=int, default=Config.IMAGE_BATCH_SIZE, help="Images per call")
+    args = parser.parse_args()
+
+    import torch
+    from agent.models.acceleration import compare_embeddings, probe_images
+
+    inputs = synthetic_texts(args.n) if args.model == "text" else probe_images(args.n, seed=1)
+    thread_counts = [int(t) for t in args.threads.split(",")] if args.threads else [torch.get_num_threads()]
+    backends = args.backends.split(",")
+    unit = "texts" if args.model == "text" else "images"
+
+    print(f"{args.model} embedder, {args.n} {unit}")
+    print(f"{'backend':<10}{'threads':>8}{'load (s)':>10}{unit + '/s':>12}{'min cos':>10}{'mean cos':>10}{'top1':>8}")
+    reference = {}
+    for backend in backends:
+        start = time.perf_counter()
+        embedder = load(args.model, backend, args.model_name)
+        load_time = time.perf_counter() - start
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            # Warm-up pass, excluded from timing 预热，不计入计时
+            embed(embedder, args.model, inputs[:min(8, len(inputs))], args.batch_size)
+            start = time.perf_counter()
+            vectors = embed(embedder, args.model, inputs, args.batch_size)
+            rate = len(inputs) / (time.perf_counter() - start)
+            reference.setdefault(threads, vectors)
+            accuracy = compare_embeddings(reference[threads], vectors)
+            print(f"{embedder.backend:<10}{threads:>8}{load_time:>10.1f}{rate:>12.1f}"
+                  f"{accuracy['min_cosine']:>10.4f}{accuracy['mean_cosine']:>10.4f}{accuracy['top1_agreement']:>8.0%}")
+        del embedder
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Memory and recall@k of the int8-quantized memory backend against exact float32 search.
+int8 量化内存后端相对精确 float32 检索的内存占用与 recall@k。
+
+Vectors come from an existing memory-backend collection (--collection_dir) or are generated as
+clustered unit vectors. Both indexes are built in a temporary directory; the source is never modified.
+向量来自已有的 memory 后端集合 (--collection_dir)，或生成聚类分布的单位向量。两个索引都在临时目录中构建，不修改来源。
+
+Usage 用法:
+    python benchmarks/quantization_recall.py --n 200000 --dim 768
+    python benchmarks/quantization_recall.py --collection_dir data/index/matrix/papers_chunks
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from agent.index.matrix_store import MatrixCollection
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    # Clustered, normalized vectors resemble sentence/CLIP embeddings better than isotropic noise
+    # 聚类且归一化的向量比各向同性噪声更接近句子/CLIP 嵌入
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 500), dim)).astype(np.float32)
+    x = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def build(directory: Path, vectors: np.ndarray, **kwargs) -> MatrixCollection:
+    collection = MatrixCollection(directory, **kwargs)
+    ids = [str(i) for i in range(len(vectors))]
+    for start in range(0, len(vectors), 50000):
+        collection.upsert(ids[start:start + 50000], vectors[start:start + 50000])
+    return collection
+
+def timed_query(collection: MatrixCollection, queries: np.ndarray, k: int):
+    start = time.perf_counter()
+    result = collection.query(queries, n_results=k, include=["distances"])
+    return result["ids"], (time.perf_counter() - start) / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description="int8 quantization memory/recall benchmark")
+    parser.add_argument("--collection_dir", default=None, help="Existing memory-backend collection to read vectors from")
+    parser.add_argument("--n", type=int, default=100000, help="Synthetic vectors")
+    parser.add_argument("--dim", type=int, default=768, help="Synthetic dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=10, help="Results per query")
+    parser.add_argument("--rerank_factors", default="1,2,4,8", help="Comma-separated re-rank factors to evaluate")
+    args = parser.parse_args()
+
+    if args.collection_dir:
+        source = MatrixCollection(args.collection_dir)
+        vectors = source.get(include=["embeddings"])["embeddings"]
+    else:
+        vectors = synthetic_vectors(args.n, args.dim)
+    n, dim = vectors.shape
+    rng = np.random.default_rng(1)
+    # Queries are perturbed stored vectors, like a query close to but not identical to a document
+    # 查询为扰动后的已存向量，模拟与文档接近但不相同的查询
+    queries = vectors[rng.integers(0, n, args.queries)] + 0.3 * rng.normal(size=(args.queries, dim)).astype(np.float32) / np.sqrt(dim)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = build(Path(tmp) / "exact", vectors)
+        exact_ids, exact_latency = timed_query(exact, queries, args.k)
+
+        float_bytes = n * dim * 4
+        int8_bytes = n * dim + n * 4 * 2  # codes + scales + norms
+        print(f"{n} vectors x {dim} dims, k={args.k}, {args.queries} queries")
+        print(f"scanned bytes  float32: {float_bytes / 2**20:8.1f} MiB   int8: {int8_bytes / 2**20:8.1f} MiB "
+              f"({int8_bytes / float_bytes:.0%})")
+        print(f"{'mode':<18}{'recall@k':>10}{'ms/query':>10}")
+        print(f"{'float32 exact':<18}{1.0:>10.4f}{exact_latency * 1e3:>10.2f}")
+
+        quantized = build(Path(tmp) / "int8", vectors, quantization="int8")
+        for factor in [int(f) for f in args.rerank_factors.split(",")]:
+            quantized.rerank_factor = factor
+            ids, latency = timed_query(quantized, queries, args.k)
+            recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(exact_ids, ids)])
+            print(f"{f'int8 rerank x{factor}':<18}{recall:>10.4f}{latency * 1e3:>10.2f}")
+
+if __name__ == "__main__":
+    main()
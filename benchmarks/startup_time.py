@@ -0,0 +1,68 @@
+"""
+Startup-time benchmark for the command line interface.
+命令行接口的启动时间基准测试。
+
+Each command is run in a fresh interpreter several times and the wall time is reported,
+together with which heavy libraries the CLI imported before running the command.
+每个命令在新的解释器中运行多次并报告耗时，同时列出命令执行前导入了哪些重量级依赖。
+
+Usage 用法:
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --repeat 5 --query "transformer architecture"
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ["torch", "open_clip", "sentence_transformers", "chromadb", "sklearn", "fitz"]
+
+# Imports main.py and parses the arguments of `main.py --help` without running a command,
+# then reports which heavy modules were already loaded.
+# 导入 main.py 但不执行命令，然后报告已加载的重量级模块。
+IMPORT_PROBE = (
+    "import sys; sys.path.insert(0, {root!r}); import main; "
+    "print(','.join(m for m in {modules!r} if m in sys.modules))"
+)
+
+def time_command(args: list[str], repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure CLI cold-start time")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per command")
+    parser.add_argument("--query", default="transformer architecture", help="Query used for the search_paper run")
+    parser.add_argument("--skip_search", action="store_true", help="Only time --help (no model load)")
+    args = parser.parse_args()
+
+    probe = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE.format(root=str(PROJECT_ROOT), modules=HEAVY_MODULES)],
+        cwd=PROJECT_ROOT, capture_output=True, text=True
+    )
+    loaded = probe.stdout.strip().splitlines()[-1] if probe.stdout.strip() else ""
+    print(f"Heavy modules imported by `import main`: {loaded or 'none'}")
+
+    commands = {
+        "import only": [sys.executable, "-c", "import sys; sys.path.insert(0, '.'); import main"],
+        "main.py --help": [sys.executable, "main.py", "--help"],
+    }
+    if not args.skip_search:
+        # In-process search: the daemon is bypassed to measure a true cold start
+        # 进程内检索：绕过常驻进程以测量真实冷启动
+        commands["search_paper (cold)"] = [sys.executable, "main.py", "--no-daemon", "search_paper", args.query]
+
+    print(f"{'command':<24}{'min (s)':>10}{'median (s)':>12}")
+    for name, cmd in commands.items():
+        times = time_command(cmd, args.repeat)
+        print(f"{name:<24}{min(times):>10.2f}{statistics.median(times):>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,33 @@
 import argparse
+import os
 import sys
-from agent.services.paper_manager import PaperManager
-from agent.services.search_service import SearchService
-from agent.services.image_search import ImageSearchService
+from pathlib import Path
+from agent.daemon.client import DaemonClient
 from agent.utils.logging import setup_logger
 
 logger = setup_logger("main")
 
+def run_command(command: str, params: dict, use_daemon: bool = True):
+    """
+    Run a command in the agent daemon if one is running, otherwise in this process.
+    如果常驻进程正在运行则在其中执行命令，否则在当前进程中执行。
+    """
+    client = DaemonClient.discover() if use_daemon else None
+    if client is not None:
+        logger.info(f"Forwarding '{command}' to the agent daemon at {client.base_url}")
+        return client.call(command, params)
+    # Services and models are imported only for the command that needs them
+    # 仅为需要的命令导入服务与模型
+    from agent.daemon.server import ServiceHub
+    return ServiceHub().execute(command, params)
+
 def main():
     """
     Main entry point for the command line interface.
     命令行接口的主入口点。
     """
     parser = argparse.ArgumentParser(description="Local Multimodal AI Agent")
+    parser.add_argument("--no-daemon", action="store_true", help="Run in this process even if the agent daemon is running")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     # add_paper
@@ -30,23 +45,48 @@ def main():
     parser_search.add_argument("--top_k", type=int, default=5, help="Number of results")
     parser_search.add_argument("--return_snippets", action="store_true", help="Return text snippets")
     parser_search.add_argument("--return_files", action="store_true", default=True, help="Return file list")
+    parser_search.add_argument("--mode", choices=["dense", "hybrid", "prefilter"], default=None,
+                               help="Snippet retrieval mode: dense, hybrid (BM25 + dense) or prefilter (BM25 candidates)")
+    parser_search.add_argument("--file_ranking", choices=["collection", "chunks"], default=None,
+                               help="Rank files by their paper vector (collection) or by aggregated chunk hits (chunks)")
+    parser_search.add_argument("--topic", default=None, help="Only papers in these topics (comma-separated)")
+    parser_search.add_argument("--filename", default=None, help="Only files whose name matches this glob, e.g. '*survey*'")
+    parser_search.add_argument("--pages", default=None, help="Only snippets from this page range, e.g. '3-7', '5-' or '2'")
+    parser_search.add_argument("--dir", default=None, help="Only files under this directory")
 
     # search_image
     # 搜索图片命令
     parser_img_search = subparsers.add_parser("search_image", help="Search for images using text")
     parser_img_search.add_argument("query", help="Search query")
     parser_img_search.add_argument("--top_k", type=int, default=5, help="Number of results")
+    parser_img_search.add_argument("--filename", default=None, help="Only images whose name matches this glob")
+    parser_img_search.add_argument("--dir", default=None, help="Only images under this directory")
     
     # batch_organize
     # 批量整理命令
     parser_batch = subparsers.add_parser("batch_organize", help="Batch organize papers in a directory")
     parser_batch.add_argument("--root", required=True, help="Root directory containing papers")
     parser_batch.add_argument("--topics", default=None, help="Comma-separated list of topics (optional, auto-detect if omitted)")
+    parser_batch.add_argument("--workers", type=int, default=None, help="PDF parsing processes (0 = parse in-process)")
+    parser_batch.add_argument("--spill", action="store_true", help="Spill document records to disk to keep memory flat on large corpora")
     
     # index_images (New helper)
     # 索引图片命令 (新助手)
     parser_idx_img = subparsers.add_parser("index_images", help="Index all images in data/images or specified dir")
     parser_idx_img.add_argument("--dir", default=None, help="Directory to index")
+    parser_idx_img.add_argument("--workers", type=int, default=None, help="Image decoding processes (0 = decode in-process)")
+
+    # convert_index
+    # 索引后端转换命令
+    parser_convert = subparsers.add_parser("convert_index", help="Copy the index from the other vector backend into the given one")
+    parser_convert.add_argument("--backend", required=True, choices=["chroma", "memory"], help="Target backend (set Config.VECTOR_BACKEND to use it)")
+
+    # serve / stop_daemon
+    # 常驻进程命令
+    parser_serve = subparsers.add_parser("serve", help="Run the agent daemon that keeps models loaded between commands")
+    parser_serve.add_argument("--port", type=int, default=None, help="Port on localhost (default: any free port)")
+    parser_serve.add_argument("--preload_images", action="store_true", help="Load the image model at startup")
+    subparsers.add_parser("stop_daemon", help="Stop the running agent daemon")
 
     args = parser.parse_args()
 
@@ -54,16 +94,54 @@ def main():
         parser.print_help()
         sys.exit(1)
 
+    use_daemon = not args.no_daemon
     try:
-        if args.command == "add_paper":
+        if args.command == "serve":
+            from agent.daemon.server import AgentDaemon
+            daemon_kwargs = {"port": args.port} if args.port is not None else {}
+            daemon = AgentDaemon(**daemon_kwargs)
+            daemon.hub.preload(images=args.preload_images)
+            daemon.serve_forever()
+
+        elif args.command == "stop_daemon":
+            client = DaemonClient.discover()
+            if client is None:
+                print("No agent daemon is running.")
+            else:
+                client.shutdown()
+                print("Agent daemon stopped.")
+
+        elif args.command == "convert_index":
+            from agent.index.vector_store import VectorStore
+            source = VectorStore(backend="memory" if args.backend == "chroma" else "chroma")
+            VectorStore(backend=args.backend).copy_from(source)
+            print(f"Index copied into the {args.backend} backend.")
+
+        elif args.command == "add_paper":
             topics_list = [t.strip() for t in args.topics.split(",")] if args.topics else None
-            pm = PaperManager()
-            pm.add_paper(args.path, topics=topics_list, move=args.move, index=not args.no_index)
+            # Paths are resolved here because the daemon runs in another working directory
+            # 路径在此处解析，因为常驻进程的工作目录可能不同
+            run_command("add_paper", {
+                "path": str(Path(args.path).resolve()),
+                "topics": topics_list,
+                "move": args.move,
+                "index": not args.no_index
+            }, use_daemon)
             
         elif args.command == "search_paper":
-            ss = SearchService()
-            results = ss.search_paper(args.query, top_k=args.top_k, return_snippets=args.return_snippets, return_files=args.return_files)
-            
+            results = run_command("search_paper", {
+                "query": args.query,
+                "top_k": args.top_k,
+                "return_snippets": args.return_snippets,
+                "return_files": args.return_files,
+                "mode": args.mode,
+                "file_ranking": args.file_ranking,
+                "topic": [t.strip() for t in args.topic.split(",")] if args.topic else None,
+                "filename": args.filename,
+                "pages": args.pages,
+                "path_prefix": os.path.abspath(args.dir) if args.dir else None
+            }, use_daemon)
+
             print("\n--- Search Results ---")
             if "files" in results:
                 print("\n[Files]")
@@ -93,13 +171,18 @@ def main():
                     for i, doc_id in enumerate(snippets["ids"][0]):
                         text = snippets["documents"][0][i]
                         meta = snippets["metadatas"][0][i]
-                        print(f"{i+1}. {meta.get('filename')} (Page {meta.get('page_id')}): {text[:100].replace(chr(10), ' ')}...")
+                        pages = meta.get('page_id') if meta.get('page_end', meta.get('page_id')) == meta.get('page_id') else f"{meta.get('page_id')}-{meta.get('page_end')}"
+                        print(f"{i+1}. {meta.get('filename')} (Page {pages}): {text[:100].replace(chr(10), ' ')}...")
                 else:
                     print("No snippets found.")
 
         elif args.command == "search_image":
-            iss = ImageSearchService()
-            results = iss.search_image(args.query, top_k=args.top_k)
+            results = run_command("search_image", {
+                "query": args.query,
+                "top_k": args.top_k,
+                "filename": args.filename,
+                "path_prefix": os.path.abspath(args.dir) if args.dir else None
+            }, use_daemon)
             print("\n--- Image Search Results ---")
             if results and results["ids"] and results["ids"][0]:
                  for i, doc_id in enumerate(results["ids"][0]):
@@ -112,17 +195,18 @@ def main():
 
         elif args.command == "batch_organize":
             topics_list = [t.strip() for t in args.topics.split(",")] if args.topics else None
-            pm = PaperManager()
-            pm.batch_organize(args.root, topics_list)
+            batch_params = {"root": str(Path(args.root).resolve()), "topics": topics_list}
+            if args.spill:
+                batch_params["spill"] = True
+            if args.workers is not None:
+                batch_params["workers"] = args.workers
+            run_command("batch_organize", batch_params, use_daemon)
 
         elif args.command == "index_images":
-            iss = ImageSearchService()
-            target_dir = args.dir if args.dir else None
-            if target_dir:
-                iss.index_images(target_dir)
-            else:
-                iss.index_images() # Uses default config
-                # 使用默认配置
+            # Without --dir the default image directory from the config is used
+            # 未指定 --dir 时使用配置中的默认图片目录
+            target_dir = str(Path(args.dir).resolve()) if args.dir else None
+            run_command("index_images", {"dir": target_dir, "workers": args.workers}, use_daemon)
 
     except Exception as e:
         logger.error(f"Error executing command: {e}", exc_info=True)